@@ -0,0 +1,257 @@
+"""
+Shell pipelines that move app archives between the droplet and S3.
+
+Also installed on the droplet to benchmark the compression codecs against a
+sample of the real app directory:
+
+    python3 archive.py benchmark <app_dir> [--sample-mb N] [--codecs SPEC ...]
+"""
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+# tar's default record size, which its checkpoints count in
+TAR_RECORD_SIZE = 10240
+MB = 1024 * 1024
+
+
+class ArchiveException(Exception):
+    """ Base Exception class for file """
+
+
+class UnknownCodec(ArchiveException):
+    """ No codec with this name """
+
+
+class Codec(object):
+    """
+    A compressor the droplet can run as a pipeline stage. ``compress`` is a
+    template with a ``{level}`` placeholder.
+    """
+
+    def __init__(self, name, package, compress, decompress, default_level):
+        self.name = name
+        self.package = package
+        self.compress = compress
+        self.decompress = decompress
+        self.default_level = default_level
+
+    def compress_command(self, level=None):
+        return self.compress.format(level=level or self.default_level)
+
+    def decompress_command(self):
+        return self.decompress
+
+
+CODECS = {
+    "gzip": Codec("gzip", "gzip", "gzip -{level}", "gzip -dc", 6),
+    # the multi-threaded options use every core of the droplet
+    "pigz": Codec("pigz", "pigz", "pigz -{level}", "pigz -dc", 6),
+    "zstd": Codec("zstd", "zstd", "zstd -q -T0 -{level}", "zstd -q -dc", 3),
+    "lz4": Codec("lz4", "lz4", "lz4 -q -{level}", "lz4 -q -dc", 1),
+}
+DEFAULT_CODEC = "gzip"
+BENCHMARK_CODECS = ["gzip:6", "pigz:6", "zstd:1", "zstd:3", "zstd:9", "lz4:1"]
+
+
+def parse_codec(spec):
+    """ Splits a ``name[:level]`` spec such as ``zstd:3`` into codec and level """
+    name, _, level = (spec or DEFAULT_CODEC).partition(":")
+    if name not in CODECS:
+        raise UnknownCodec(f'Unknown codec "{name}", expected one of {list(CODECS)}')
+    return CODECS[name], int(level) if level else None
+
+
+def pipeline(*commands) -> str:
+    """ Joins ``commands`` with pipes, failing if any stage fails """
+    return "bash -o pipefail -c " + shlex.quote(" | ".join(commands))
+
+
+def stream_backup_command(
+    app_dir: str,
+    s3_url: str,
+    transfer: str,
+    metadata_file: str,
+    codec: str = DEFAULT_CODEC,
+    progress_every: int = 100 * 1024 * 1024,
+    rate_limit: int = 0,
+) -> str:
+    """
+    Archives ``app_dir`` straight into a multipart upload, so compression and
+    transfer overlap and nothing but a small metadata file is written to the
+    droplet's disk. The ``transfer`` script checksums the tar stream on the way
+    through, and the checksum and ``codec`` are uploaded next to the archive as
+    ``<s3_url>.json``. Progress goes to stderr as byte counts: tar's running
+    total every ``progress_every`` bytes, then tar's and dd's totals for the
+    raw and compressed streams. A ``rate_limit`` caps how fast tar's output is
+    consumed, in bytes per second.
+    """
+    compressor, level = parse_codec(codec)
+    checkpoint = max(1, progress_every // TAR_RECORD_SIZE)
+    upload = pipeline(
+        f"tar -C {shlex.quote(app_dir)} --totals --checkpoint={checkpoint}"
+        " --checkpoint-action=echo=%T -cf - .",
+        *_throttle(rate_limit),
+        f"python3 {transfer} digest --out {shlex.quote(metadata_file)}"
+        f" --field codec={shlex.quote(codec)}",
+        compressor.compress_command(level),
+        "dd bs=1M iflag=fullblock",
+        f"aws s3 cp --only-show-errors - {shlex.quote(s3_url)}",
+    )
+    return (
+        f"{upload} && aws s3 cp --only-show-errors"
+        f" {shlex.quote(metadata_file)} {shlex.quote(s3_url + '.json')}"
+    )
+
+
+def _throttle(rate_limit):
+    """ A pipeline stage limiting throughput, if there's a limit """
+    return [f"pv -q -L {rate_limit}"] if rate_limit else []
+
+
+def stream_restore_command(
+    archive_url: str,
+    app_dir: str,
+    transfer: str,
+    sha256: str = None,
+    codec: str = DEFAULT_CODEC,
+    part_size: int = 8 * 1024 * 1024,
+    workers: int = 8,
+) -> str:
+    """
+    Extracts the archive at ``archive_url`` (a presigned URL) into ``app_dir``
+    while it is still being fetched as parallel byte ranges. With ``sha256``,
+    the stream is verified on its way into tar and the pipeline fails on a
+    mismatch.
+    """
+    stages = [
+        f"python3 {transfer} get {shlex.quote(archive_url)}"
+        f" --part-size {part_size} --workers {workers}",
+        parse_codec(codec)[0].decompress_command(),
+    ]
+    if sha256:
+        stages.append(f"python3 {transfer} digest --expect {shlex.quote(sha256)}")
+    stages.append(f"tar -C {shlex.quote(app_dir)} -xf -")
+    return pipeline(*stages)
+
+
+def archive_backup_commands(
+    app_dir: str,
+    archive_file: str,
+    s3_url: str,
+    codec: str = DEFAULT_CODEC,
+    rate_limit: int = 0,
+):
+    """
+    Writes ``app_dir`` to a local archive, then uploads it and its metadata.
+    They're run in order, each only if the one before it succeeded
+    """
+    compressor, level = parse_codec(codec)
+    metadata = json.dumps({"codec": codec})
+    return [
+        pipeline(
+            f"tar -C {shlex.quote(app_dir)} -cvf - .",
+            *_throttle(rate_limit),
+            f"{compressor.compress_command(level)} > {shlex.quote(archive_file)}",
+        ),
+        f"aws s3 cp {shlex.quote(archive_file)} {shlex.quote(s3_url)}",
+        f"echo {shlex.quote(metadata)}"
+        f" | aws s3 cp - {shlex.quote(s3_url + '.json')}",
+    ]
+
+
+def archive_extract_command(archive_file: str, app_dir: str, codec=DEFAULT_CODEC):
+    """ Extracts a local archive with the codec it was written with """
+    return pipeline(
+        f"{parse_codec(codec)[0].decompress_command()} < {shlex.quote(archive_file)}",
+        f"tar -C {shlex.quote(app_dir)} -xvf -",
+    )
+
+
+def benchmark(app_dir, specs=None, sample_bytes=256 * MB, workdir="/tmp"):
+    """
+    Compresses the first ``sample_bytes`` of a tar of ``app_dir`` with each
+    codec spec and times compression and decompression. The sample is read
+    once before timing, so it comes from the page cache for every codec.
+    """
+    specs = specs or BENCHMARK_CODECS
+    sample = os.path.join(workdir, "auto_server_sample.tar")
+    compressed = sample + ".compressed"
+    # head closes the pipe early on big trees, so tar's exit status is ignored
+    subprocess.run(
+        f"tar -C {shlex.quote(app_dir)} -cf - . 2>/dev/null"
+        f" | head -c {sample_bytes} > {sample}",
+        shell=True,
+    )
+    size = os.path.getsize(sample)
+    results = []
+    try:
+        for spec in specs:
+            codec, level = parse_codec(spec)
+            start = time.monotonic()
+            subprocess.run(
+                f"{codec.compress_command(level)} < {sample} > {compressed}",
+                shell=True,
+                check=True,
+            )
+            compress_time = time.monotonic() - start
+            compressed_size = os.path.getsize(compressed)
+            start = time.monotonic()
+            subprocess.run(
+                f"{codec.decompress_command()} < {compressed} > /dev/null",
+                shell=True,
+                check=True,
+            )
+            decompress_time = time.monotonic() - start
+            results.append(
+                {
+                    "codec": spec,
+                    "sample_bytes": size,
+                    "ratio": round(size / max(compressed_size, 1), 3),
+                    "compress_mb_s": round(size / MB / max(compress_time, 1e-6), 1),
+                    "decompress_mb_s": round(
+                        size / MB / max(decompress_time, 1e-6), 1
+                    ),
+                }
+            )
+    finally:
+        for path in (sample, compressed):
+            if os.path.exists(path):
+                os.remove(path)
+    return results
+
+
+def format_benchmark(results):
+    """ Lays out ``benchmark`` results as a table """
+    row = (
+        "{codec:<10} {ratio:>5.2f}   {compress_mb_s:>13.1f}   {decompress_mb_s:>15.1f}"
+    )
+    lines = ["codec      ratio   compress MB/s   decompress MB/s"]
+    lines.extend(row.format(**result) for result in results)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command")
+    benchmark_parser = commands.add_parser("benchmark")
+    benchmark_parser.add_argument("app_dir")
+    benchmark_parser.add_argument("--sample-mb", type=int, default=256)
+    benchmark_parser.add_argument("--codecs", nargs="+", default=BENCHMARK_CODECS)
+    benchmark_parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command == "benchmark":
+        results = benchmark(args.app_dir, args.codecs, args.sample_mb * MB)
+        print(json.dumps(results) if args.json else format_benchmark(results))
+    else:
+        parser.error("a command is required")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,435 @@
+"""
+Content-defined chunking and deduplicated storage for app directory backups.
+
+Runs on the droplet, so it sticks to what the stock image's python3 offers
+(plus boto3 and numpy from apt, the latter only to chunk faster):
+
+    python3 chunkstore.py backup <app_dir> <bucket> <prefix> [--keep N] [--rate-limit B]
+    python3 chunkstore.py restore <app_dir> <bucket> <prefix> [manifest] [--missing-ok]
+    python3 chunkstore.py prune <bucket> <prefix> <keep>
+
+Files are split at content-defined boundaries, so an edit only changes the
+chunks around it. Chunks are stored once under ``<prefix>/chunks/<sha256>``,
+and each backup is a small manifest under ``<prefix>/manifests/`` listing the
+chunks of every file. Keeping an old restore point costs only its manifest
+plus the chunks no newer backup shares.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy
+except ImportError:  # hashed a byte at a time instead, to the same boundaries
+    numpy = None
+
+MANIFEST_VERSION = 1
+CHUNKS = "chunks/"
+MANIFESTS = "manifests/"
+
+MASK_64 = (1 << 64) - 1
+# fixed pseudo-random table for the gear hash; must never change, or every
+# chunk boundary moves and deduplication against old backups is lost
+GEAR = [
+    int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)
+]
+# bytes hashed per step when vectorised: boundaries come every few hundred KB,
+# so most chunks are found without hashing much past them
+HASH_BLOCK = 128 * 1024
+GEAR_ARRAY = numpy.array(GEAR, dtype=numpy.uint64) if numpy is not None else None
+
+
+class ChunkStoreException(Exception):
+    """ Base Exception class for file """
+
+
+class ManifestNotFound(ChunkStoreException):
+    """ There is no backup manifest to restore from """
+
+
+class Chunker(object):
+    """
+    Gear-hash chunker. Boundaries are cut where the rolling hash has its top
+    bits clear, never before ``min_size`` bytes (those are skipped without
+    hashing) and always by ``max_size`` bytes.
+
+    With numpy the hash is computed a block at a time, about fifteen times
+    faster than byte by byte, and cuts in exactly the same places.
+    """
+
+    def __init__(
+        self, min_size=256 * 1024, avg_size=1024 * 1024, max_size=4096 * 1024
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        bits = max(1, (avg_size - min_size).bit_length() - 1)
+        self.mask = ((1 << bits) - 1) << (64 - bits)
+
+    def cut(self, data, start):
+        """ Length of the chunk beginning at ``start`` in ``data`` """
+        remaining = len(data) - start
+        if remaining <= self.min_size:
+            return remaining
+        end = start + min(remaining, self.max_size)
+        if numpy is not None:
+            return self._cut_blocks(data, start, end)
+        h = 0
+        mask = self.mask
+        gear = GEAR
+        for i in range(start + self.min_size, end):
+            h = ((h << 1) + gear[data[i]]) & MASK_64
+            if not h & mask:
+                return i + 1 - start
+        return end - start
+
+    def _cut_blocks(self, data, start, end):
+        """
+        ``cut`` with numpy. After 64 bytes a byte has been shifted out of the
+        hash, so the hash at ``i`` is the sum of ``GEAR[data[i - k]] << k`` for
+        ``k`` below 64, mod 2**64. Sums of 1, 2, 4 ... 64 terms are built by
+        doubling, and each block carries the 63 bytes before it.
+        """
+        hashed = start + self.min_size
+        mask = numpy.uint64(self.mask)
+        for block in range(hashed, end, HASH_BLOCK):
+            first = max(hashed, block - 63)
+            last = min(end, block + HASH_BLOCK)
+            h = GEAR_ARRAY[numpy.frombuffer(data, numpy.uint8, last - first, first)]
+            for shift in (1, 2, 4, 8, 16, 32):
+                h[shift:] += h[:-shift] << numpy.uint64(shift)
+            cuts = numpy.flatnonzero((h[block - first :] & mask) == 0)
+            if cuts.size:
+                return block + int(cuts[0]) + 1 - start
+        return end - start
+
+    def chunks(self, stream, read_size=None):
+        """ Yields the content-defined chunks of a binary file object """
+        read_size = read_size or self.max_size * 2
+        buffer = b""
+        eof = False
+        while True:
+            while not eof and len(buffer) < self.max_size:
+                data = stream.read(read_size)
+                if not data:
+                    eof = True
+                buffer += data
+            if not buffer:
+                return
+            length = self.cut(buffer, 0)
+            yield buffer[:length]
+            buffer = buffer[length:]
+
+
+class DirectoryStore(object):
+    """ Keeps objects as files under a local directory """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def list(self, prefix):
+        base = self._path(prefix)
+        if not os.path.isdir(base):
+            return []
+        return sorted(prefix + name for name in os.listdir(base))
+
+    def get(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def delete(self, keys):
+        for key in keys:
+            os.remove(self._path(key))
+
+
+class S3Store(object):
+    """ Keeps objects under a prefix of an S3 bucket """
+
+    def __init__(self, bucket, prefix):
+        import boto3
+
+        self.client = boto3.client("s3")
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/") + "/"
+
+    def list(self, prefix):
+        paginator = self.client.get_paginator("list_objects_v2")
+        keys = []
+        pages = paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix)
+        for page in pages:
+            keys.extend(
+                item["Key"][len(self.prefix) :] for item in page.get("Contents", [])
+            )
+        return sorted(keys)
+
+    def get(self, key):
+        response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        return response["Body"].read()
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def delete(self, keys):
+        keys = list(keys)
+        for i in range(0, len(keys), 1000):
+            objects = [{"Key": self.prefix + key} for key in keys[i : i + 1000]]
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects})
+
+
+class Throttle(object):
+    """ Sleeps as needed to keep reads under ``rate`` bytes per second """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.total = 0
+
+    def consume(self, size):
+        if not self.rate:
+            return
+        self.total += size
+        ahead = self.total / self.rate - (time.monotonic() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def _walk(root):
+    """ Yields (relative path, lstat) for everything under ``root``, sorted """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in dirnames + sorted(filenames):
+            path = os.path.join(dirpath, name)
+            yield os.path.relpath(path, root), os.lstat(path)
+
+
+def latest_manifest(store):
+    """ Name of the newest manifest, or None """
+    names = store.list(MANIFESTS)
+    return names[-1] if names else None
+
+
+def load_manifest(store, name=None):
+    name = name or latest_manifest(store)
+    if name is None:
+        raise ManifestNotFound("No backups have been made yet")
+    return json.loads(store.get(name).decode())
+
+
+def backup(root, store, chunker=None, workers=8, level=3, rate_limit=0):
+    """
+    Stores every file under ``root`` that isn't already in ``store`` and writes
+    a new manifest. Files whose size and mtime match the previous manifest reuse
+    its chunk list without being read. With ``rate_limit``, files are read at
+    no more than that many bytes per second.
+    """
+    chunker = chunker or Chunker()
+    throttle = Throttle(rate_limit)
+    known = {key[len(CHUNKS) :] for key in store.list(CHUNKS)}
+    try:
+        previous = {entry["path"]: entry for entry in load_manifest(store)["entries"]}
+    except ManifestNotFound:
+        previous = {}
+
+    stats = {"files": 0, "bytes": 0, "read": 0, "chunks": 0, "uploaded": 0}
+    entries = []
+    in_flight = set()
+
+    def upload(digest, data):
+        compressed = zlib.compress(data, level)
+        store.put(CHUNKS + digest, compressed)
+        return len(compressed)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # bounded, so chunking can't run ahead of the network and hold the
+        # whole world in memory
+        uploads = deque()
+        for path, st in _walk(root):
+            entry = {"path": path, "mode": stat.S_IMODE(st.st_mode)}
+            if stat.S_ISDIR(st.st_mode):
+                entry["type"] = "dir"
+            elif stat.S_ISLNK(st.st_mode):
+                entry["type"] = "link"
+                entry["target"] = os.readlink(os.path.join(root, path))
+            elif stat.S_ISREG(st.st_mode):
+                entry.update(type="file", size=st.st_size, mtime=st.st_mtime)
+                stats["files"] += 1
+                stats["bytes"] += st.st_size
+                old = previous.get(path)
+                if (
+                    old
+                    and old.get("size") == st.st_size
+                    and old.get("mtime") == st.st_mtime
+                    and all(c in known for c in old["chunks"])
+                ):
+                    entry["chunks"] = old["chunks"]
+                else:
+                    entry["chunks"] = []
+                    with open(os.path.join(root, path), "rb") as f:
+                        for data in chunker.chunks(f):
+                            digest = hashlib.sha256(data).hexdigest()
+                            entry["chunks"].append(digest)
+                            stats["read"] += len(data)
+                            throttle.consume(len(data))
+                            if digest not in known and digest not in in_flight:
+                                in_flight.add(digest)
+                                uploads.append(executor.submit(upload, digest, data))
+                                if len(uploads) > workers * 2:
+                                    stats["uploaded"] += uploads.popleft().result()
+            else:
+                continue
+            entries.append(entry)
+        for future in uploads:
+            stats["uploaded"] += future.result()
+    stats["chunks"] = len(in_flight)
+
+    created = time.time()
+    name = "{}{}.{:06d}Z.json".format(
+        MANIFESTS,
+        time.strftime("%Y%m%dT%H%M%S", time.gmtime(created)),
+        int(created % 1 * 1000000),
+    )
+    manifest = {"version": MANIFEST_VERSION, "created": created, "entries": entries}
+    store.put(name, json.dumps(manifest, separators=(",", ":")).encode())
+    stats["manifest"] = name
+    return stats
+
+
+def _remove(path):
+    """ Removes whatever is at ``path``, not following symlinks """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _remove_unlisted(root, listed) -> int:
+    """ Removes what's under ``root`` but not in ``listed``, returning the count """
+    removed = 0
+    for directory, subdirectories, files in os.walk(root, topdown=False):
+        for name in files + subdirectories:
+            path = os.path.join(directory, name)
+            if os.path.relpath(path, root) not in listed:
+                _remove(path)
+                removed += 1
+    return removed
+
+
+def restore(root, store, name=None, workers=8):
+    """
+    Rebuilds ``root`` from a manifest, the newest one by default. Anything
+    under ``root`` the manifest doesn't list, such as a region file made since
+    the backup, is removed
+    """
+    manifest = load_manifest(store, name)
+    stats = {"files": 0, "bytes": 0}
+
+    def fetch(digest):
+        return zlib.decompress(store.get(CHUNKS + digest))
+
+    os.makedirs(root, exist_ok=True)
+    stats["removed"] = _remove_unlisted(
+        root, {os.path.normpath(entry["path"]) for entry in manifest["entries"]}
+    )
+    directories = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for entry in manifest["entries"]:
+            path = os.path.join(root, entry["path"])
+            if entry["type"] == "dir":
+                if not os.path.isdir(path) or os.path.islink(path):
+                    _remove(path)
+                os.makedirs(path, exist_ok=True)
+                directories.append((path, entry["mode"]))
+            elif entry["type"] == "link":
+                _remove(path)
+                os.symlink(entry["target"], path)
+            else:
+                # written afresh, never through a symlink left at the path
+                _remove(path)
+                with open(path, "xb") as f:
+                    for data in executor.map(fetch, entry["chunks"]):
+                        f.write(data)
+                os.chmod(path, entry["mode"])
+                os.utime(path, (entry["mtime"], entry["mtime"]))
+                stats["files"] += 1
+                stats["bytes"] += entry["size"]
+    # only after their contents are written, in case a mode is read-only
+    for path, mode in reversed(directories):
+        os.chmod(path, mode)
+    return stats
+
+
+def prune(store, keep):
+    """ Drops all but the newest ``keep`` manifests and any chunks they don't use """
+    names = store.list(MANIFESTS)
+    expired = names[:-keep] if keep > 0 else []
+    if not expired:
+        return {"manifests": 0, "chunks": 0}
+    used = set()
+    for name in names[len(expired) :]:
+        for entry in json.loads(store.get(name).decode())["entries"]:
+            used.update(entry.get("chunks", []))
+    unused = [key for key in store.list(CHUNKS) if key[len(CHUNKS) :] not in used]
+    store.delete(expired)
+    store.delete(unused)
+    return {"manifests": len(expired), "chunks": len(unused)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command")
+    backup_parser = commands.add_parser("backup")
+    backup_parser.add_argument("app_dir")
+    backup_parser.add_argument("bucket")
+    backup_parser.add_argument("prefix")
+    backup_parser.add_argument("--keep", type=int, default=0)
+    backup_parser.add_argument("--rate-limit", type=int, default=0)
+    restore_parser = commands.add_parser("restore")
+    restore_parser.add_argument("app_dir")
+    restore_parser.add_argument("bucket")
+    restore_parser.add_argument("prefix")
+    restore_parser.add_argument("manifest", nargs="?")
+    restore_parser.add_argument("--missing-ok", action="store_true")
+    prune_parser = commands.add_parser("prune")
+    prune_parser.add_argument("bucket")
+    prune_parser.add_argument("prefix")
+    prune_parser.add_argument("keep", type=int)
+    args = parser.parse_args(argv)
+
+    store = S3Store(args.bucket, args.prefix)
+    if args.command == "backup":
+        result = backup(args.app_dir, store, rate_limit=args.rate_limit)
+        if args.keep:
+            result["pruned"] = prune(store, args.keep)
+    elif args.command == "restore":
+        try:
+            result = restore(args.app_dir, store, args.manifest)
+        except ManifestNotFound:
+            if not args.missing_ok:
+                raise
+            result = {"files": 0, "bytes": 0}
+    elif args.command == "prune":
+        result = prune(store, args.keep)
+    else:
+        parser.error("a command is required")
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
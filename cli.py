@@ -3,26 +3,69 @@ import json
 import sys
 
 import settings
+import tracing
 from lambda_function import controller, lambda_handler
 
 
 def main():
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s app_name action [--wait] | %(prog)s action --all|--tag TAG"
+    )
     parser.add_argument("app_name", type=str, help="App service to act upon")
     parser.add_argument(
-        "action", type=str, help="Action to perform", choices=controller.actions
+        "action",
+        type=str,
+        nargs="?",
+        help="Action to perform",
+        choices=controller.actions,
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="Act upon every app in the fleet"
+    )
+    parser.add_argument("--tag", help="Act upon every app with this droplet tag")
+    parser.add_argument(
+        "--parallelism", type=int, help="How many apps to act upon at once"
+    )
+    parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="Run the action to completion rather than as a job",
+    )
+    parser.add_argument(
+        "--trace", action="store_true", help="Show where the action's time went"
     )
 
     args, body = parser.parse_known_args()
-    if body:
-        body = " ".join(body)
+    body = " ".join(body)
 
-    action = {"action": args.action, "app_name": args.app_name, "body": body}
+    if args.all or args.tag:
+        # there's no app name, just the action
+        if args.action is not None or args.app_name not in controller.actions:
+            parser.error("give only an action with --all or --tag")
+        action = {
+            "action": args.app_name,
+            "all": args.all,
+            "tag": args.tag,
+            "parallelism": args.parallelism,
+            "body": body,
+            "wait": args.wait,
+        }
+    else:
+        if args.action is None:
+            parser.error("the following arguments are required: action")
+        action = {
+            "action": args.action,
+            "app_name": args.app_name,
+            "body": body,
+            "wait": args.wait,
+        }
     context = {}
 
     result = lambda_handler(action, context)
     message = result.get("message")
     print(message or "No response")
+    if args.trace and result.get("trace"):
+        print(tracing.describe(result["trace"]))
 
 
 if __name__ == "__main__":
@@ -1 +1,170 @@
+import io
+import itertools
+import os
+import stat
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+
 import pytest
+from botocore.exceptions import ClientError
+
+
+@pytest.fixture
+def fake_aws(tmp_path, monkeypatch):
+    """
+    An ``aws`` on PATH whose ``s3 cp`` copies a file, or stdin for ``-``, into
+    the returned directory under the destination's base name
+    """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    script = bin_dir / "aws"
+    script.write_text(
+        "#!/bin/sh\n"
+        'for arg; do src="$dst"; dst="$arg"; done\n'
+        f'out="{uploads}/$(basename "$dst")"\n'
+        'if [ "$src" = "-" ]; then cat > "$out"; else cp "$src" "$out"; fi\n'
+    )
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return uploads
+
+
+class FakeS3Object(object):
+    """ Stands in for a boto3 ``Object``, checking S3's request conditions """
+
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+
+    def _check(self, operation, IfMatch=None, IfNoneMatch=None):
+        """ Records the request, raising the error S3 would answer it with """
+        conditions = {"IfMatch": IfMatch, "IfNoneMatch": IfNoneMatch}
+        conditions = {name: value for name, value in conditions.items() if value}
+        self.bucket.requests.append((operation, self.key, conditions))
+        if self.key in self.bucket.errors:
+            raise s3_error(self.bucket.errors[self.key])
+        etag = self.bucket.stored.get(self.key, (None, None))[1]
+        if operation == "get":
+            if etag is None:
+                raise s3_error("NoSuchKey")
+            if IfNoneMatch == etag:
+                raise s3_error("304")
+        elif IfNoneMatch == "*" and etag is not None:
+            raise s3_error("PreconditionFailed")
+        if IfMatch is not None and IfMatch != etag:
+            raise s3_error("PreconditionFailed")
+
+    def get(self, **conditions):
+        with self.bucket.lock:
+            self._check("get", **conditions)
+            body, etag = self.bucket.stored[self.key]
+        return {"Body": io.BytesIO(body), "ETag": etag}
+
+    def put(self, Body, ContentType=None, **conditions):
+        with self.bucket.lock:
+            self._check("put", **conditions)
+            etag = f'"{next(self.bucket.etags)}"'
+            self.bucket.stored[self.key] = (Body, etag)
+        return {"ETag": etag}
+
+    def delete(self, **conditions):
+        with self.bucket.lock:
+            self._check("delete", **conditions)
+            self.bucket.stored.pop(self.key, None)
+
+
+class FakeS3Objects(object):
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def filter(self, Prefix):
+        return [
+            FakeS3Object(self.bucket, key)
+            for key in sorted(self.bucket.stored)
+            if key.startswith(Prefix)
+        ]
+
+
+class FakeS3Bucket(object):
+    """
+    Stands in for a boto3 ``Bucket``, with S3's conditional requests. Every
+    request is kept in ``requests`` as ``(operation, key, conditions)``, and
+    a key in ``errors`` fails its requests with that error code
+    """
+
+    def __init__(self):
+        self.stored = {}
+        self.requests = []
+        self.errors = {}
+        self.etags = itertools.count(1)
+        self.lock = threading.Lock()
+        self.objects = FakeS3Objects(self)
+        events = SimpleNamespace(register=lambda *args, **kwargs: None)
+        self.meta = SimpleNamespace(
+            client=SimpleNamespace(meta=SimpleNamespace(events=events))
+        )
+
+    def Object(self, key):
+        return FakeS3Object(self, key)
+
+    def body(self, key):
+        """ What's stored at ``key``, or None """
+        return self.stored.get(key, (None, None))[0]
+
+    def count(self, operation, key):
+        return sum(request[:2] == (operation, key) for request in self.requests)
+
+
+def s3_error(code):
+    return ClientError({"Error": {"Code": code}}, "Operation")
+
+
+@pytest.fixture
+def s3_bucket():
+    """ A fresh ``FakeS3Bucket`` """
+    return FakeS3Bucket()
+
+
+@pytest.fixture
+def range_server(tmp_path):
+    """
+    Serves files from the returned ``(directory, base_url)`` with support for
+    single ``Range: bytes=a-b`` requests, the way S3 answers presigned GETs
+    """
+    root = tmp_path / "served"
+    root.mkdir()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = root / self.path.lstrip("/").split("?")[0]
+            if not path.is_file():
+                self.send_error(404)
+                return
+            data = path.read_bytes()
+            requested = self.headers.get("Range")
+            if not requested:
+                self.send_response(200)
+            else:
+                start, end = (int(x) for x in requested.split("=")[1].split("-"))
+                if start >= len(data):
+                    self.send_error(416)
+                    return
+                end = min(end, len(data) - 1)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+                data = data[start : end + 1]
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield root, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
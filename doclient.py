@@ -0,0 +1,289 @@
+"""
+A shared layer under every python-digitalocean call in the process.
+
+python-digitalocean sends every request through one private method,
+``BaseAPI.__perform_request``; ``install`` wraps it so that requests:
+
+* wait on a token bucket, slowed down as ``Ratelimit-Remaining`` runs low
+* are retried with jittered exponential backoff on 429s, on 5xx responses and
+  connection errors for GETs, honouring ``Retry-After``
+* share one response when an identical GET is already in flight
+* are counted per endpoint, with latency and errors
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+import lazy
+import tracing
+
+# not needed until a client is installed or a request is sent
+baseapi = lazy.module("digitalocean.baseapi")
+requests = lazy.module("requests")
+
+# path segments that are IDs: numbers, or UUIDs for volumes and the like
+ID_SEGMENT = re.compile(r"/[0-9a-f-]*\d[0-9a-f-]*(?=/|$)")
+
+
+class DOClientException(Exception):
+    """ Base Exception class for file """
+
+
+class TokenBucket(object):
+    """
+    Allows bursts of up to ``capacity`` requests, refilling at ``rate`` per
+    second. The rate drops to what's left of the account's allowance when the
+    API reports it running low.
+    """
+
+    def __init__(self, capacity: float, rate: float, clock=time.monotonic):
+        self.capacity = capacity
+        self.max_rate = rate
+        self.rate = rate
+        self.tokens = capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        refilled = self.tokens + (now - self._updated) * self.rate
+        self.tokens = min(self.capacity, refilled)
+        self._updated = now
+
+    def wait_time(self) -> float:
+        """ Takes a token, returning how long to sleep before using it """
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, sleep=time.sleep) -> float:
+        """ Takes a token, sleeping until it can be used. Returns the sleep """
+        delay = self.wait_time()
+        if delay:
+            sleep(delay)
+        return delay
+
+    def update(self, remaining: int, reset_at: float, now: float = None):
+        """
+        Spreads the ``remaining`` requests over the time until ``reset_at`` (an
+        epoch timestamp), when that's slower than the configured rate
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._refill()
+            window = max(reset_at - now, 1.0)
+            self.rate = max(min(self.max_rate, remaining / window), 1.0 / window)
+            self.tokens = min(self.tokens, remaining)
+
+
+def backoff_delays(tries: int, base: float = 0.5, cap: float = 30.0, rng=random):
+    """ "Full jitter" exponential backoff: each delay is random in [0, ceiling) """
+    return [rng.uniform(0, min(cap, base * 2 ** n)) for n in range(tries)]
+
+
+class Coalescer(object):
+    """ Runs one call per key at a time, handing its result to everyone waiting """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def run(self, key, function):
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = function()
+        except BaseException as error:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+        future.set_result(result)
+        return result
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "coalesced": self.coalesced,
+            "mean_ms": round(1000 * self.total_seconds / max(self.calls, 1), 1),
+            "max_ms": round(1000 * self.max_seconds, 1),
+        }
+
+
+class Metrics(object):
+    """ Per-endpoint counters, keyed like ``GET droplets/:id`` """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+
+    @staticmethod
+    def endpoint(method: str, url: str) -> str:
+        path = url.split("://", 1)[-1].split("?", 1)[0]
+        path = path.split("/v2/", 1)[-1].strip("/")
+        return f"{method} {ID_SEGMENT.sub('/:id', path)}"
+
+    def record(self, endpoint: str, seconds: float = None, error=False, **counts):
+        """ Counts a call that took ``seconds``, and/or increments ``counts`` """
+        with self._lock:
+            stats = self.endpoints.setdefault(endpoint, EndpointStats())
+            if seconds is not None:
+                stats.calls += 1
+                stats.total_seconds += seconds
+                stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.errors += bool(error)
+            for name, count in counts.items():
+                setattr(stats, name, getattr(stats, name) + count)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self.endpoints.items()}
+
+    def summary(self) -> str:
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+
+class Client(object):
+    """ Rate limiting, retries, coalescing and metrics for DigitalOcean calls """
+
+    # responses worth retrying; only 429s are safe to retry for writes
+    RETRY_ANY = {429}
+    RETRY_READS = {500, 502, 503, 504}
+
+    def __init__(
+        self, burst=10, rate_per_minute=250, max_retries=5, sleep=time.sleep
+    ):
+        self.bucket = TokenBucket(burst, rate_per_minute / 60.0)
+        self.coalescer = Coalescer()
+        self.metrics = Metrics()
+        self.max_retries = max_retries
+        self._sleep = sleep
+
+    def request(self, send, method: str, url: str, params, tokens=()):
+        """ Sends a request with ``send(url, method, params)`` """
+        endpoint = self.metrics.endpoint(method, url)
+        if method != baseapi.GET:
+            return self._send(send, endpoint, method, url, params)
+        key = (url, json.dumps(params, sort_keys=True, default=str), tuple(tokens))
+        sent = []
+
+        def send_once():
+            sent.append(True)
+            return self._send(send, endpoint, method, url, params)
+
+        response = self.coalescer.run(key, send_once)
+        if not sent:
+            self.metrics.record(endpoint, coalesced=1)
+        return response
+
+    def _send(self, send, endpoint, method, url, params):
+        read = method == baseapi.GET
+        delays = backoff_delays(self.max_retries)
+        for attempt in range(self.max_retries + 1):
+            span = tracing.start_span(
+                "digitalocean", endpoint=endpoint, attempt=attempt + 1
+            )
+            throttled = self.bucket.acquire(self._sleep)
+            if throttled:
+                span.set(throttled_seconds=round(throttled, 3))
+            start = time.monotonic()
+            try:
+                response = send(url, method, params)
+            except requests.ConnectionError as error:
+                self.metrics.record(endpoint, time.monotonic() - start, error=True)
+                span.end(error=error)
+                if not read or attempt == self.max_retries:
+                    raise
+                self.metrics.record(endpoint, retries=1)
+                self._sleep(delays[attempt])
+                continue
+
+            status = response.status_code
+            elapsed = time.monotonic() - start
+            span.end(status=status, error=f"HTTP {status}" if status >= 400 else None)
+            self.metrics.record(endpoint, elapsed, error=status >= 400)
+            self._update_limits(response.headers)
+            retryable = status in self.RETRY_ANY or (
+                read and status in self.RETRY_READS
+            )
+            if not retryable or attempt == self.max_retries:
+                return response
+            self.metrics.record(endpoint, retries=1)
+            self._sleep(max(delays[attempt], self._retry_after(response.headers)))
+        return response
+
+    def _update_limits(self, headers):
+        remaining = headers.get("Ratelimit-Remaining")
+        reset = headers.get("Ratelimit-Reset")
+        if remaining is not None and reset is not None:
+            try:
+                self.bucket.update(int(remaining), float(reset))
+            except ValueError:
+                pass
+
+    @staticmethod
+    def _retry_after(headers) -> float:
+        try:
+            return min(float(headers.get("Retry-After", 0)), 60.0)
+        except ValueError:
+            return 0.0
+
+
+_client = None
+_install_lock = threading.Lock()
+
+
+def install(**options) -> Client:
+    """
+    Routes every python-digitalocean request in the process through one
+    ``Client``, returning it. Later calls return the same client.
+    """
+    global _client
+    with _install_lock:
+        if _client is None:
+            _client = Client(**options)
+            send = baseapi.BaseAPI._BaseAPI__perform_request
+
+            def perform_request(api, url, type=baseapi.GET, params=None):
+                return _client.request(
+                    lambda u, m, p: send(api, u, m, p),
+                    type,
+                    url,
+                    params,
+                    tokens=api.tokens,
+                )
+
+            baseapi.BaseAPI._BaseAPI__perform_request = perform_request
+    return _client
+
+
+def installed():
+    """ The client ``install`` made, or None if there hasn't been one yet """
+    return _client
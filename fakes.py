@@ -0,0 +1,662 @@
+"""
+Local stand-ins for the services the controller drives, so whole actions can
+be run and timed without an account anywhere:
+
+* ``FakeDigitalOcean``, an HTTP server speaking enough of DigitalOcean's API
+  for creating, finding, tagging and destroying droplets and SSH keys, with
+  configurable delays before a droplet boots and is given an address
+* ``FakeS3``, an HTTP server speaking enough of S3's REST API for boto3 and
+  presigned URLs: objects, listing, and conditional reads and writes
+* ``FakeSSHServer``, a paramiko server whose "droplet" takes a configurable
+  time per command and prints a configurable amount of output. It keeps files
+  written with ``echo`` and serves them back with ``cat``, and its ``aws s3
+  cp`` and ``curl`` move bytes to and from the ``FakeS3`` it's given
+
+Each counts what it was asked to do, for reporting API calls and bytes moved.
+Block storage volumes aren't faked, so ``PERSISTENCE=volume`` can't be run.
+"""
+
+import collections
+import hashlib
+import json
+import re
+import shlex
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+import paramiko
+
+import keys
+
+# path segments that are IDs, so calls are counted per endpoint
+ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+# what the fake droplet's HTTP requests identify as, to count them apart
+DROPLET_AGENT = "fake-droplet"
+
+
+class FakeException(Exception):
+    """ Base Exception class for file """
+
+
+class _Server(object):
+    """ An HTTP server on a free local port, serving from a thread """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self._httpd = None
+
+    def _handler(self):
+        raise NotImplementedError
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_port}"
+
+    def count(self, name: str):
+        with self.lock:
+            self.calls[name] += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keeps connections open, as clients' sessions expect
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if not size:
+                    # trailing headers, up to a blank line
+                    while self.rfile.readline().strip():
+                        pass
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "aws-chunked" in self.headers.get("Content-Encoding", ""):
+            body = _decode_aws_chunked(body)
+        return body
+
+    def reply(self, status: int, body: bytes = b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if "Content-Length" not in (headers or {}):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    """ The payload of a body in S3's ``aws-chunked`` encoding """
+    data, position = b"", 0
+    while True:
+        end = body.index(b"\r\n", position)
+        size = int(body[position:end].split(b";")[0], 16)
+        if not size:
+            return data
+        data += body[end + 2 : end + 2 + size]
+        position = end + 2 + size + 2
+
+
+class FakeDigitalOcean(_Server):
+    """
+    DigitalOcean's API for droplets, SSH keys, tags, images, sizes and
+    actions. A new droplet's create action completes ``boot_delay`` seconds
+    after it was requested, it's given ``droplet_ip`` after ``ip_delay``
+    seconds, and a destroyed one is gone ``destroy_delay`` seconds later.
+    Point python-digitalocean at ``url`` with ``DIGITALOCEAN_END_POINT``.
+    """
+
+    def __init__(
+        self,
+        boot_delay: float = 1.0,
+        ip_delay: float = 0.5,
+        destroy_delay: float = 0.5,
+        action_delay: float = 0.5,
+        droplet_ip: str = "127.0.0.1",
+        clock=time.monotonic,
+    ):
+        super().__init__()
+        self.boot_delay = boot_delay
+        self.ip_delay = ip_delay
+        self.destroy_delay = destroy_delay
+        self.action_delay = action_delay
+        self.droplet_ip = droplet_ip
+        self.clock = clock
+        self.droplets = {}
+        self.ssh_keys = {}
+        self.actions = {}
+        self.tags = set()
+        self._ids = iter(range(1000, 10 ** 9))
+
+    def _handler(self):
+        fake = self
+
+        class Handler(_Handler):
+            def do_GET(self):
+                fake._handle(self)
+
+            do_POST = do_PUT = do_DELETE = do_GET
+
+        return Handler
+
+    def _handle(self, request):
+        url = urllib.parse.urlsplit(request.path)
+        path = url.path.split("/v2/", 1)[-1].strip("/")
+        query = dict(urllib.parse.parse_qsl(url.query))
+        body = request.read_body()
+        params = json.loads(body) if body else {}
+        self.count(f"{request.command} {ID_SEGMENT.sub('/:id', '/' + path)}")
+        with self.lock:
+            status, response = self._route(request.command, path, query, params)
+        data = b"" if response is None else json.dumps(response).encode()
+        request.reply(
+            status,
+            data,
+            {"Content-Type": "application/json", "Ratelimit-Remaining": "5000"},
+        )
+
+    def _route(self, method, path, query, params):
+        parts = path.split("/")
+        now = self.clock()
+        if parts[0] == "droplets":
+            if len(parts) == 1 and method == "GET":
+                droplets = [
+                    self._droplet(d, now)
+                    for d in self.droplets.values()
+                    if self._exists(d, now)
+                    and query.get("tag_name") in (None, *d["tags"])
+                ]
+                return 200, {"droplets": droplets, "links": {}, "meta": {}}
+            if len(parts) == 1 and method == "POST":
+                return 202, self._create_droplet(params, now)
+            droplet = self.droplets.get(int(parts[1]))
+            if droplet is None or not self._exists(droplet, now):
+                return self._not_found()
+            if len(parts) == 2 and method == "GET":
+                return 200, {"droplet": self._droplet(droplet, now)}
+            if len(parts) == 2 and method == "DELETE":
+                droplet.setdefault("destroyed", now)
+                return 204, None
+            if len(parts) == 3 and method == "POST":
+                action = self._action(params.get("type"), droplet["id"], now)
+                return 201, {"action": self._action_view(action, now)}
+        if parts[0] == "actions" and len(parts) == 2:
+            action = self.actions.get(int(parts[1]))
+            if action is None:
+                return self._not_found()
+            return 200, {"action": self._action_view(action, now)}
+        if parts[:2] == ["account", "keys"]:
+            return self._route_keys(method, parts[2:], params)
+        if parts[0] == "tags":
+            if len(parts) == 1 and method == "POST":
+                self.tags.add(params["name"])
+                return 201, {"tag": {"name": params["name"], "resources": {}}}
+            if len(parts) == 3 and parts[2] == "resources":
+                for resource in params.get("resources", []):
+                    droplet = self.droplets.get(int(resource["resource_id"]))
+                    if droplet is None:
+                        continue
+                    if method == "POST" and parts[1] not in droplet["tags"]:
+                        droplet["tags"].append(parts[1])
+                    if method == "DELETE" and parts[1] in droplet["tags"]:
+                        droplet["tags"].remove(parts[1])
+                return 204, None
+        if parts[0] == "images" and method == "GET":
+            return 200, {"images": [], "links": {}, "meta": {}}
+        if parts[0] == "sizes" and method == "GET":
+            sizes = [{"slug": "4gb", "price_monthly": 20.0, "regions": []}]
+            return 200, {"sizes": sizes, "links": {}, "meta": {}}
+        return self._not_found()
+
+    def _route_keys(self, method, parts, params):
+        if not parts and method == "GET":
+            keys = list(self.ssh_keys.values())
+            return 200, {"ssh_keys": keys, "links": {}, "meta": {}}
+        if not parts and method == "POST":
+            key_id = next(self._ids)
+            blob = params["public_key"].split()[1].encode()
+            digest = hashlib.md5(blob).hexdigest()
+            self.ssh_keys[key_id] = {
+                "id": key_id,
+                "name": params["name"],
+                "public_key": params["public_key"],
+                "fingerprint": ":".join(
+                    digest[i : i + 2] for i in range(0, len(digest), 2)
+                ),
+            }
+            return 201, {"ssh_key": self.ssh_keys[key_id]}
+        key = self.ssh_keys.get(int(parts[0])) if parts[0].isdigit() else None
+        if key is None:
+            return self._not_found()
+        if method == "DELETE":
+            del self.ssh_keys[key["id"]]
+            return 204, None
+        return 200, {"ssh_key": key}
+
+    def _create_droplet(self, params, now):
+        droplet_id = next(self._ids)
+        self.droplets[droplet_id] = {
+            "id": droplet_id,
+            "name": params["name"],
+            "size_slug": params.get("size"),
+            "image": params.get("image"),
+            "tags": list(params.get("tags") or []),
+            "created": now,
+        }
+        action = self._action("create", droplet_id, now, self.boot_delay)
+        droplet = self._droplet(self.droplets[droplet_id], now)
+        return {"droplet": droplet, "links": {"actions": [{"id": action["id"]}]}}
+
+    def _exists(self, droplet, now) -> bool:
+        return now < droplet.get("destroyed", now + 1) + self.destroy_delay
+
+    def _droplet(self, droplet, now) -> dict:
+        booted = now >= droplet["created"] + self.boot_delay
+        addressed = now >= droplet["created"] + self.ip_delay
+        public = [{"ip_address": self.droplet_ip, "type": "public"}]
+        return {
+            "id": droplet["id"],
+            "name": droplet["name"],
+            "status": "active" if booted else "new",
+            "size_slug": droplet["size_slug"],
+            "image": droplet["image"],
+            "tags": list(droplet["tags"]),
+            "networks": {"v4": public if addressed else [], "v6": []},
+            "features": [],
+            "volume_ids": [],
+        }
+
+    def _action(self, kind, droplet_id, now, delay=None):
+        action_id = next(self._ids)
+        self.actions[action_id] = {
+            "id": action_id,
+            "type": kind,
+            "resource_id": droplet_id,
+            "started": now,
+            "delay": self.action_delay if delay is None else delay,
+        }
+        return self.actions[action_id]
+
+    @staticmethod
+    def _action_view(action, now) -> dict:
+        done = now >= action["started"] + action["delay"]
+        return {
+            "id": action["id"],
+            "type": action["type"],
+            "resource_id": action["resource_id"],
+            "resource_type": "droplet",
+            "status": "completed" if done else "in-progress",
+        }
+
+    @staticmethod
+    def _not_found():
+        return 404, {"id": "not_found", "message": "The resource was not found."}
+
+
+class FakeS3(_Server):
+    """
+    S3's object API for path-style requests, e.g. from a boto3 resource made
+    with ``endpoint_url=url`` and ``addressing_style`` "path", or from its
+    presigned URLs. Buckets spring into being when first written to. Bytes
+    moved are counted by who moved them: "droplet" for the fake droplet's
+    requests and "lambda" for anyone else's, or the ``source`` given to
+    ``put`` and ``get``.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.objects = {}
+        self.bytes_in = collections.Counter()
+        self.bytes_out = collections.Counter()
+        self._versions = iter(range(1, 10 ** 9))
+
+    def _handler(self):
+        fake = self
+
+        class Handler(_Handler):
+            def do_GET(self):
+                fake._handle(self)
+
+            do_HEAD = do_PUT = do_DELETE = do_POST = do_GET
+
+        return Handler
+
+    def put(self, bucket: str, key: str, data: bytes, source: str = "lambda"):
+        with self.lock:
+            etag = f'"{next(self._versions)}"'
+            self.objects[(bucket, key)] = (data, etag)
+            self.bytes_in[source] += len(data)
+        return etag
+
+    def get(self, bucket: str, key: str, source: str = "lambda"):
+        """ The object's data, or None if there's no such object """
+        with self.lock:
+            if (bucket, key) not in self.objects:
+                return None
+            data, _ = self.objects[(bucket, key)]
+            self.bytes_out[source] += len(data)
+            return data
+
+    def _handle(self, request):
+        url = urllib.parse.urlsplit(request.path)
+        bucket, _, key = urllib.parse.unquote(url.path).lstrip("/").partition("/")
+        query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        body = request.read_body()
+        agent = request.headers.get("User-Agent", "")
+        source = "droplet" if agent == DROPLET_AGENT else "lambda"
+        if not key:
+            self.count(f"{request.command} bucket")
+            if request.command == "GET":
+                return self._list(request, bucket, query)
+            return request.reply(200)
+        self.count(f"{request.command} object")
+
+        with self.lock:
+            data, etag = self.objects.get((bucket, key), (None, None))
+        if_match = request.headers.get("If-Match")
+        if_none_match = request.headers.get("If-None-Match")
+        if request.command == "PUT":
+            if (if_none_match == "*" and etag) or (if_match and if_match != etag):
+                return self._error(request, 412, "PreconditionFailed")
+            etag = self.put(bucket, key, body, source)
+            return request.reply(200, headers={"ETag": etag})
+        if etag is None:
+            return self._error(request, 404, "NoSuchKey")
+        if if_match and if_match != etag:
+            return self._error(request, 412, "PreconditionFailed")
+        if request.command == "DELETE":
+            with self.lock:
+                self.objects.pop((bucket, key), None)
+            return request.reply(204)
+        if if_none_match == etag:
+            return request.reply(304, headers={"ETag": etag, "Content-Length": "0"})
+
+        headers = {
+            "ETag": etag,
+            "Content-Type": "binary/octet-stream",
+            "Last-Modified": formatdate(usegmt=True),
+            "Accept-Ranges": "bytes",
+        }
+        status = 200
+        requested = request.headers.get("Range")
+        if requested:
+            start, _, end = requested.split("=")[1].partition("-")
+            end = min(int(end or len(data) - 1), len(data) - 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            data, status = data[int(start) : end + 1], 206
+        if request.command == "GET":
+            with self.lock:
+                self.bytes_out[source] += len(data)
+        headers["Content-Length"] = str(len(data))
+        request.reply(status, data, headers)
+
+    def _list(self, request, bucket: str, query: dict):
+        prefix = query.get("prefix", "")
+        with self.lock:
+            found = sorted(
+                (key, data, etag)
+                for (name, key), (data, etag) in self.objects.items()
+                if name == bucket and key.startswith(prefix)
+            )
+        contents = "".join(
+            f"<Contents><Key>{escape(key)}</Key>"
+            f"<LastModified>2020-01-01T00:00:00.000Z</LastModified>"
+            f"<ETag>{escape(etag)}</ETag><Size>{len(data)}</Size>"
+            f"<StorageClass>STANDARD</StorageClass></Contents>"
+            for key, data, etag in found
+        )
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>"
+            f"<KeyCount>{len(found)}</KeyCount><MaxKeys>1000</MaxKeys>"
+            f"<IsTruncated>false</IsTruncated>{contents}</ListBucketResult>"
+        ).encode()
+        request.reply(200, body, {"Content-Type": "application/xml"})
+
+    @staticmethod
+    def _error(request, status: int, code: str):
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            f"<Error><Code>{code}</Code><Message>{code}</Message></Error>"
+        ).encode()
+        request.reply(status, body, {"Content-Type": "application/xml"})
+
+
+class CommandRule(object):
+    """
+    How long commands matching ``pattern`` (a regular expression searched for
+    in the command) take, how many lines they print and their exit status
+    """
+
+    def __init__(self, pattern: str, seconds: float, lines: int = 0, exit_code=0):
+        self.pattern = re.compile(pattern)
+        self.seconds = seconds
+        self.lines = lines
+        self.exit_code = exit_code
+
+
+class FakeSSHServer(object):
+    """
+    A droplet reached over SSH on a local port, accepting any key. Commands
+    take the time and print the output of the first matching ``rules`` entry,
+    or else ``seconds`` and ``lines``. ``aws s3 cp`` uploads of a file store
+    ``archive_bytes`` bytes in ``s3``, downloads and ``curl`` fetch objects
+    from it, and ``echo ... > path`` writes files that ``cat path`` prints,
+    without the made-up lines other commands print.
+    """
+
+    def __init__(
+        self,
+        s3: FakeS3 = None,
+        seconds: float = 0.02,
+        lines: int = 10,
+        rules=(),
+        archive_bytes: int = 1024 * 1024,
+    ):
+        self.s3 = s3
+        self.seconds = seconds
+        self.lines = lines
+        self.rules = list(rules)
+        self.archive_bytes = archive_bytes
+        self.files = {}
+        self.commands = []
+        self.bytes_sent = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._host_key = keys.load(keys.ed25519_private_key())
+        self._socket = None
+        self._transports = []
+
+    @property
+    def port(self) -> int:
+        return self._socket.getsockname()[1]
+
+    def start(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(16)
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._socket.close()
+        for transport in self._transports:
+            transport.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            serve = threading.Thread(target=self._serve, args=(connection,))
+            serve.daemon = True
+            serve.start()
+
+    def _serve(self, connection):
+        # port probes close without a word, which paramiko would log as errors
+        connection.settimeout(10)
+        try:
+            if not connection.recv(1, socket.MSG_PEEK):
+                connection.close()
+                return
+        except OSError:
+            connection.close()
+            return
+        connection.settimeout(None)
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(self._host_key)
+        with self.lock:
+            self.connections += 1
+            self._transports.append(transport)
+        try:
+            transport.start_server(server=_Droplet(self))
+        except (paramiko.SSHException, EOFError):
+            transport.close()
+
+    def rule_for(self, command: str):
+        for rule in self.rules:
+            if rule.pattern.search(command):
+                return rule
+        return CommandRule("", self.seconds, self.lines)
+
+    def run(self, channel, command: str):
+        """ Plays ``command`` out on ``channel`` """
+        with self.lock:
+            self.commands.append(command)
+        rule = self.rule_for(command)
+        time.sleep(rule.seconds)
+        try:
+            output = self._effects(command)
+        except FakeException as error:
+            output, exit_code = f"{error}\n", 1
+        else:
+            exit_code = rule.exit_code
+        # a file that's read prints just what's in it, as a real one would
+        if not command.startswith("cat "):
+            output += "".join(
+                f"{command[:40]!r}: line {n} of simulated output\n"
+                for n in range(rule.lines)
+            )
+        data = output.encode()
+        # ends with EOF, leaving the client to close the channel: paramiko only
+        # accepts the exec request once ``check_channel_exec_request`` returns,
+        # and a quick command closing it before then reads as a dropped channel
+        try:
+            channel.sendall(data)
+            channel.send_exit_status(exit_code)
+            channel.shutdown_write()
+        except (OSError, EOFError, paramiko.SSHException):
+            channel.close()
+        with self.lock:
+            self.bytes_sent += len(data)
+
+    def _effects(self, command: str) -> str:
+        """ What the command does to files and S3, returning what it prints """
+        printed = ""
+        # a heredoc's body is the file being written, not more commands
+        for part in command.split("\n", 1)[0].split(" && "):
+            try:
+                words = shlex.split(part)
+            except ValueError:
+                words = part.split()
+            if words[:1] == ["cat"] and len(words) >= 2:
+                printed += self.files.get(words[1], "")
+            elif words[:1] == ["echo"] and ">" in words:
+                arrow = words.index(">")
+                with self.lock:
+                    self.files[words[arrow + 1]] = " ".join(words[1:arrow]) + "\n"
+            elif "aws" in words and words[words.index("aws") + 1 :][:2] == ["s3", "cp"]:
+                printed += self._aws_s3_cp(words)
+            elif words[:1] == ["curl"]:
+                self._curl(words[-1])
+        return printed
+
+    def _aws_s3_cp(self, words) -> str:
+        source, destination = words[-2:]
+        if destination.startswith("s3://"):
+            bucket, _, key = destination[len("s3://") :].partition("/")
+            if source == "-":
+                # what's piped in, from "echo text | aws s3 cp - s3://..."
+                data = " ".join(words[1 : words.index("|")]).encode() + b"\n"
+            else:
+                data = b"\0" * self.archive_bytes
+            self.s3.put(bucket, key, data, source="droplet")
+            return f"upload: {source} to {destination}\n"
+        bucket, _, key = source[len("s3://") :].partition("/")
+        if self.s3.get(bucket, key, source="droplet") is None:
+            raise FakeException(f"fatal error: {source} does not exist")
+        return f"download: {source} to {destination}\n"
+
+    @staticmethod
+    def _curl(url: str):
+        request = urllib.request.Request(url, headers={"User-Agent": DROPLET_AGENT})
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+        except OSError as error:
+            raise FakeException(f"curl: {error}")
+
+
+class _Droplet(paramiko.ServerInterface):
+    """ One SSH connection to a ``FakeSSHServer`` """
+
+    def __init__(self, server: FakeSSHServer):
+        self.server = server
+
+    def get_allowed_auths(self, username):
+        return "publickey"
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        command = command.decode(errors="replace")
+        threading.Thread(
+            target=self.server.run, args=(channel, command), daemon=True
+        ).start()
+        return True
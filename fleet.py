@@ -0,0 +1,84 @@
+"""
+Running an action on many apps at once, e.g. backing every server up before a
+cost-saving shutdown.
+
+Apps are worked on by a bounded pool of threads, so the whole fleet takes
+about as long as its slowest few apps rather than the sum of all of them, and
+an app that fails is reported without stopping the others.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import digitalocean
+
+import tracing
+
+# every app droplet carries this tag, so the fleet can be found by listing it
+APP_TAG = "auto-server-app"
+
+
+class FleetException(Exception):
+    """ Base Exception class for file """
+
+
+class FleetResult(object):
+    """ What an action on one app returned or raised, and how long it took """
+
+    def __init__(self, app_name: str, message=None, error=None, seconds=0.0):
+        self.app_name = app_name
+        self.message = message
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def describe(self) -> str:
+        outcome = (self.message or "Done") if self.ok else f"Failed: {self.error}"
+        return f"{self.app_name} ({self.seconds:.1f}s): {outcome}"
+
+
+def tag_droplet(token: str, droplet, tag: str = APP_TAG):
+    """ Makes a droplet part of the fleet, e.g. one claimed from the pool """
+    app_tag = digitalocean.Tag(token=token, name=tag)
+    app_tag.create()
+    app_tag.add_droplets([droplet.id])
+
+
+def app_names(manager, tag: str = APP_TAG):
+    """ The names of the apps whose droplets carry ``tag`` """
+    return sorted({droplet.name for droplet in manager.get_all_droplets(tag_name=tag)})
+
+
+def run(app_names, act, parallelism: int = 4, clock=time.monotonic):
+    """
+    Calls ``act(app_name)`` for every app, at most ``parallelism`` at a time,
+    returning a ``FleetResult`` per app in the order they were given
+    """
+
+    def timed(app_name):
+        start = clock()
+        try:
+            message = act(app_name)
+        except Exception as error:  # pylint: disable=broad-except
+            reason = f"{type(error).__name__}: {error}"
+            return FleetResult(app_name, error=reason, seconds=clock() - start)
+        return FleetResult(app_name, message=message, seconds=clock() - start)
+
+    app_names = list(app_names)
+    if not app_names:
+        return []
+    with ThreadPoolExecutor(max_workers=min(parallelism, len(app_names))) as executor:
+        return list(executor.map(tracing.in_context(timed), app_names))
+
+
+def summary(action: str, results, seconds: float = None) -> str:
+    """ One line per app, after a count of how many succeeded """
+    failed = [result for result in results if not result.ok]
+    lines = [f'Ran "{action}" on {len(results)} app(s), {len(failed)} failed']
+    if seconds is not None:
+        lines[0] += f" in {seconds:.1f}s"
+    lines.extend(result.describe() for result in results)
+    return "\n".join(lines)
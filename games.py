@@ -0,0 +1,85 @@
+"""
+What the controller needs to know about each game server image
+"""
+
+
+class Game(object):
+    """
+    A game server's RCON details and the console commands that bracket a live
+    backup, the ports its container publishes, and how to tell it's accepting
+    players (see ``readiness.PROBES``). Paths are relative to
+    ``settings.APP_DIR``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rcon_port: int,
+        pre_backup,
+        post_backup,
+        rcon_password_file: str = None,
+        rcon_properties_file: str = None,
+        settle_seconds: int = 0,
+        ports=(),
+        ready_probe: str = None,
+        ready_port: int = None,
+    ):
+        self.name = name
+        self.rcon_port = rcon_port
+        self.pre_backup = list(pre_backup)
+        self.post_backup = list(post_backup)
+        self.rcon_password_file = rcon_password_file
+        self.rcon_properties_file = rcon_properties_file
+        # how long a save takes to reach the disk after the command returns
+        self.settle_seconds = settle_seconds
+        # as given to ``docker run -p``
+        self.ports = list(ports)
+        self.ready_probe = ready_probe
+        self.ready_port = ready_port
+
+
+GAMES = {
+    "factorio": Game(
+        "factorio",
+        rcon_port=27015,
+        pre_backup=["/server-save"],
+        post_backup=[],
+        rcon_password_file="config/rconpw",
+        settle_seconds=5,
+        ports=["34197:34197/udp", "27015:27015/tcp"],
+        # the game's UDP handshake isn't documented, its RCON login is
+        ready_probe="rcon",
+        ready_port=27015,
+    ),
+    "minecraft": Game(
+        "minecraft",
+        rcon_port=25575,
+        pre_backup=["save-off", "save-all flush"],
+        post_backup=["save-on"],
+        rcon_properties_file="server.properties",
+        # RCON stays on the droplet, for live backups
+        ports=["25565:25565/tcp", "127.0.0.1:25575:25575/tcp"],
+        ready_probe="server_list_ping",
+        ready_port=25565,
+    ),
+}
+
+# published for images no game matches
+DEFAULT_PORTS = ["34197:34197/udp", "27015:27015/tcp"]
+
+# substrings of docker image names, checked in order
+IMAGE_HINTS = [
+    ("factorio", "factorio"),
+    ("minecraft", "minecraft"),
+    ("ftb", "minecraft"),
+    ("feedthebeast", "minecraft"),
+]
+
+
+def game_for_image(image: str):
+    """ The ``Game`` an image (``settings.DOCKERFILE``) runs, or None """
+    image = (image or "").lower()
+    for hint, name in IMAGE_HINTS:
+        if hint in image:
+            return GAMES[name]
+    return None
@@ -0,0 +1,64 @@
+"""
+Naming, selection and cleanup of pre-baked droplet snapshots.
+
+A snapshot is named ``auto-server-<image>-<version>-<timestamp>``, where
+``<image>`` is a slug of ``settings.DOCKERFILE`` and ``<version>`` is a short
+hash of everything that went into baking it.
+"""
+
+import hashlib
+import re
+import time
+
+PREFIX = "auto-server"
+NAME_PATTERN = re.compile(
+    rf"^{PREFIX}-(?P<slug>.+)-(?P<version>[0-9a-f]{{12}})-(?P<stamp>\d{{14}})$"
+)
+
+
+def image_slug(dockerfile: str) -> str:
+    """ ``factoriotools/factorio:1.0`` -> ``factoriotools-factorio-1-0`` """
+    return re.sub(r"[^a-z0-9]+", "-", (dockerfile or "").lower()).strip("-")
+
+
+def bake_version(*inputs) -> str:
+    """ A short hash of the bake plan, so changed plans get new snapshots """
+    digest = hashlib.sha256()
+    for value in inputs:
+        digest.update(str(value).encode() + b"\0")
+    return digest.hexdigest()[:12]
+
+
+def snapshot_name(dockerfile: str, version: str, now: float = None) -> str:
+    stamp = time.strftime("%Y%m%d%H%M%S", time.gmtime(now))
+    return f"{PREFIX}-{image_slug(dockerfile)}-{version}-{stamp}"
+
+
+def snapshot_version(image) -> str:
+    """ The bake version in a snapshot's name, or None for other images """
+    match = NAME_PATTERN.match(image.name or "")
+    return match.group("version") if match else None
+
+
+def matching_snapshots(images, dockerfile: str):
+    """ Snapshots baked for ``dockerfile``, newest first """
+    slug = image_slug(dockerfile)
+    matches = []
+    for image in images:
+        match = NAME_PATTERN.match(image.name or "")
+        if match and match.group("slug") == slug:
+            matches.append((match.group("stamp"), image))
+    return [image for _, image in sorted(matches, key=lambda m: m[0], reverse=True)]
+
+
+def newest_snapshot(images, dockerfile: str, region: str = None):
+    """ The most recently baked snapshot for ``dockerfile`` in ``region`` """
+    for image in matching_snapshots(images, dockerfile):
+        if region is None or region in (image.regions or []):
+            return image
+    return None
+
+
+def expired_snapshots(images, dockerfile: str, keep: int):
+    """ Snapshots for ``dockerfile`` beyond the newest ``keep`` """
+    return matching_snapshots(images, dockerfile)[keep:]
@@ -0,0 +1,284 @@
+"""
+Long actions run as jobs: a record of the action's stages that's saved after
+each one, so a worker that times out or crashes can be followed by another
+that carries on from the first unfinished stage.
+
+Stages must be safe to run twice, as one that was interrupted runs again.
+What a stage needs to hand to later ones, e.g. the ID of a droplet it made,
+goes in the job's ``data``, which is saved with it.
+
+Jobs are stored by app, next to a pointer to the app's latest job for each
+action, so finding it doesn't mean reading every job there has ever been.
+"""
+
+import json
+import os
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+import tracing
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class JobException(Exception):
+    """ Base Exception class for file """
+
+
+class JobNotFound(JobException):
+    """ No job with this ID """
+
+
+class Job(object):
+    """ One run of an action for an app, and how far it has got """
+
+    def __init__(
+        self,
+        action: str,
+        app_name: str,
+        body: str = "",
+        id: str = None,
+        state: str = QUEUED,
+        completed=(),
+        messages=None,
+        current: str = None,
+        error: str = None,
+        attempts: int = 0,
+        data=None,
+        created_at: float = None,
+        updated_at: float = None,
+    ):
+        self.id = id or uuid.uuid4().hex[:12]
+        self.action = action
+        self.app_name = app_name
+        self.body = body
+        self.state = state
+        self.completed = list(completed)
+        self.messages = dict(messages or {})
+        self.current = current
+        self.error = error
+        self.attempts = attempts
+        self.data = dict(data or {})
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(**data)
+
+    def stalled(self, lease_seconds: float, now: float = None) -> bool:
+        """ Unfinished, but no worker has saved progress for too long """
+        now = time.time() if now is None else now
+        return self.state not in FINISHED and now - self.updated_at > lease_seconds
+
+    def describe(self) -> str:
+        """ A progress report for the ``status`` action """
+        lines = [
+            f'Job {self.id}: {self.action} for "{self.app_name}" is {self.state}'
+        ]
+        if self.state == RUNNING and self.current:
+            lines.append(f"  running: {self.current}")
+        for stage in self.completed:
+            lines.append(f"  done: {stage}")
+            message = self.messages.get(stage) or ""
+            lines.extend(f"    {line}" for line in message.splitlines())
+        if self.error:
+            lines.append(f"  error: {self.error}")
+        return "\n".join(lines)
+
+
+def pointer_name(action: str = None) -> str:
+    """ What the pointer to an app's latest job (for ``action``) is called """
+    return f"latest-{action}" if action else "latest"
+
+
+class JobStore(object):
+    """
+    Saves and finds jobs and the pointers to each app's latest ones. Backends
+    store a named JSON document per app with ``_read`` and ``_write``, and
+    list an app's names with ``_names``.
+    """
+
+    def _read(self, app_name: str, name: str):
+        """ The document called ``name``, or None if there isn't one """
+        raise NotImplementedError
+
+    def _write(self, app_name: str, name: str, data: dict):
+        raise NotImplementedError
+
+    def _names(self, app_name: str):
+        """ The names of every document stored for the app """
+        raise NotImplementedError
+
+    def save(self, job: Job):
+        job.updated_at = time.time()
+        self._write(job.app_name, job.id, job.to_dict())
+
+    def load(self, app_name: str, job_id: str) -> Job:
+        data = self._read(app_name, job_id)
+        if data is None:
+            raise JobNotFound(job_id)
+        return Job.from_dict(data)
+
+    def point(self, job: Job):
+        """ Makes ``job`` the app's latest, overall and for its action """
+        for action in (None, job.action):
+            self._write(job.app_name, pointer_name(action), {"id": job.id})
+
+    def latest_id(self, app_name: str, action: str = None):
+        pointer = self._read(app_name, pointer_name(action))
+        return pointer and pointer["id"]
+
+    def jobs(self, app_name: str):
+        return [
+            self.load(app_name, name)
+            for name in self._names(app_name)
+            if not name.startswith("latest")
+        ]
+
+
+class DirectoryJobStore(JobStore):
+    """ Jobs as JSON files in a local directory, one directory per app """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _file(self, app_name: str, name: str) -> str:
+        return os.path.join(self.path, app_name, f"{name}.json")
+
+    def _write(self, app_name: str, name: str, data: dict):
+        os.makedirs(os.path.join(self.path, app_name), exist_ok=True)
+        # written then renamed, so readers never see half a job
+        temporary = self._file(app_name, name) + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(data, f)
+        os.replace(temporary, self._file(app_name, name))
+
+    def _read(self, app_name: str, name: str):
+        try:
+            with open(self._file(app_name, name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _names(self, app_name: str):
+        directory = os.path.join(self.path, app_name)
+        if not os.path.isdir(directory):
+            return []
+        return [
+            name[: -len(".json")]
+            for name in os.listdir(directory)
+            if name.endswith(".json")
+        ]
+
+
+class S3JobStore(JobStore):
+    """ Jobs as JSON objects under ``prefix``/<app name>/ in an S3 bucket """
+
+    def __init__(self, bucket, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+
+    def _object(self, app_name: str, name: str):
+        return self.bucket.Object(f"{self.prefix}/{app_name}/{name}.json")
+
+    def _read(self, app_name: str, name: str):
+        try:
+            body = self._object(app_name, name).get()["Body"]
+        except ClientError:
+            return None
+        return json.loads(body.read().decode())
+
+    def _write(self, app_name: str, name: str, data: dict):
+        self._object(app_name, name).put(
+            Body=json.dumps(data).encode(), ContentType="application/json"
+        )
+
+    def _names(self, app_name: str):
+        prefix = f"{self.prefix}/{app_name}/"
+        return [
+            summary.key[len(prefix) : -len(".json")]
+            for summary in self.bucket.objects.filter(Prefix=prefix)
+            if summary.key.endswith(".json")
+        ]
+
+
+def latest(store, app_name: str, action: str = None):
+    """ The app's most recent job (for ``action``), or None """
+    job_id = store.latest_id(app_name, action)
+    if job_id is None:
+        return None
+    try:
+        return store.load(app_name, job_id)
+    except JobNotFound:
+        return None
+
+
+def submit(store, action: str, app_name: str, body: str = "", lease_seconds=900):
+    """
+    Queues ``action`` for the app, returning the job and whether it needs a
+    worker. A failed or stalled job for the same request is resumed instead, so
+    retrying carries on from where it stopped, and one that's queued or running
+    is shared: the duplicate request attaches to it rather than repeating it.
+
+    Callers serialize submissions for an app, e.g. with a lease, so that two
+    identical requests can't both start a new job.
+    """
+    job = latest(store, app_name, action)
+    if job is not None and job.state != SUCCEEDED and job.body == body:
+        if job.state in (QUEUED, RUNNING) and not job.stalled(lease_seconds):
+            return job, False
+        job.state, job.error = QUEUED, None
+        store.save(job)
+    else:
+        job = Job(action, app_name, body)
+        store.save(job)
+        store.point(job)
+    return job, True
+
+
+def run(store, job: Job, stages, time_left=None, margin: float = 0):
+    """
+    Runs the job's unfinished ``stages``, a list of ``(name, function)``, saving
+    after each. With ``time_left``, a function returning the seconds this
+    worker has left, the job is queued again rather than starting another
+    stage with less than ``margin`` seconds to go; the first always starts.
+    Returns the job, which is queued again when it ran out of time.
+    """
+    if job.state in FINISHED:
+        return job
+    job.state = RUNNING
+    job.attempts += 1
+    store.save(job)
+    ran = False
+    for name, stage in stages:
+        if name in job.completed:
+            continue
+        if ran and time_left is not None and time_left() < margin:
+            job.state, job.current = QUEUED, None
+            store.save(job)
+            return job
+        job.current = name
+        store.save(job)
+        try:
+            with tracing.span("job.stage", job_id=job.id, stage=name):
+                job.messages[name] = stage() or ""
+        except Exception as error:  # pylint: disable=broad-except
+            job.state, job.error = FAILED, f"{name}: {type(error).__name__}: {error}"
+            store.save(job)
+            return job
+        job.completed.append(name)
+        store.save(job)
+        ran = True
+    job.state, job.current = SUCCEEDED, None
+    store.save(job)
+    return job
@@ -2,15 +2,48 @@
 The lambda function controlling generation of a server
 """
 
+import json
 import os
+import shlex
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
-import digitalocean
-import paramiko
-from retry import retry
+from botocore.exceptions import ClientError
 
+import doclient
+import images
+import jobs
+import lazy
+import leases
 import settings
+import sizing
+import tracing
+from archive import (
+    CODECS,
+    DEFAULT_CODEC,
+    archive_backup_commands,
+    archive_extract_command,
+    stream_backup_command,
+    stream_restore_command,
+)
+from games import DEFAULT_PORTS, game_for_image
+from provision import Step, StepFailed, fingerprints, run_plan
+from resources import ResourceIndex
+
+# imported on first use, as most requests need only some of them, if any
+boto3 = lazy.module("boto3")
+# every DigitalOcean request goes through the rate limited client
+digitalocean = lazy.module("digitalocean", on_load=lambda _: do_client())
+paramiko = lazy.module("paramiko")
+fleet = lazy.module("fleet")
+keys = lazy.module("keys")
+pool = lazy.module("pool")
+readiness = lazy.module("readiness")
+ssh = lazy.module("ssh")
+volumes = lazy.module("volumes")
+waiting = lazy.module("waiting")
 
 
 class LambdaException(Exception):
@@ -41,9 +74,73 @@ class NoIpAddress(LambdaException):
     """ Couldn't get an IP address for the droplet """
 
 
-@retry(tries=30, delay=10)
-def connect_ssh_client(client, *args, **kwargs):
-    return client.connect(*args, **kwargs)
+class NoFingerprint(LambdaException):
+    """ DigitalOcean hasn't given the SSH key a fingerprint yet """
+
+
+class LiveBackupFailed(LambdaException):
+    """ The game server couldn't be saved, or its files couldn't be copied """
+
+
+class BackupFailed(LambdaException):
+    """ A backup command failed, so S3 may not have the latest files """
+
+
+class RestoreFailed(LambdaException):
+    """ The archive couldn't be extracted, or didn't match its checksum """
+
+
+class SnapshotFailed(LambdaException):
+    """ DigitalOcean didn't finish snapshotting the bake droplet """
+
+
+class VolumeNotFlushed(LambdaException):
+    """ The app's files couldn't be flushed to its volume, so it stays attached """
+
+
+class ResizeAborted(LambdaException):
+    """ The app couldn't be stopped and flushed, so the droplet kept running """
+
+
+class AppState(object):
+    """
+    What the process remembers about an app between requests: its droplet,
+    keys and open SSH connection. Every controller for the app shares it, so a
+    warm lambda or the CLI doesn't look them up and connect again per action
+    """
+
+    # one per app name, for the life of the process
+    _by_app = {}
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.droplet = None
+        self.private_key = None
+        self.ssh_key = None
+        self.ssh_client = None
+        self.volume = None
+
+    @classmethod
+    def for_app(cls, app_name: str):
+        with cls._lock:
+            return cls._by_app.setdefault(app_name, cls())
+
+    @classmethod
+    def clear_process_cache(cls):
+        with cls._lock:
+            for state in cls._by_app.values():
+                state.disconnect()
+            cls._by_app.clear()
+
+    def disconnect(self):
+        if self.ssh_client is not None:
+            self.ssh_client.close()
+        self.ssh_client = None
+
+    def forget_droplet(self):
+        """ For a droplet that's been destroyed, or may have been """
+        self.disconnect()
+        self.droplet = None
 
 
 class Controller(object):
@@ -53,279 +150,1742 @@ class Controller(object):
 
     ALL_ACTIONS = ["create", "destroy", "hard_destroy", "backup", "restore"]
 
-    def __init__(self, app_name: str = "", message_body: str = ""):
+    def __init__(self, app_name: str = "", message_body: str = "", state=None):
         self.app_name = app_name
         self.message_body = message_body
-        self._droplet = None
-        self._private_key = None
-        self._ssh_key = None
-        self._ssh_client = None
+        # names of the app's droplet, key, volume and S3 objects
+        self.app_settings = settings.for_app(app_name or settings.APP_NAME)
+        # droplets that aren't the app's (bake, standby) get a state of their own
+        if state is None:
+            state = AppState.for_app(self.app_settings.APP_NAME)
+        self.state = state
+        self._resource_index = None
+        # whether a connection left open by an earlier request was checked
+        self._ssh_checked = False
+        # seconds spent waiting for the droplet to accept SSH
+        self.ssh_seconds = None
         self.actions = {
             "backup": self.backup,
+            "bake": self.bake,
+            "benchmark": self.benchmark,
             "configure": self.configure,
             "create": self.create,
             "exec": self.exec,
             "destroy": self.destroy,
             "hard_destroy": self.hard_destroy,
+            "refill_pool": self.refill_pool,
+            "resize": self.resize,
             "restore": self.restore,
+            "rightsize": self.rightsize,
+            "rotate_key": self.rotate_key,
+            "run_job": self.run_job,
+            "status": self.status,
+            "telemetry": self.telemetry,
         }
-        self.manager = digitalocean.Manager(token=settings.DIGITALOCEAN_API_TOKEN)
+        self._manager = None
 
     def __str__(self):
         return f'App controller for application "{self.app_name}"'
 
-    @retry(NoIpAddress, tries=10, delay=3)
+    @property
+    def manager(self):
+        """ Made on first use, as many actions never call DigitalOcean """
+        if self._manager is None:
+            self._manager = digitalocean.Manager(token=settings.DIGITALOCEAN_API_TOKEN)
+        return self._manager
+
     def get_ip_address(self):
-        self.droplet.load()
-        if self.droplet.ip_address is None:
-            raise NoIpAddress("No IP address found")
-        return self.droplet.ip_address
+        """ The droplet's address, waiting for DigitalOcean to assign one """
+        droplet = self.droplet
+
+        def loaded_address():
+            droplet.load()
+            return droplet.ip_address
+
+        # a droplet keeps its address, so only reload until it has one
+        if droplet.ip_address is None:
+            try:
+                waiting.wait_for(
+                    loaded_address,
+                    timeout=settings.ACTION_TIMEOUT,
+                    description="an IP address",
+                )
+            except waiting.WaitTimedOut as error:
+                raise NoIpAddress(str(error))
+        # bake and standby droplets aren't the app's, so aren't indexed
+        if droplet.id == self.resource_index.get("droplet_id"):
+            self.resource_index.update(ip_address=droplet.ip_address)
+        return droplet.ip_address
+
+    @property
+    def resource_index(self):
+        """ IDs of this app's droplet and SSH key, to skip listing the account """
+        if self._resource_index is None:
+            self._resource_index = ResourceIndex(
+                s3_bucket(), self.app_settings.S3_RESOURCE_INDEX_PATH
+            )
+        return self._resource_index
 
     def _exec(self, command, wait_for_completion: bool = True):
         """ Sends a command over SSH to the droplet """
-        stdin, stdout, stderr = self.ssh_client.exec_command(command)
-        if wait_for_completion:
-            stdout.channel.recv_exit_status()
+        if not wait_for_completion:
+            return self._send(command)
+        with tracing.span("ssh.exec", command=tracing.digest(command)) as span:
+            stdin, stdout, stderr = self._send(command)
+            span.set(exit_status=stdout.channel.recv_exit_status())
         return stdin, stdout, stderr
 
+    def _send(self, command):
+        try:
+            return self.ssh_client.exec_command(command)
+        except (paramiko.SSHException, OSError):
+            # the connection dropped since it was checked, so make a new one
+            tracing.annotate(reconnected=True)
+            self.state.disconnect()
+            return self.ssh_client.exec_command(command)
+
+    def _stream(self, command, on_line=None, timeout: float = None):
+        """
+        Runs ``command`` on the droplet, reading its output as it comes. Lines
+        go to ``on_line(stream, line)`` and only a tail of them is kept.
+        Returns an ``ssh.CommandResult``
+        """
+        with tracing.span("ssh.exec", command=tracing.digest(command)) as span:
+            _, stdout, _ = self._exec(command, wait_for_completion=False)
+            result = ssh.collect(
+                stdout.channel,
+                on_line=on_line,
+                timeout=timeout,
+                tail=settings.EXEC_TAIL_LINES,
+            )
+            span.set(exit_status=result.exit_code, lines=result.lines)
+        return result
+
     @property
     def ssh_key(self):
-        if self._ssh_key is None:
-            self._ssh_key = self._create_ssh_key()
-        return self._ssh_key
+        if self.state.ssh_key is None:
+            self.state.ssh_key = self._get_ssh_key()
+        return self.state.ssh_key
 
-    @retry(tries=10, delay=3)
     def get_ssh_key_fingerprint(self):
-        """ Retrieves the fingerprint """
-        self.ssh_key.load()
-        if self.ssh_key.fingerprint is None:
-            raise LambdaException
-        return self.ssh_key.fingerprint
+        """ Retrieves the fingerprint, waiting for DigitalOcean to compute it """
+        key = self.ssh_key
+
+        def loaded_fingerprint():
+            key.load()
+            return key.fingerprint
+
+        if key.fingerprint is None:
+            try:
+                waiting.wait_for(
+                    loaded_fingerprint,
+                    timeout=30,
+                    description="the SSH key's fingerprint",
+                )
+            except waiting.WaitTimedOut as error:
+                raise NoFingerprint(str(error))
+        return key.fingerprint
 
     def _get_ssh_key(self):
         """ Retrieves or generates an SSH key """
-        keys = list(
-            filter(
-                lambda x: x.name == settings.APP_NAME, self.manager.get_all_sshkeys()
-            )
-        )
+        key_id = self.resource_index.get("ssh_key_id")
+        if key_id:
+            try:
+                key = self.manager.get_ssh_key(key_id)
+                if key.name == self.app_settings.APP_NAME:
+                    return key
+            except digitalocean.NotFoundError:
+                pass
+            self.resource_index.forget("ssh_key_id", "ssh_key_fingerprint")
+
+        name = self.app_settings.APP_NAME
+        keys = list(filter(lambda x: x.name == name, self.manager.get_all_sshkeys()))
 
         if len(keys) > 1:
             raise MultipleKeysFound
-        if len(keys) == 0:
-            return self._create_ssh_key()
-
-        return keys[0]
+        key = keys[0] if keys else self._create_ssh_key()
+        self.resource_index.update(
+            ssh_key_id=key.id, ssh_key_fingerprint=key.fingerprint
+        )
+        return key
 
     def _create_ssh_key(self):
         """ Creates a new SSH key """
-        self._ssh_key = digitalocean.SSHKey(
+        self.state.ssh_key = digitalocean.SSHKey(
             token=settings.DIGITALOCEAN_API_TOKEN,
-            name=settings.APP_NAME,
+            name=self.app_settings.APP_NAME,
             public_key=self.public_key,
         )
-        self._ssh_key.create()
-        return self._ssh_key
+        self.state.ssh_key.create()
+        return self.state.ssh_key
 
     @property
     def public_key(self):
         """ public portion of key """
-        return f"ssh-rsa {self.private_key.get_base64()}"
+        return keys.public_key_line(self.private_key)
 
     @property
     def private_key(self):
         """ Lazy loads pk from s3 or generates a fresh one """
-        if self._private_key is None:
-            self._private_key = self._get_private_key()
-        return self._private_key
+        if self.state.private_key is None:
+            self.state.private_key = self._get_private_key()
+        return self.state.private_key
+
+    @property
+    def key_cache(self):
+        """ The private key in S3, with a local copy kept while it's unchanged """
+        return keys.KeyCache(
+            s3_bucket(), self.app_settings.S3_SSH_KEY_FILE_PATH, settings.KEY_CACHE_DIR
+        )
 
     def _get_private_key(self):
         """ Gets or creates a private key """
-        try:
-            s3_bucket.download_file(
-                settings.S3_SSH_KEY_FILE_PATH, settings.SSH_KEY_FILE_NAME,
+        text = self.key_cache.fetch()
+        if text is None:
+            text = keys.generate(settings.SSH_KEY_TYPE, settings.PRIVATE_KEY_PASSPHRASE)
+            self.key_cache.store(text)
+        return keys.load(text, settings.PRIVATE_KEY_PASSPHRASE)
+
+    def rotate_key(self):
+        """
+        Replaces the app's SSH key with a new ``settings.SSH_KEY_TYPE`` one: on
+        the droplet, if there is one, in S3 and at DigitalOcean. The app's standby
+        droplets only accept the old key, so they're destroyed and its pool
+        refilled
+        """
+        old_line = self.public_key
+        text = keys.generate(settings.SSH_KEY_TYPE, settings.PRIVATE_KEY_PASSPHRASE)
+        new_key = keys.load(text, settings.PRIVATE_KEY_PASSPHRASE)
+        new_line = keys.public_key_line(new_key)
+        authorized_keys = "/root/.ssh/authorized_keys"
+        droplet = self._existing_droplet()
+        if droplet:
+            # both keys work until the new one is saved
+            self._exec(f"echo {shlex.quote(new_line)} >> {authorized_keys}")
+
+        self.key_cache.store(text)
+        old_ssh_key = self.ssh_key
+        self.state.private_key = new_key
+        self.state.ssh_key = None
+        old_ssh_key.destroy()
+        self.resource_index.forget("ssh_key_id", "ssh_key_fingerprint")
+        fingerprint = self.get_ssh_key_fingerprint()
+
+        if droplet:
+            # the open connection outlives the old key's removal
+            self._exec(
+                f"grep -vF {shlex.quote(old_line)} {authorized_keys}"
+                f" > {authorized_keys}.new && mv {authorized_keys}.new"
+                f" {authorized_keys}"
             )
-        except:
-            self._create_private_key()
-
-        private_key = paramiko.RSAKey.from_private_key_file(
-            settings.SSH_KEY_FILE_NAME, password=settings.PRIVATE_KEY_PASSPHRASE
+        standbys = self.manager.get_all_droplets(
+            tag_name=pool.pool_tag(self.app_name, settings.DOCKERFILE)
         )
-        return private_key
-
-    def _create_private_key(self):
-        """ Generates a new private key and stores it locally and in s3 """
-        key = paramiko.RSAKey.generate(2048)
-        key.write_private_key_file(
-            settings.SSH_KEY_FILE_NAME, password=settings.PRIVATE_KEY_PASSPHRASE
+        for standby in standbys:
+            standby.destroy()
+        if standbys and settings.POOL_SIZE:
+            self._refill_pool_later()
+        return (
+            f"Rotated the SSH key to {fingerprint}, replacing"
+            f" {len(standbys)} standby droplet(s)"
         )
-        s3_bucket.upload_file(settings.SSH_KEY_FILE_NAME, settings.S3_SSH_KEY_FILE_PATH)
 
     @property
     def ssh_client(self):
-        """ Returns a SSH client for this droplet """
-        if self._ssh_client is None:
-            self._ssh_client = self._create_ssh_client()
-        return self._ssh_client
-
-    def _create_ssh_client(self) -> paramiko.SSHClient:
-        """ Creates an SSH connection to the droplet """
-        client = paramiko.SSHClient()
+        """
+        Returns a SSH client for this droplet. A connection left open by an
+        earlier request is reused once it's been checked to still work
+        """
+        if self.state.ssh_client is not None and not self._ssh_checked:
+            self._ssh_checked = True
+            if not ssh.alive(self.state.ssh_client):
+                # the droplet may have gone with it, so find that again too
+                self.state.forget_droplet()
+        if self.state.ssh_client is None:
+            # found first, as a new droplet is configured on the way, which
+            # connects to it: that connection is then the one to use
+            self.droplet
+        if self.state.ssh_client is None:
+            client = self._create_ssh_client()
+            if self.state.ssh_client is None:
+                self.state.ssh_client = client
+            else:
+                # another thread connected meanwhile, so only one is kept open
+                client.close()
+            self._ssh_checked = True
+        return self.state.ssh_client
+
+    def _create_ssh_client(self) -> "paramiko.SSHClient":
+        """
+        Creates an SSH connection to the droplet, as soon as it accepts one.
+        The app droplet's host key is pinned in the resource index.
+        """
         ip = self.get_ip_address()
-
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        connect_ssh_client(
-            client, ip, username="root", pkey=self.private_key, timeout=90
-        )
+        indexed = self.droplet.id == self.resource_index.get("droplet_id")
+        with tracing.span("ssh.connect", host=ip, pinned=indexed):
+            client, host_key, self.ssh_seconds = ssh.connect(
+                ip,
+                self.private_key,
+                host_key=self.resource_index.get("host_key") if indexed else None,
+                timeout=settings.SSH_TIMEOUT,
+                keepalive=settings.SSH_KEEPALIVE,
+                port=settings.SSH_PORT,
+            )
+        if indexed:
+            self.resource_index.update(host_key=host_key)
+        print(f"SSH to {ip} was ready in {self.ssh_seconds:.1f}s")
         return client
 
     @property
     def droplet(self):
         """ Provides a lazily loaded droplet for ``self.app_name`` """
-        if self._droplet is None:
-            self._droplet = self._get_droplet()
+        if self.state.droplet is None:
+            self.state.droplet = self._get_droplet()
             self._configure_droplet()
-        return self._droplet
+        return self.state.droplet
 
     def _get_droplet(self):
         """ Calls DigitalOcean's API to fetch a droplet manager """
+        droplet = self._find_droplet()
+        if droplet is None:
+            droplet = self._claim_standby() or self._create_droplet()
+            self._index_droplet(droplet)
+        return droplet
+
+    def _find_droplet(self):
+        """ The app's droplet, or None. Unlike ``_get_droplet``, never creates one """
+        droplet = self._indexed_droplet()
+        if droplet is not None:
+            return droplet
+
         droplets = self.manager.get_all_droplets()
-        droplets = list(filter(lambda d: d.name == settings.APP_NAME, droplets))
+        name = self.app_settings.APP_NAME
+        droplets = list(filter(lambda d: d.name == name, droplets))
 
         if len(droplets) > 1:
             raise MultipleDropletsFound
         elif len(droplets) == 0:
-            return self._create_droplet()
-
+            return None
+        self._index_droplet(droplets[0])
         return droplets[0]
 
+    def _index_droplet(self, droplet):
+        # droplets from the pool, or made before there was a fleet, join it
+        if fleet.APP_TAG not in (droplet.tags or []):
+            fleet.tag_droplet(settings.DIGITALOCEAN_API_TOKEN, droplet)
+        # a droplet that wasn't indexed may not be the one whose host key we have
+        self.resource_index.forget("host_key")
+        self.resource_index.update(
+            droplet_id=droplet.id, ip_address=droplet.ip_address
+        )
+
+    def _existing_droplet(self):
+        """
+        Loads the app's droplet without creating or configuring one, for
+        actions that only make sense on a droplet that's already there
+        """
+        if self.state.droplet is None:
+            self.state.droplet = self._find_droplet()
+        return self.state.droplet
+
+    def _indexed_droplet(self):
+        """ The droplet the resource index points at, if it still exists """
+        droplet_id = self.resource_index.get("droplet_id")
+        if not droplet_id:
+            return None
+        try:
+            droplet = self.manager.get_droplet(droplet_id)
+            if droplet.name == self.app_settings.APP_NAME:
+                return droplet
+        except digitalocean.NotFoundError:
+            pass
+        self.resource_index.forget("droplet_id", "ip_address", "host_key")
+        return None
+
     def _create_droplet(self):
         """ Creates a new droplet """
         self.get_ssh_key_fingerprint()
-        self._droplet = digitalocean.Droplet(
+        self.state.droplet = digitalocean.Droplet(
             token=settings.DIGITALOCEAN_API_TOKEN,
-            name=settings.APP_NAME,
+            name=self.app_settings.APP_NAME,
             region=settings.DIGITALOCEAN_REGION_SLUG,
-            image="docker-18-04",
-            size_slug="4gb",
+            image=self._image(),
+            size_slug=self._droplet_size(),
             ssh_keys=[self.ssh_key.id],
+            tags=[fleet.APP_TAG],
+            # attached at boot, so there's no separate attach to wait on
+            volumes=[self.volume.id] if settings.PERSISTENCE == "volume" else [],
+        )
+        self.state.droplet.create()
+        return self._wait_until_active(self.state.droplet)
+
+    def _wait_until_active(self, droplet):
+        """ Follows a new droplet's create action, then loads its details """
+        for action_id in droplet.action_ids:
+            waited = waiting.wait_for_action(
+                waiting.action_for(settings.DIGITALOCEAN_API_TOKEN, action_id),
+                timeout=settings.ACTION_TIMEOUT,
+            )
+            print(f'Droplet "{droplet.name}" was created in {waited.seconds:.1f}s')
+        droplet.load()
+        return droplet
+
+    def _claim_standby(self):
+        """ Takes a configured droplet from the warm pool, if there is one """
+        # standby droplets are all ``settings.DROPLET_SIZE``
+        if not settings.POOL_SIZE or self._droplet_size() != settings.DROPLET_SIZE:
+            return None
+        try:
+            with self._pool_lease():
+                droplet = pool.claim(
+                    self.manager,
+                    settings.DIGITALOCEAN_API_TOKEN,
+                    self.app_name,
+                    settings.DOCKERFILE,
+                )
+        except leases.LeaseHeld:
+            print("Warm pool is busy, creating a new droplet instead")
+            return None
+        self._refill_pool_later()
+        return droplet
+
+    def _pool_lease(self):
+        """ Holds the lease on the app's warm pool """
+        return leases.hold(
+            self.lease_store,
+            pool.lease_name(self.app_name, settings.DOCKERFILE),
+            uuid.uuid4().hex,
+            ttl=pool.LEASE_SECONDS,
+            wait=settings.LEASE_WAIT,
         )
-        self._droplet.create()
-        return self._droplet
 
-    def _configure_droplet(self):
-        """ Run standard configuration on the new droplet """
-        self.get_ip_address()
-        commands = [
+    def _refill_pool_later(self):
+        """ Refills the warm pool without holding up the current action """
+        self._invoke_later(
+            {"action": "refill_pool", "app_name": self.app_name},
+            Controller(self.app_name).refill_pool,
+        )
+
+    def _invoke_later(self, event: dict, run_locally):
+        """
+        Runs an action without holding up the current one: in another lambda
+        invocation, since a lambda is frozen once it returns, or else by
+        calling ``run_locally`` on a thread
+        """
+        function_name = os.getenv("AWS_LAMBDA_FUNCTION_NAME")
+        if function_name:
+            boto3.client("lambda").invoke(
+                FunctionName=function_name,
+                InvocationType="Event",
+                Payload=json.dumps(event),
+            )
+        else:
+            threading.Thread(target=run_locally).start()
+
+    def _droplet_price(self) -> float:
+        """ Monthly price of a ``settings.DROPLET_SIZE`` droplet, 0 if unknown """
+        for size in self.manager.get_all_sizes():
+            if size.slug == settings.DROPLET_SIZE:
+                return size.price_monthly
+        return 0
+
+    def _droplet_size(self) -> str:
+        """ The size chosen for the app by "resize", else ``settings.DROPLET_SIZE`` """
+        return self._app_options().get("size_slug") or settings.DROPLET_SIZE
+
+    def _app_options(self) -> dict:
+        """
+        What actions like "resize" chose for the app. Unlike the resource
+        index these aren't hints that can be found again, so they're kept apart
+        """
+        try:
+            options = s3_bucket().Object(self.app_settings.S3_APP_OPTIONS_PATH)
+            body = options.get()["Body"]
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return {}
+            raise
+        return json.loads(body.read().decode())
+
+    def _set_app_options(self, **options):
+        s3_bucket().Object(self.app_settings.S3_APP_OPTIONS_PATH).put(
+            Body=json.dumps(dict(self._app_options(), **options)).encode(),
+            ContentType="application/json",
+        )
+
+    def _image(self):
+        """ The newest snapshot baked for ``settings.DOCKERFILE``, or the base """
+        snapshot = images.newest_snapshot(
+            self.manager.get_my_images(),
+            settings.DOCKERFILE,
+            settings.DIGITALOCEAN_REGION_SLUG,
+        )
+        return snapshot.id if snapshot else settings.BASE_IMAGE
+
+    @property
+    def volume(self):
+        """ The block storage volume holding ``settings.APP_DIR`` """
+        if self.state.volume is None:
+            self.state.volume = volumes.ensure_volume(
+                self.manager,
+                settings.DIGITALOCEAN_API_TOKEN,
+                self.app_settings.VOLUME_NAME,
+                settings.DIGITALOCEAN_REGION_SLUG,
+                settings.VOLUME_SIZE_GB,
+            )
+        return self.state.volume
+
+    def _attach_volume(self):
+        """ Attaches the app's volume to a droplet that was created without it """
+        if settings.PERSISTENCE == "volume":
+            volumes.attach(
+                self.volume, self.droplet.id, settings.DIGITALOCEAN_REGION_SLUG
+            )
+
+    def _configure_steps(self):
+        """ Standard configuration for a droplet, as a provisioning plan """
+        # every codec's package, so any archive can be restored whatever the
+        # current BACKUP_CODEC is
+        packages = ["awscli", "pv", "rsync"]
+        packages += sorted({codec.package for codec in CODECS.values()})
+        if settings.BACKUP_MODE == "chunked":
+            packages += ["python3-boto3", "python3-numpy"]
+        steps = [
             # create app_dir
-            f"mkdir -p {settings.APP_DIR}",
+            Step(
+                "mkdir",
+                f"mkdir -p {settings.APP_DIR} {settings.REMOTE_STATE_DIR}",
+                requires=["mount_volume"] if settings.PERSISTENCE == "volume" else [],
+                cacheable=True,
+            ),
             # ensure we have the packages we need
-            f"apt-get --assume-yes update",
-            f"apt --assume-yes install awscli",
-            # configure AWS
-            f"aws configure set AWS_ACCESS_KEY_ID {settings.AWS_ACCESS_KEY_ID}",
-            f"aws configure set AWS_SECRET_ACCESS_KEY {settings.AWS_SECRET_ACCESS_KEY}",
-            f"aws configure set region {settings.AWS_REGION_ID}",
-            f"aws configure set output {settings.AWS_OUTPUT_FORMAT}",
+            Step("apt_update", "apt-get --assume-yes update", cacheable=True),
+            Step(
+                "apt_install",
+                f"apt --assume-yes install {' '.join(packages)}",
+                requires=["apt_update"],
+                cacheable=True,
+            ),
+            # configure AWS. These all write ~/.aws/config, so they run in order
+            Step(
+                "aws_configure",
+                " && ".join(
+                    [
+                        f"aws configure set AWS_ACCESS_KEY_ID {settings.AWS_ACCESS_KEY_ID}",
+                        f"aws configure set AWS_SECRET_ACCESS_KEY {settings.AWS_SECRET_ACCESS_KEY}",
+                        f"aws configure set region {settings.AWS_REGION_ID}",
+                        f"aws configure set output {settings.AWS_OUTPUT_FORMAT}",
+                        "aws configure set default.s3.max_concurrent_requests"
+                        f" {settings.S3_MAX_CONCURRENT_REQUESTS}",
+                        "aws configure set default.s3.multipart_chunksize"
+                        f" {settings.S3_MULTIPART_CHUNKSIZE}",
+                    ]
+                ),
+                requires=["apt_install"],
+                cacheable=True,
+            ),
         ]
-        for command in commands:
-            self._exec(command)
-        return "Droplet configured!"
+        if settings.BACKUP_MODE == "chunked":
+            steps.append(self._tool_step("chunkstore"))
+        if settings.BACKUP_MODE == "stream":
+            steps.append(self._tool_step("transfer"))
+        if settings.PERSISTENCE == "volume":
+            steps.append(
+                Step(
+                    "mount_volume",
+                    volumes.mount_command(
+                        self.app_settings.VOLUME_NAME, settings.APP_DIR
+                    ),
+                    cacheable=True,
+                )
+            )
+        if settings.BACKUP_LIVE:
+            steps.append(self._tool_step("rcon"))
+        steps.append(self._tool_step("archive"))
+        steps.append(self._tool_step("telemetry"))
+        return steps
+
+    def _tool_step(self, name: str):
+        """
+        Installs one of this repo's droplet-side scripts. The script travels in
+        the command itself, so its fingerprint changes whenever the script does.
+        """
+        with open(os.path.join(os.path.dirname(__file__), f"{name}.py")) as f:
+            source = f.read()
+        return Step(
+            name,
+            f"cat > {self._tool_path(name)} <<'AUTO_SERVER_EOF'\n"
+            f"{source}\nAUTO_SERVER_EOF",
+            requires=["mkdir"],
+            cacheable=True,
+        )
+
+    def _tool_path(self, name: str) -> str:
+        return f"{settings.REMOTE_STATE_DIR}/{name}.py"
+
+    def _chunkstore_command(self, *args) -> str:
+        tool = self._tool_path("chunkstore")
+        return " ".join([f"python3 {tool}", *filter(None, args)])
+
+    def _restore_steps(self):
+        """ Steps that put the latest backup in place, ending with "restore" """
+        if settings.BACKUP_MODE == "chunked":
+            return [
+                Step(
+                    "restore",
+                    self._chunkstore_command(
+                        "restore",
+                        settings.APP_DIR,
+                        settings.S3_BUCKET_NAME,
+                        self.app_settings.S3_CHUNK_STORE_PATH,
+                        "--missing-ok",
+                    ),
+                    requires=["mkdir", "aws_configure", "chunkstore"],
+                )
+            ]
+
+        if settings.BACKUP_MODE == "stream":
+            metadata = self._archive_metadata()
+            # no archive just means there's nothing to restore yet
+            if metadata is None:
+                return [Step("restore", "true")]
+            # fetched from a presigned URL, so this doesn't wait on awscli
+            return [
+                Step(
+                    "restore",
+                    self._stream_restore_command(metadata),
+                    # the decompressor comes from apt
+                    requires=["mkdir", "apt_install", "transfer"],
+                )
+            ]
+
+        metadata = self._archive_metadata()
+        # a missing archive just means there's nothing to restore yet
+        if metadata is None:
+            return [Step("restore", "true")]
+        return [
+            Step(
+                "restore_download",
+                f"curl -sSf -o {self.app_settings.ARCHIVE_FILE_NAME}"
+                f" '{self._archive_url()}'",
+            ),
+            Step(
+                "restore",
+                archive_extract_command(
+                    self.app_settings.ARCHIVE_FILE_NAME,
+                    settings.APP_DIR,
+                    metadata.get("codec", DEFAULT_CODEC),
+                ),
+                requires=["mkdir", "apt_install", "restore_download"],
+            ),
+        ]
+
+    def _archive_url(self) -> str:
+        """ A presigned URL the droplet can fetch the archive from """
+        return s3_bucket().meta.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": settings.S3_BUCKET_NAME,
+                "Key": self.app_settings.S3_ARCHIVE_FILE_PATH,
+            },
+            ExpiresIn=3600,
+        )
+
+    def _archive_metadata(self):
+        """
+        The metadata stored next to the archive, ``{}`` for an archive made
+        without any, or None when there is no archive at all
+        """
+        try:
+            metadata = s3_bucket().Object(self.app_settings.S3_ARCHIVE_METADATA_PATH)
+            body = metadata.get()["Body"]
+            return json.loads(body.read().decode())
+        except ClientError:
+            pass
+        try:
+            s3_bucket().Object(self.app_settings.S3_ARCHIVE_FILE_PATH).load()
+        except ClientError:
+            return None
+        return {}
+
+    def _stream_restore_command(self, metadata: dict) -> str:
+        return stream_restore_command(
+            self._archive_url(),
+            settings.APP_DIR,
+            self._tool_path("transfer"),
+            sha256=metadata.get("sha256"),
+            codec=metadata.get("codec", DEFAULT_CODEC),
+            part_size=settings.RESTORE_PART_SIZE,
+            workers=settings.RESTORE_WORKERS,
+        )
+
+    def _create_steps(self):
+        """
+        Configuration plus everything needed to start the server. The image pull
+        and the archive download don't need awscli, so they run alongside apt.
+        """
+        game = game_for_image(settings.DOCKERFILE)
+        ports = game.ports if game else DEFAULT_PORTS
+        run_command = " ".join(
+            [
+                "docker run",
+                "-d",
+                *(f"-p {port}" for port in ports),
+                f"--name={self.app_name}",
+                "--restart=always",
+                f"-v {settings.APP_DIR}:/{self.app_name}",
+                f"{settings.DOCKERFILE}",
+            ]
+        )
+        restore_steps = self._restore_steps()
+        if settings.PERSISTENCE == "volume":
+            # the volume already has the files, unless it's brand new
+            for step in restore_steps:
+                step.command = volumes.if_empty_command(settings.APP_DIR, step.command)
+        return (
+            self._configure_steps()
+            + restore_steps
+            + [
+                self._docker_pull_step(),
+                Step("docker_run", run_command, requires=["docker_pull", "restore"]),
+            ]
+        )
+
+    def _docker_pull_step(self):
+        # DOCKERFILE tags are pinned, so a baked pull never needs repeating
+        return Step("docker_pull", f"docker pull {settings.DOCKERFILE}", cacheable=True)
+
+    def _bake_steps(self):
+        """
+        The configuration that's the same for every droplet of this image. AWS
+        credentials and the volume belong to the app, so they stay out of the
+        snapshot and are applied when a droplet is created from it.
+        """
+        excluded = {"aws_configure", "mount_volume"}
+        steps = [s for s in self._configure_steps() if s.name not in excluded]
+        for step in steps:
+            step.requires = tuple(r for r in step.requires if r not in excluded)
+        return steps + [self._docker_pull_step()]
+
+    def _run_step(self, step):
+        """ Runs one provisioning step on its own SSH channel """
+        with tracing.span("provision.step", step=step.name):
+            result = self._stream(step.command)
+        if result.exit_code:
+            print(f'Step "{step.name}" failed:\n{result.output}')
+        return result.exit_code
+
+    def _read_state(self) -> dict:
+        """ Fetches the fingerprints of configuration applied to the droplet """
+        _, stdout, _ = self._exec(f"cat {settings.REMOTE_STATE_FILE} 2>/dev/null")
+        try:
+            return json.loads(stdout.read().decode())
+        except ValueError:
+            return {}
+
+    def _write_state(self, state: dict):
+        """ Records the fingerprints of configuration applied to the droplet """
+        self._exec(
+            f"mkdir -p {settings.REMOTE_STATE_DIR}"
+            f" && echo {shlex.quote(json.dumps(state))} > {settings.REMOTE_STATE_FILE}"
+        )
+
+    def _provision(self, steps, force: bool = False):
+        """
+        Runs a provisioning plan, returning its timing report. Cacheable steps
+        whose fingerprint matches the droplet's recorded state are skipped,
+        unless ``force`` is set.
+        """
+        # connect before fanning out, so the threads share one transport
+        self.ssh_client
+        cacheable = {step.name for step in steps if step.cacheable}
+        wanted = {
+            name: value
+            for name, value in fingerprints(steps).items()
+            if name in cacheable
+        }
+        applied = {} if force else self._read_state()
+        skip = [name for name, value in wanted.items() if applied.get(name) == value]
+
+        try:
+            report = run_plan(steps, self._run_step, skip=skip)
+        except StepFailed as failure:
+            self._record_state(wanted, applied, failure.report)
+            raise
+        self._record_state(wanted, applied, report)
+        return report
+
+    def _record_state(self, wanted: dict, applied: dict, report):
+        """ Updates the droplet's state with the steps that just succeeded """
+        state = {name: value for name, value in applied.items() if name not in wanted}
+        state.update(
+            {name: wanted[name] for name in report.succeeded if name in wanted}
+        )
+        if state != applied:
+            self._write_state(state)
+
+    def _configure_droplet(self, force: bool = False):
+        """ Run standard configuration on the droplet, skipping applied steps """
+        self._attach_volume()
+        report = self._provision(self._configure_steps(), force=force)
+        return f"Droplet configured!\n{report.summary()}"
 
     def configure(self):
         """ Rerun configuration on a droplet """
-        return self._configure_droplet()
+        return self._configure_droplet(force=True)
 
     def exec(self, command=None):
         """ Run a command on the server. Not to be confused with ``_exec`` """
         if command is None:
             command = self.message_body
-        _, stdout, stderr = self._exec(command)
-        result = stdout.read().decode() or stderr.read().decode() or "Success"
-        return f'Ran command "{command}":\n{result}'
+        try:
+            result = self._stream(command, timeout=settings.EXEC_TIMEOUT or None)
+        except ssh.CommandTimedOut as error:
+            return f'Gave up on command "{command}": {error}\n{error.result.output}'
+        output = result.output or "Success"
+        if result.exit_code:
+            output += f"\nExited with status {result.exit_code}"
+        return f'Ran command "{command}":\n{output}'
 
     def backup(self):
         """ Tarballs app files, and uploads to S3 under ``S3_BUCKET_NAME`` """
+        if settings.BACKUP_LIVE:
+            return self._live_backup()
+        return self._backup(settings.APP_DIR)
+
+    def _backup(self, source: str, low_impact: bool = False):
+        """ Backs up ``source`` as app files, using ``settings.BACKUP_MODE`` """
+        if settings.BACKUP_MODE == "chunked":
+            return self._chunked_backup(source, low_impact)
+        if settings.BACKUP_MODE == "stream":
+            return self._stream_backup(source, low_impact)
+
         self.get_ip_address()
-        commands = [
-            f"tar -C {settings.APP_DIR} -zcvf {settings.ARCHIVE_FILE_NAME} .",
-            f"aws s3 cp {settings.ARCHIVE_FILE_NAME} s3://{settings.S3_BUCKET_NAME}/{settings.S3_ARCHIVE_FILE_PATH}",
-        ]
+        commands = archive_backup_commands(
+            source,
+            self.app_settings.ARCHIVE_FILE_NAME,
+            f"s3://{settings.S3_BUCKET_NAME}/{self.app_settings.S3_ARCHIVE_FILE_PATH}",
+            settings.BACKUP_CODEC,
+            rate_limit=settings.BACKUP_RATE_LIMIT if low_impact else 0,
+        )
+        # in order, so the metadata is only uploaded once the archive is
         for command in commands:
-            print(self.exec(command))
+            self._run_backup(command, low_impact)
         return f'Backed up app "{self.app_name}" to "{settings.S3_BUCKET_NAME}"'
 
+    def _backup_command(self, command: str, low_impact: bool) -> str:
+        """ Runs ``command`` at idle CPU and IO priority when ``low_impact`` """
+        if not low_impact:
+            return command
+        return f"nice -n 19 ionice -c 3 bash -c {shlex.quote(command)}"
+
+    def _run_backup(self, command: str, low_impact: bool = False):
+        """ Runs one backup command, raising ``BackupFailed`` if it fails """
+        result = self._stream(self._backup_command(command, low_impact))
+        print(result.output)
+        if result.exit_code:
+            raise BackupFailed(
+                f"Backup exited with status {result.exit_code}:\n{result.output}"
+            )
+
+    def _stream_backup(self, source: str, low_impact: bool = False):
+        """ Archives app files straight into a multipart upload """
+        command = stream_backup_command(
+            source,
+            f"s3://{settings.S3_BUCKET_NAME}/{self.app_settings.S3_ARCHIVE_FILE_PATH}",
+            self._tool_path("transfer"),
+            f"{settings.REMOTE_STATE_DIR}/{self.app_settings.ARCHIVE_FILE_NAME}.json",
+            settings.BACKUP_CODEC,
+            rate_limit=settings.BACKUP_RATE_LIMIT if low_impact else 0,
+        )
+        self._run_backup(command, low_impact)
+        return f'Backed up app "{self.app_name}" to "{settings.S3_BUCKET_NAME}"'
+
+    def _chunked_backup(self, source: str, low_impact: bool = False):
+        """ Uploads only the chunks of app files that S3 doesn't have yet """
+        command = self._chunkstore_command(
+            "backup",
+            source,
+            settings.S3_BUCKET_NAME,
+            self.app_settings.S3_CHUNK_STORE_PATH,
+            f"--keep {settings.BACKUP_RETENTION}",
+            f"--rate-limit {settings.BACKUP_RATE_LIMIT}" if low_impact else "",
+        )
+        self._run_backup(command, low_impact)
+        return (
+            f'Backed up app "{self.app_name}" to'
+            f' "{settings.S3_BUCKET_NAME}/{self.app_settings.S3_CHUNK_STORE_PATH}"'
+        )
+
+    def _rcon_command(self, game, commands) -> str:
+        """ Sends console commands to the game server through RCON """
+        args = [
+            f"python3 {self._tool_path('rcon')}",
+            f"--port {game.rcon_port}",
+            f"--timeout {settings.RCON_TIMEOUT}",
+        ]
+        if game.rcon_password_file:
+            args.append(
+                f"--password-file {settings.APP_DIR}/{game.rcon_password_file}"
+            )
+        if game.rcon_properties_file:
+            args.append(
+                f"--properties {settings.APP_DIR}/{game.rcon_properties_file}"
+            )
+        args.append("--ignore-unreachable")
+        args.extend(shlex.quote(command) for command in commands)
+        return " ".join(args)
+
+    def _live_backup(self):
+        """
+        Backs up a running server without stalling it. The game saves (and for
+        Minecraft stops saving) while the files are copied to
+        ``settings.SNAPSHOT_DIR``, then the copy is archived at idle priority
+        and with a throughput limit while the game carries on.
+        """
+        game = game_for_image(settings.DOCKERFILE)
+        # saving is turned back on whatever fails once it may be off, even the
+        # flush right after turning it off
+        try:
+            if game:
+                result = self._stream(self._rcon_command(game, game.pre_backup))
+                if result.exit_code:
+                    raise LiveBackupFailed(result.output)
+                if game.settle_seconds:
+                    time.sleep(game.settle_seconds)
+            # only changed files are copied, keeping the no-save window short
+            result = self._stream(
+                f"nice -n 10 ionice -c 2 -n 7 rsync -a --delete"
+                f" {settings.APP_DIR}/ {settings.SNAPSHOT_DIR}/"
+            )
+            if result.exit_code:
+                raise LiveBackupFailed(result.output)
+        finally:
+            if game and game.post_backup:
+                self._exec(self._rcon_command(game, game.post_backup))
+        return self._backup(settings.SNAPSHOT_DIR, low_impact=True)
+
+    def _chunked_restore(self):
+        """ Rebuilds app files from a manifest, named in the body or the newest """
+        command = self._chunkstore_command(
+            "restore",
+            settings.APP_DIR,
+            settings.S3_BUCKET_NAME,
+            self.app_settings.S3_CHUNK_STORE_PATH,
+            shlex.quote(self.message_body) if self.message_body else "",
+        )
+        result = self._stream(command)
+        print(result.output)
+        if result.exit_code:
+            raise RestoreFailed(
+                f"Restore exited with status {result.exit_code}:\n{result.output}"
+            )
+        return "Restored!"
+
+    def _stream_restore(self):
+        """ Extracts the archive while parallel ranged GETs download it """
+        metadata = self._archive_metadata()
+        if metadata is None:
+            return "Nothing to restore!"
+        # connect (and configure) first, so the URL doesn't age while we wait
+        self.ssh_client
+        result = self._stream(self._stream_restore_command(metadata))
+        if result.exit_code:
+            raise RestoreFailed(result.output)
+        if metadata.get("sha256"):
+            return "Restored! Checksum verified."
+        return "Restored!"
+
     def restore(self):
         """ Fetches app files from S3 under ``S3_BUCKET_Name`` and extracts """
-        self.get_ip_address()
+        if settings.BACKUP_MODE == "chunked":
+            return self._chunked_restore()
+        if settings.BACKUP_MODE == "stream":
+            return self._stream_restore()
+
+        metadata = self._archive_metadata()
+        if metadata is None:
+            return "Nothing to restore!"
         commands = [
-            f"aws s3 cp s3://{settings.S3_BUCKET_NAME}/{settings.S3_ARCHIVE_FILE_PATH} {settings.ARCHIVE_FILE_NAME}",
-            f"tar -xvzf {settings.ARCHIVE_FILE_NAME} -C {settings.APP_DIR}",
+            f"aws s3 cp s3://{settings.S3_BUCKET_NAME}/"
+            f"{self.app_settings.S3_ARCHIVE_FILE_PATH}"
+            f" {self.app_settings.ARCHIVE_FILE_NAME}",
+            archive_extract_command(
+                self.app_settings.ARCHIVE_FILE_NAME,
+                settings.APP_DIR,
+                metadata.get("codec", DEFAULT_CODEC),
+            ),
         ]
         for command in commands:
             print(self.exec(command))
         return "Restored!"
 
+    def benchmark(self):
+        """
+        Measures every codec (or those listed in the body, e.g. "zstd:3 lz4")
+        against a sample of the app directory
+        """
+        codecs = self.message_body.split() if self.message_body else []
+        command = " ".join(
+            [
+                f"python3 {self._tool_path('archive')} benchmark",
+                settings.APP_DIR,
+                f"--sample-mb {settings.BENCHMARK_SAMPLE_MB}",
+                *([f"--codecs {' '.join(map(shlex.quote, codecs))}"] if codecs else []),
+            ]
+        )
+        return self.exec(command)
+
+    @property
+    def telemetry_store(self):
+        return sizing.TelemetryStore(
+            s3_bucket(),
+            self.app_settings.S3_TELEMETRY_PATH,
+            settings.TELEMETRY_RETENTION,
+        )
+
+    def telemetry(self):
+        """
+        Samples the app container's CPU, memory, disk and network use for
+        ``settings.TELEMETRY_SECONDS`` (or the seconds given in the body) and
+        stores the series for "rightsize"
+        """
+        try:
+            seconds = int(self.message_body or settings.TELEMETRY_SECONDS)
+        except ValueError:
+            seconds = 0
+        if seconds <= 0:
+            return f'Can\'t sample for "{self.message_body}", give a number of seconds'
+        if not self._existing_droplet():
+            return "No droplet to measure"
+        # installs the sampler on droplets configured before it existed
+        self._configure_droplet()
+        command = " ".join(
+            [
+                f"python3 {self._tool_path('telemetry')} sample",
+                shlex.quote(self.app_name),
+                f"--seconds {seconds}",
+                f"--interval {settings.TELEMETRY_INTERVAL}",
+            ]
+        )
+        result = self._stream(command)
+        if result.exit_code:
+            return f"Sampling failed with status {result.exit_code}:\n{result.output}"
+        try:
+            series = json.loads(result.tail[-1])
+        except (IndexError, ValueError):
+            return f"Sampling printed no series:\n{result.output}"
+        key = self.telemetry_store.save(series)
+        used = sizing.usage([series])
+        return (
+            f'Sampled {used["samples"]} intervals into "{key}": at most'
+            f' {used["cpu_peak"]} cores and {used["memory_peak_mb"]} MB of memory'
+        )
+
+    def _recommendation(self, sizes) -> sizing.Recommendation:
+        return sizing.recommend(
+            self.telemetry_store.recent(),
+            sizes,
+            self._droplet_size(),
+            settings.DIGITALOCEAN_REGION_SLUG,
+            headroom=settings.SIZING_HEADROOM,
+            memory_reserve_mb=settings.SIZING_MEMORY_RESERVE_MB,
+            min_samples=settings.SIZING_MIN_SAMPLES,
+        )
+
+    def rightsize(self):
+        """ Suggests a droplet size for the app from its stored telemetry """
+        try:
+            return self._recommendation(self.manager.get_all_sizes()).describe()
+        except sizing.SizingException as error:
+            return str(error)
+
+    def resize(self):
+        """
+        Moves the app to the suggested droplet size, or to the size given in
+        the body, and makes it the size of droplets created for the app from
+        then on. The droplet is stopped while it's resized; its disk is left as
+        it is, so it can be sized down again later. A size with a smaller disk
+        than the droplet's can't be moved to in place, so it's left for the
+        app's next droplet.
+        """
+        sizes = self.manager.get_all_sizes()
+        if self.message_body:
+            slug = self.message_body.strip()
+        else:
+            recommendation = self._recommendation(sizes)
+            print(recommendation.describe())
+            slug = recommendation.size.slug
+        size = next((size for size in sizes if size.slug == slug), None)
+        if size is None:
+            return f'No droplet size is called "{slug}"'
+        self._set_app_options(size_slug=slug)
+        droplet = self._existing_droplet()
+        if droplet is None:
+            return f'Droplets for the app will be "{slug}" from now on'
+        droplet.load()
+        if droplet.size_slug == slug:
+            return f'The droplet is already "{slug}"'
+        if size.disk < droplet.disk:
+            return (
+                f'"{slug}" has a smaller disk than the droplet, so the app will'
+                " get it with its next droplet"
+            )
+
+        previous = droplet.size_slug
+        # powering off with writes still in memory would cut them off
+        command = f"docker stop {self.app_name} && sync"
+        result = self._stream(command)
+        if result.exit_code:
+            self._exec(f"docker start {self.app_name}")
+            raise ResizeAborted(
+                f"{command} exited with status {result.exit_code}:\n{result.output}"
+            )
+        self.state.disconnect()
+        for action in (
+            lambda: droplet.power_off(return_dict=False),
+            lambda: droplet.resize(slug, return_dict=False, disk=False),
+            # the container restarts with the droplet
+            lambda: droplet.power_on(return_dict=False),
+        ):
+            waiting.wait_for_action(action(), timeout=settings.ACTION_TIMEOUT)
+        droplet.size_slug = slug
+        return f'Resized the droplet from "{previous}" to "{slug}"'
+
+    def bake(self):
+        """
+        Provisions a temporary droplet for ``settings.DOCKERFILE``, pulls the
+        image and saves it as a snapshot that ``create`` then boots from. Older
+        snapshots beyond ``settings.SNAPSHOT_RETENTION`` are deleted.
+        """
+        data = {}
+        try:
+            messages = [stage() for _, stage in self._bake_stages(data)]
+        except Exception:
+            # not a job, so nothing would carry on with the droplet
+            droplet = self._bake_droplet(data)
+            if droplet is not None:
+                droplet.destroy()
+            raise
+        return "\n".join(message for message in messages if message)
+
+    def _bake_stages(self, data: dict):
+        """
+        ``bake`` as stages, which keep the snapshot's name and the droplet's ID
+        in ``data``. A bake job that fails keeps its droplet, so retrying it
+        carries on with that; the last stage destroys it.
+        """
+        steps = self._bake_steps()
+
+        def droplet():
+            if "snapshot_name" not in data:
+                version = images.bake_version(
+                    settings.BASE_IMAGE,
+                    settings.DOCKERFILE,
+                    *sorted(fingerprints(steps).items()),
+                )
+                newest = images.newest_snapshot(
+                    self.manager.get_my_images(),
+                    settings.DOCKERFILE,
+                    settings.DIGITALOCEAN_REGION_SLUG,
+                )
+                if newest and images.snapshot_version(newest) == version:
+                    data["up_to_date"] = True
+                    return f'Snapshot "{newest.name}" is already up to date'
+                data["snapshot_name"] = images.snapshot_name(
+                    settings.DOCKERFILE, version
+                )
+            baker = self._bake_droplet(data)
+            if baker is None:
+                self.get_ssh_key_fingerprint()
+                baker = digitalocean.Droplet(
+                    token=settings.DIGITALOCEAN_API_TOKEN,
+                    name=f"{self.app_settings.APP_NAME}-bake",
+                    region=settings.DIGITALOCEAN_REGION_SLUG,
+                    image=settings.BASE_IMAGE,
+                    size_slug=settings.DROPLET_SIZE,
+                    ssh_keys=[self.ssh_key.id],
+                )
+                baker.create()
+            data["droplet_id"] = baker.id
+            return f'Baking on droplet "{baker.name}" ({baker.id})'
+
+        def provision():
+            if data.get("up_to_date"):
+                return ""
+            baker = Controller(self.app_name, state=AppState())
+            baker.state.private_key = self.private_key
+            baker.state.droplet = self._booted(self._bake_droplet(data))
+            try:
+                report = baker._provision(steps, force=True)
+                baker._exec("sync")
+            finally:
+                baker.state.disconnect()
+            return report.summary()
+
+        def snapshot():
+            if data.get("up_to_date"):
+                return ""
+            name = data["snapshot_name"]
+            if any(image.name == name for image in self.manager.get_my_images()):
+                return f'Snapshot "{name}" was already taken'
+            baker = self._bake_droplet(data)
+            if baker is None:
+                raise DropletDoesNotExist("The bake droplet is gone")
+            # a worker that ran out of time may have left one going
+            action = next(
+                (
+                    action
+                    for action in baker.get_actions()
+                    if action.type == "snapshot" and action.status == "in-progress"
+                ),
+                None,
+            )
+            if action is None:
+                if baker.status != "off":
+                    # powered off first, for a snapshot of a cleanly stopped disk
+                    waiting.wait_for_action(
+                        baker.power_off(return_dict=False),
+                        timeout=settings.ACTION_TIMEOUT,
+                    )
+                action = baker.take_snapshot(name, return_dict=False)
+            try:
+                waited = waiting.wait_for_action(
+                    action, timeout=settings.SNAPSHOT_TIMEOUT, longest=30
+                )
+            except waiting.WaitException as error:
+                raise SnapshotFailed(f'Snapshot "{name}" failed: {error}')
+            return f'Snapshot "{name}" took {waited.seconds:.0f}s'
+
+        def cleanup():
+            if data.get("up_to_date"):
+                return ""
+            baker = self._bake_droplet(data)
+            if baker is not None:
+                baker.destroy()
+            expired = images.expired_snapshots(
+                self.manager.get_my_images(),
+                settings.DOCKERFILE,
+                settings.SNAPSHOT_RETENTION,
+            )
+            for image in expired:
+                image.destroy()
+            return (
+                f'Baked snapshot "{data["snapshot_name"]}", deleted'
+                f" {len(expired)} old snapshot(s)"
+            )
+
+        return [
+            ("droplet", droplet),
+            ("provision", provision),
+            ("snapshot", snapshot),
+            ("cleanup", cleanup),
+        ]
+
+    def _bake_droplet(self, data: dict):
+        """
+        The droplet a bake is using: the one in ``data``, or else one left by a
+        run that was cut short before it could record it. None if there isn't one
+        """
+        if data.get("droplet_id"):
+            try:
+                return self.manager.get_droplet(data["droplet_id"])
+            except digitalocean.NotFoundError:
+                return None
+        name = f"{self.app_settings.APP_NAME}-bake"
+        found = [d for d in self.manager.get_all_droplets() if d.name == name]
+        return found[0] if found else None
+
+    def _booted(self, droplet):
+        """ ``droplet`` once it's active, which a new one isn't straight away """
+        if droplet is None:
+            raise DropletDoesNotExist("The bake droplet is gone")
+
+        def active():
+            droplet.load()
+            return droplet if droplet.status == "active" else None
+
+        waiting.wait_for(
+            active,
+            timeout=settings.ACTION_TIMEOUT,
+            description=f'droplet "{droplet.name}" to boot',
+        )
+        return droplet
+
+    def refill_pool(self):
+        """
+        Tops the warm pool up to ``settings.POOL_SIZE`` standby droplets, within
+        ``settings.POOL_MAX_MONTHLY_COST``, and configures the new ones
+        """
+        # counted and created under the pool's lease, so concurrent refills
+        # don't both top it up; new droplets are tagged as they're created, so
+        # the next count includes them
+        try:
+            with self._pool_lease():
+                standing_by = self.manager.get_all_droplets(
+                    tag_name=pool.pool_tag(self.app_name, settings.DOCKERFILE)
+                )
+                count = pool.droplets_to_add(
+                    len(standing_by),
+                    settings.POOL_SIZE,
+                    self._droplet_price(),
+                    settings.POOL_MAX_MONTHLY_COST,
+                )
+                if not count:
+                    return f"Warm pool has {len(standing_by)} droplet(s), none added"
+                self.get_ssh_key_fingerprint()
+                droplets = digitalocean.Droplet.create_multiple(
+                    token=settings.DIGITALOCEAN_API_TOKEN,
+                    names=pool.standby_names(
+                        self.app_name, settings.DOCKERFILE, count
+                    ),
+                    region=settings.DIGITALOCEAN_REGION_SLUG,
+                    image=self._image(),
+                    size_slug=settings.DROPLET_SIZE,
+                    ssh_keys=[self.ssh_key.id],
+                    tags=[pool.pool_tag(self.app_name, settings.DOCKERFILE)],
+                )
+        except leases.LeaseHeld:
+            return "Warm pool is busy, none added"
+        # loaded before fanning out, so the threads don't all fetch it
+        self.private_key
+        # they share one create action
+        self._wait_until_active(droplets[0])
+        with ThreadPoolExecutor(max_workers=len(droplets)) as executor:
+            configure = tracing.in_context(self._configure_standby)
+            configured = list(executor.map(configure, droplets))
+        ready = [droplet for droplet, ok in zip(droplets, configured) if ok]
+        if ready:
+            pool.mark_ready(
+                settings.DIGITALOCEAN_API_TOKEN,
+                self.app_name,
+                settings.DOCKERFILE,
+                ready,
+            )
+        return f"Added {len(ready)} of {count} standby droplet(s) to the warm pool"
+
+    def _configure_standby(self, droplet) -> bool:
+        """
+        Runs the image's bake steps on a new standby droplet, destroying it if
+        they fail
+        """
+        standby = Controller(self.app_name, state=AppState())
+        standby.state.droplet = droplet
+        standby.state.private_key = self.private_key
+        try:
+            standby._provision(self._bake_steps())
+        except Exception as error:  # pylint: disable=broad-except
+            print(f'Standby droplet "{droplet.name}" failed to configure: {error}')
+            droplet.destroy()
+            return False
+        finally:
+            if standby.state.ssh_client is not None:
+                standby.state.ssh_client.close()
+        return True
+
     def hard_destroy(self):
         return self.destroy(hard=True)
 
     def destroy(self, hard=False):
-        if not hard:
-            self._exec("warn.sh")
+        for _, stage in self._destroy_stages(hard):
+            stage()
+        return "Destroyed!"
 
-        self.backup()
-        self.droplet.destroy()
+    def _destroy_stages(self, hard: bool = False):
+        """
+        ``destroy`` as stages. A rerun finds the droplet already gone rather
+        than creating a new one to back up
+        """
+
+        def warn():
+            if self._existing_droplet():
+                self._exec("warn.sh")
+
+        def save():
+            if not self._existing_droplet():
+                return "No droplet to save"
+            if settings.PERSISTENCE != "volume":
+                return self.backup()
+            # the files outlive the droplet on the volume, so there's nothing
+            # to upload; just make sure everything has reached it, as detaching
+            # a volume that's still written to loses what hadn't
+            for command in (
+                f"docker stop {self.app_name}",
+                volumes.unmount_command(settings.APP_DIR),
+            ):
+                result = self._stream(command)
+                if result.exit_code:
+                    raise VolumeNotFlushed(
+                        f"{command} exited with status {result.exit_code}:\n"
+                        f"{result.output}"
+                    )
+            volumes.detach(
+                self.volume,
+                self.droplet.id,
+                settings.DIGITALOCEAN_REGION_SLUG,
+                timeout=settings.ACTION_TIMEOUT,
+            )
+            return "Detached the volume"
+
+        def destroy():
+            if not self._existing_droplet():
+                return "No droplet to destroy"
+            droplet_id = self.droplet.id
+            self.droplet.destroy()
+            self.state.forget_droplet()
+            self.resource_index.forget("droplet_id", "ip_address", "host_key")
+            # the name stays taken until the droplet is really gone
+            waiting.wait_until_gone(
+                lambda: self.manager.get_droplet(droplet_id),
+                timeout=settings.ACTION_TIMEOUT,
+                description=f"droplet {droplet_id} to be destroyed",
+            )
+            return "Destroyed!"
 
-        return "Destroyed!"
+        stages = [] if hard else [("warn", warn)]
+        return stages + [("save", save), ("destroy", destroy)]
 
     def create(self):
-        command = " ".join(
-            [
-                "docker run",
-                "-p 34197:34197/udp",
-                "-p 27015:27015/tcp",
-                "-it",
-                f"--name={self.app_name}",
-                "--restart=always",
-                f"-v {settings.APP_DIR}:/{self.app_name}",
-                f"{settings.DOCKERFILE}",
-            ]
+        """
+        Creates and provisions the droplet, starts the server and waits until it
+        accepts players, reporting where the time went
+        """
+        messages = [stage() for _, stage in self._create_stages()]
+        return "\n".join(messages)
+
+    def _create_stages(self):
+        """ ``create`` as stages, each of which carries on from a partial run """
+        phases = readiness.Phases()
+
+        def droplet():
+            # configuration is part of the create plan, so skip the implicit
+            # configure that ``self.droplet`` would run
+            with phases.phase("api_create"):
+                if self.state.droplet is None:
+                    self.state.droplet = self._get_droplet()
+                self._attach_volume()
+            with phases.phase("ip"):
+                ip = self.get_ip_address()
+            with phases.phase("ssh"):
+                self.ssh_client
+            return f"Created a new dropplet @ {ip}"
+
+        def provision():
+            if self.state.droplet is None:
+                self.state.droplet = self._get_droplet()
+            steps = self._create_steps()
+            report = self._provision(steps)
+            self._add_provision_phases(phases, steps, report)
+            return report.summary()
+
+        def game_ready():
+            if self.state.droplet is None:
+                self.state.droplet = self._get_droplet()
+            ready = self._wait_until_playable(self.get_ip_address(), phases)
+            return f"{ready}\n{phases.summary()}"
+
+        return [
+            ("droplet", droplet),
+            ("provision", provision),
+            ("game_ready", game_ready),
+        ]
+
+    def job_stages(self, action: str, job=None):
+        """
+        ``action`` as a list of ``(name, function)`` stages. Stages keep what
+        later ones need in ``job.data``, which is saved after each of them
+        """
+        if action == "bake":
+            return self._bake_stages(job.data if job is not None else {})
+        if action == "create":
+            return self._create_stages()
+        if action in ("destroy", "hard_destroy"):
+            return self._destroy_stages(hard=action == "hard_destroy")
+        return [(action, self.actions[action])]
+
+    @property
+    def job_store(self):
+        if settings.JOB_STORE == "directory":
+            return jobs.DirectoryJobStore(settings.JOB_DIR)
+        return jobs.S3JobStore(s3_bucket(), settings.S3_JOBS_PATH)
+
+    @property
+    def lease_store(self):
+        if settings.JOB_STORE == "directory":
+            return leases.DirectoryLeaseStore(os.path.join(settings.JOB_DIR, "leases"))
+        return leases.S3LeaseStore(s3_bucket(), settings.S3_LEASES_PATH)
+
+    def submit(self, action: str, wait: bool = False):
+        """
+        Starts ``action`` as a job, or attaches to the same request's unfinished
+        job. With ``wait``, runs the job here, or waits for the worker already
+        running it, and returns how it went.
+        """
+        # one submission per app at a time, so duplicates find the first's job
+        with leases.hold(
+            self.lease_store,
+            f"{self.app_name}.submit",
+            uuid.uuid4().hex,
+            ttl=60,
+            wait=settings.LEASE_WAIT,
+        ):
+            job, new = jobs.submit(
+                self.job_store,
+                action,
+                self.app_name,
+                self.message_body,
+                lease_seconds=settings.JOB_LEASE_SECONDS,
+            )
+        if wait:
+            return self.run_job(job.id) if new else self._wait_for_job(job)
+        if not new:
+            return f"Job {job.id} is already {job.state}, check on it with status"
+        self._start_job(job)
+        return f"Started job {job.id}, check on it with status"
+
+    def _wait_for_job(self, job) -> str:
+        store = self.job_store
+
+        def finished():
+            loaded = store.load(job.app_name, job.id)
+            return loaded if loaded.state in jobs.FINISHED else None
+
+        waited = waiting.wait_for(
+            finished,
+            timeout=settings.JOB_LEASE_SECONDS,
+            description=f"job {job.id}",
+            first=1.0,
+            longest=10.0,
         )
-        self._exec(command)
-        return f"Created a new dropplet @ {self.get_ip_address()}"
+        return waited.value.describe()
+
+    def _start_job(self, job):
+        self._invoke_later(
+            {"action": "run_job", "app_name": job.app_name, "body": job.id},
+            lambda: Controller(job.app_name).run_job(job.id),
+        )
+
+    def run_job(self, job_id: str = None, time_left=None):
+        """
+        Works through a job's stages while holding the app's lease, so jobs for
+        an app run one at a time. A worker running out of time hands the rest
+        over to a new one
+        """
+        store = self.job_store
+        job = store.load(self.app_name, job_id or self.message_body)
+        if time_left is None:
+            wait = settings.JOB_LEASE_SECONDS
+        else:
+            wait = max(0, time_left() - settings.JOB_STAGE_MARGIN)
+        try:
+            with leases.hold(
+                self.lease_store,
+                job.app_name,
+                f"{job.id}-{uuid.uuid4().hex[:8]}",
+                ttl=settings.JOB_LEASE_SECONDS,
+                wait=wait,
+            ) as lease:
+                # loaded again, in case another worker finished it meanwhile
+                job = store.load(job.app_name, job.id)
+                worker = Controller(job.app_name, job.body)
+                stages = [
+                    (name, self._renewing(lease, stage))
+                    for name, stage in worker.job_stages(job.action, job)
+                ]
+                job = jobs.run(
+                    store,
+                    job,
+                    stages,
+                    time_left=time_left,
+                    margin=settings.JOB_STAGE_MARGIN,
+                )
+        except leases.LeaseHeld:
+            # another job for the app is taking a while, queue behind it again
+            self._start_job(job)
+            return f"{job.describe()}\nWaiting for another job on this app"
+        if job.state == jobs.QUEUED:
+            self._start_job(job)
+        return job.describe()
+
+    def _renewing(self, lease, stage):
+        """ ``stage``, extending ``lease`` first so it outlasts long jobs """
+
+        def renewed():
+            leases.acquire(
+                self.lease_store,
+                lease.name,
+                lease.owner,
+                ttl=settings.JOB_LEASE_SECONDS,
+            )
+            return stage()
+
+        return renewed
+
+    def status(self):
+        """
+        Progress of the job named in the body, or of the app's latest job. A
+        job whose worker died is started again
+        """
+        store = self.job_store
+        try:
+            if self.message_body:
+                job = store.load(self.app_name, self.message_body)
+            else:
+                job = jobs.latest(store, self.app_name)
+        except jobs.JobNotFound:
+            return f'No job "{self.message_body}"'
+        if job is None:
+            return "No jobs yet"
+        if job.stalled(settings.JOB_LEASE_SECONDS):
+            self._start_job(job)
+            return f"{job.describe()}\nIts worker stopped responding, restarted it"
+        return job.describe()
+
+    def _add_provision_phases(self, phases, steps, report):
+        """
+        Splits the provisioning plan into phases. Its steps overlap, so
+        "configure" is the time until the last configuration step finished,
+        while "restore" and "container_start" are the time their steps took.
+        """
+        configure = {step.name for step in self._configure_steps()}
+        finished = [report.finished[n] for n in configure if n in report.finished]
+        phases.add("configure", max(finished, default=0))
+        restore = [
+            step.name
+            for step in steps
+            if step.name.startswith("restore") and step.name not in report.skipped
+        ]
+        phases.add("restore", sum(report.durations.get(n, 0) for n in restore))
+        phases.add("container_start", report.durations.get("docker_run", 0))
+
+    def _wait_until_playable(self, ip: str, phases) -> str:
+        """ Probes the game until it answers, as the "game_ready" phase """
+        game = game_for_image(settings.DOCKERFILE)
+        if game is None or game.ready_probe is None:
+            return "Not waiting for the server, there's no probe for this image"
+        with phases.phase("game_ready"):
+            try:
+                readiness.wait_until_ready(
+                    game, ip, timeout=settings.GAME_READY_TIMEOUT
+                )
+            except waiting.WaitTimedOut:
+                return (
+                    f"{game.name} wasn't answering after"
+                    f" {settings.GAME_READY_TIMEOUT}s, it may still be starting"
+                )
+        return f"{game.name} is accepting players"
 
     def point_route53(self):
         route53 = boto3.client("route53")
         route53.create_traffic_policy_instance(
             HostedZoneID="srv_a_record",
-            Name=settings.APP_NAME,
+            Name=self.app_settings.APP_NAME,
             TTL=3600,
             TrafficPolicyID="srv_a_record",
             TrafficPolicyVersion=1,
         )
 
 
+# clients are made on first use rather than at import, so a cold start only pays
+# for those its request needs; they're then kept for the life of the process
+_s3_lock = threading.Lock()
+_s3_bucket = None
+
+
+def do_client() -> doclient.Client:
+    """ The process's DigitalOcean API client, installed on first use """
+    return doclient.install(
+        burst=settings.DO_API_BURST,
+        rate_per_minute=settings.DO_API_RATE_PER_MINUTE,
+        max_retries=settings.DO_API_MAX_RETRIES,
+    )
+
+
+def s3_bucket():
+    """ The bucket everything's stored in, its client made on first use """
+    global _s3_bucket  # pylint: disable=global-statement
+    with _s3_lock:
+        if _s3_bucket is None:
+            s3 = boto3.resource("s3", endpoint_url=settings.S3_ENDPOINT_URL)
+            tracing.instrument_boto3(s3.meta.client)
+            _s3_bucket = s3.Bucket(settings.S3_BUCKET_NAME)  # pylint: disable=no-member
+        return _s3_bucket
+
+
 controller = Controller()
-s3 = boto3.resource("s3")
-s3_bucket = s3.Bucket(settings.S3_BUCKET_NAME)  # pylint: disable=no-member
+in_flight = doclient.Coalescer()
+
+
+def run_action(app_name: str, action: str, body="", wait=False, time_left=None):
+    """ Runs ``action`` for one app: as a job if it's one, or else directly """
+    # a controller per request, as a shared one would be changed under the
+    # feet of any other request in the process
+    app_controller = Controller(app_name, body)
+
+    with tracing.span("action", action=action, app_name=app_name):
+        if action in settings.JOB_ACTIONS:
+            return app_controller.submit(action, wait=wait)
+        if action == "run_job":
+            return app_controller.run_job(time_left=time_left)
+        # identical requests in flight in this process share one answer
+        return in_flight.run(
+            (app_name, action, json.dumps(body)), app_controller.actions[action]
+        )
+
+
+def run_fleet(action: str, tag: str, body="", wait=False, parallelism=None):
+    """
+    Runs ``action`` for every app whose droplet is tagged ``tag``, a few at a
+    time, reporting how each went
+    """
+    start = time.monotonic()
+    results = fleet.run(
+        fleet.app_names(controller.manager, tag),
+        lambda app_name: run_action(app_name, action, body, wait),
+        parallelism or settings.FLEET_PARALLELISM,
+    )
+    return fleet.summary(action, results, time.monotonic() - start)
 
 
 def lambda_handler(event: dict, context: object):
     """ Actually handles the lambda call """
     action = event["action"]
-    app_name = event["app_name"]
     body = event.get("body", "")
-    controller.app_name = app_name
-    controller.message_body = body
+    wait = event.get("wait", False)
+
+    with tracing.trace(
+        action,
+        enabled=settings.TRACING,
+        sample_rate=settings.TRACE_SAMPLE_RATE,
+        min_ms=settings.TRACE_MIN_MS,
+        app_name=event.get("app_name"),
+        tag=event.get("tag"),
+    ) as trace:
+        if event.get("all") or event.get("tag"):
+            tag = event.get("tag") or fleet.APP_TAG
+            target = f'apps tagged "{tag}"'
+            response = run_fleet(action, tag, body, wait, event.get("parallelism"))
+        else:
+            app_name = event["app_name"]
+            target = f'app "{app_name}"'
+            time_left = getattr(context, "get_remaining_time_in_millis", None)
+            response = run_action(
+                app_name,
+                action,
+                body,
+                wait,
+                time_left=(lambda: time_left() / 1000) if time_left else None,
+            )
 
-    act = controller.actions.get(action)
-    response = act()
+    # ends up in the function's logs, for spotting slow or throttled endpoints
+    if doclient.installed():
+        print(f"DigitalOcean API: {doclient.installed().metrics.summary()}")
 
-    message = f'Called action "{action}" for app "{app_name}".\n'
+    message = f'Called action "{action}" for {target}.\n'
     if response:
         message += response
 
-    return {"message": message}
+    return {"message": message, "trace": trace.summary() if trace else None}
 
 
 if __name__ == "__main__":
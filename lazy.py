@@ -0,0 +1,46 @@
+"""
+Imports deferred to first use, so a cold start only pays for the libraries its
+request needs: boto3, paramiko and python-digitalocean each take a sizeable
+part of a second to import in a small lambda, and a job submission or status
+check needs none of them.
+"""
+
+import importlib
+import threading
+
+
+class LazyModule(object):
+    """ Stands in for a module, importing it when an attribute is first used """
+
+    def __init__(self, name: str, on_load=None):
+        self._name = name
+        self._on_load = on_load
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            # imports are thread safe, the lock only saves a second lookup
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_load is not None:
+                        # before it's published, so no other thread skips it
+                        self._on_load(module)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, name: str):
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded yet"
+        return f"<lazy module {self._name!r}, {state}>"
+
+
+def module(name: str, on_load=None) -> LazyModule:
+    """
+    ``name``, to be imported the first time one of its attributes is used,
+    when ``on_load(module)`` is called if given
+    """
+    return LazyModule(name, on_load)
@@ -0,0 +1,227 @@
+"""
+Per-app leases, so only one invocation works on an app at a time.
+
+A lease is a small record of who holds it and until when, kept with
+conditional writes: it's only created if there is none, and only replaced if
+it hasn't changed since it was read. A holder that dies stops blocking
+everyone else once its lease runs out.
+"""
+
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
+
+import waiting
+
+# what S3 answers when a conditional write loses
+CONFLICTS = ("PreconditionFailed", "ConditionalRequestConflict", "412", "409")
+# request parameters for conditional writes, and the headers they become
+CONDITION_HEADERS = {"IfMatch": "If-Match", "IfNoneMatch": "If-None-Match"}
+
+
+class LeaseException(Exception):
+    """ Base Exception class for file """
+
+
+class LeaseHeld(LeaseException):
+    """ Someone else held the lease for longer than we would wait """
+
+
+class Lease(object):
+    """ ``owner``'s hold on ``name``, until ``expires_at`` """
+
+    def __init__(self, name: str, owner: str, expires_at: float):
+        self.name = name
+        self.owner = owner
+        self.expires_at = expires_at
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(**data)
+
+    def expired(self, now: float = None) -> bool:
+        return (time.time() if now is None else now) >= self.expires_at
+
+
+class DirectoryLeaseStore(object):
+    """
+    Leases as files in a local directory, for running locally. Conditional
+    writes are made atomic with a lock file next to the lease.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.json")
+
+    @contextmanager
+    def _locked(self, name: str):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file(name) + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self, name: str):
+        try:
+            with open(self._file(name)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def read(self, name: str):
+        """ The lease record and a version to make writes conditional on """
+        text = self._read(name)
+        return (None, None) if text is None else (json.loads(text), text)
+
+    def write(self, name: str, record: dict, version) -> bool:
+        """ Writes ``record`` if the lease is still at ``version`` (None: absent) """
+        with self._locked(name):
+            if self._read(name) != version:
+                return False
+            temporary = self._file(name) + ".tmp"
+            with open(temporary, "w") as f:
+                json.dump(record, f)
+            os.replace(temporary, self._file(name))
+            return True
+
+    def delete(self, name: str, version) -> bool:
+        with self._locked(name):
+            if self._read(name) != version:
+                return False
+            os.remove(self._file(name))
+            return True
+
+
+def _stash_conditions(params, context, **kwargs):
+    # botocore older than 1.35 rejects these parameters, so they're taken out
+    # before validation and sent as headers by ``_send_conditions``
+    headers = {
+        header: params.pop(parameter)
+        for parameter, header in CONDITION_HEADERS.items()
+        if parameter in params
+    }
+    if headers:
+        context["lease_conditions"] = headers
+
+
+def _send_conditions(params, context, **kwargs):
+    params["headers"].update(context.get("lease_conditions", {}))
+
+
+def allow_conditions(client):
+    """
+    Lets ``client``'s PutObject and DeleteObject take ``IfMatch`` and
+    ``IfNoneMatch`` whatever its botocore version
+    """
+    events = client.meta.events
+    for operation in ("PutObject", "DeleteObject"):
+        events.register(
+            f"before-parameter-build.s3.{operation}",
+            _stash_conditions,
+            unique_id=f"leases-stash-{operation}",
+        )
+        events.register(
+            f"before-call.s3.{operation}",
+            _send_conditions,
+            unique_id=f"leases-send-{operation}",
+        )
+
+
+class S3LeaseStore(object):
+    """ Leases as JSON objects under ``prefix``, written with S3 conditional writes """
+
+    def __init__(self, bucket, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        allow_conditions(bucket.meta.client)
+
+    def _object(self, name: str):
+        return self.bucket.Object(f"{self.prefix}/{name}.json")
+
+    def read(self, name: str):
+        try:
+            response = self._object(name).get()
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None, None
+            raise
+        return json.loads(response["Body"].read().decode()), response["ETag"]
+
+    def write(self, name: str, record: dict, version) -> bool:
+        condition = {"IfMatch": version} if version else {"IfNoneMatch": "*"}
+        try:
+            self._object(name).put(
+                Body=json.dumps(record).encode(),
+                ContentType="application/json",
+                **condition,
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] in CONFLICTS:
+                return False
+            raise
+        return True
+
+    def delete(self, name: str, version) -> bool:
+        try:
+            self._object(name).delete(IfMatch=version)
+        except ClientError as error:
+            if error.response["Error"]["Code"] in CONFLICTS:
+                return False
+            raise
+        return True
+
+
+def acquire(store, name: str, owner: str, ttl: float, now: float = None):
+    """
+    Takes the lease on ``name`` for ``ttl`` seconds, or extends it if ``owner``
+    already holds it. Returns the lease, or None while someone else holds it.
+    """
+    now = time.time() if now is None else now
+    record, version = store.read(name)
+    if record is not None:
+        held = Lease.from_dict(record)
+        if held.owner != owner and not held.expired(now):
+            return None
+    lease = Lease(name, owner, now + ttl)
+    return lease if store.write(name, lease.to_dict(), version) else None
+
+
+def release(store, lease: Lease):
+    """ Gives the lease up, unless it has already passed to someone else """
+    record, version = store.read(lease.name)
+    if record is not None and record["owner"] == lease.owner:
+        store.delete(lease.name, version)
+
+
+@contextmanager
+def hold(store, name: str, owner: str, ttl: float, wait: float = 0, **options):
+    """
+    Holds the lease on ``name`` for the block, waiting up to ``wait`` seconds
+    for it. Raises ``LeaseHeld`` if it's still taken by then.
+    """
+    options.setdefault("first", 0.5)
+    options.setdefault("longest", 5.0)
+    try:
+        waited = waiting.wait_for(
+            lambda: acquire(store, name, owner, ttl),
+            timeout=wait,
+            description=f'the lease on "{name}"',
+            **options,
+        )
+    except waiting.WaitTimedOut as error:
+        raise LeaseHeld(str(error))
+    try:
+        yield waited.value
+    finally:
+        release(store, waited.value)
@@ -0,0 +1,330 @@
+"""
+Runs an app through create, configure, backup, restore and destroy against
+the local stand-ins in ``fakes``, with no account or network needed, and
+reports for each action how long it took, the DigitalOcean and S3 calls it
+made, the SSH commands it ran and the bytes it moved.
+
+After the rounds, the actions run once more with the process forgetting its
+droplet, keys, connection and resource index before each one, as every
+invocation of a cold lambda would. These are reported as e.g. "create (cold)".
+
+The stand-ins' delays resemble a real droplet's, scaled down by --time-scale
+so a run takes seconds. Results can be saved and later compared, so a change
+can be measured against what came before it:
+
+    python lifecycle_benchmark.py --rounds 3 --save baseline.json
+    python lifecycle_benchmark.py --rounds 3 --baseline baseline.json
+
+Settings such as BACKUP_MODE or BACKUP_CODEC are taken from the environment.
+Only the "archive" backup mode moves bytes through the fake droplet's S3.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import fakes
+import jobs
+
+ACTIONS = ("create", "configure", "backup", "restore", "destroy")
+APP_NAME = "benchmark"
+BUCKET = "auto-server-benchmark"
+
+# seconds things take on a real droplet, before --time-scale
+BOOT_SECONDS = 45.0
+IP_SECONDS = 10.0
+DESTROY_SECONDS = 5.0
+COMMAND_SECONDS = 0.2
+# (pattern, seconds, lines of output) for the slow or verbose commands
+COMMAND_RULES = [
+    ("apt-get --assume-yes update", 8.0, 40),
+    ("apt --assume-yes install", 20.0, 400),
+    ("docker pull", 15.0, 30),
+    ("docker run", 2.0, 1),
+    ("tar -C .* -cvf", 10.0, 2000),
+    ("tar -C .* -xvf", 8.0, 2000),
+    ("aws s3 cp", 5.0, 2),
+    ("curl ", 5.0, 0),
+]
+# metrics compared against a baseline, and what they're called in reports
+METRICS = {
+    "seconds": "s",
+    "do_calls": "DO calls",
+    "s3_requests": "S3 requests",
+    "s3_bytes": "S3 bytes",
+    "droplet_s3_bytes": "droplet S3 bytes",
+    "ssh_commands": "SSH commands",
+    "ssh_connections": "SSH connections",
+    "ssh_bytes": "SSH bytes",
+}
+
+
+class LifecycleBenchmarkException(Exception):
+    """ Base Exception class for file """
+
+
+class ActionFailed(LifecycleBenchmarkException):
+    """ An action didn't succeed against the stand-ins """
+
+
+def start_fakes(time_scale: float, archive_bytes: int):
+    """ The stand-ins, started, as ``(digitalocean, s3, ssh)`` """
+    digitalocean = fakes.FakeDigitalOcean(
+        boot_delay=BOOT_SECONDS * time_scale,
+        ip_delay=IP_SECONDS * time_scale,
+        destroy_delay=DESTROY_SECONDS * time_scale,
+        action_delay=BOOT_SECONDS * time_scale,
+    ).start()
+    s3 = fakes.FakeS3().start()
+    rules = [
+        fakes.CommandRule(pattern, seconds * time_scale, lines)
+        for pattern, seconds, lines in COMMAND_RULES
+    ]
+    ssh = fakes.FakeSSHServer(
+        s3,
+        seconds=COMMAND_SECONDS * time_scale,
+        rules=rules,
+        archive_bytes=archive_bytes,
+    ).start()
+    return digitalocean, s3, ssh
+
+
+def configure_environment(digitalocean, s3, ssh, workdir: str):
+    """
+    Points the controller's settings at the stand-ins. They're read when
+    ``settings`` is imported, so this comes first
+    """
+    os.environ.pop("AWS_LAMBDA_FUNCTION_NAME", None)
+    os.environ.update(
+        APP_NAME=APP_NAME,
+        DIGITALOCEAN_API_TOKEN="benchmark",
+        DIGITALOCEAN_END_POINT=f"{digitalocean.url}/v2/",
+        S3_BUCKET_NAME=BUCKET,
+        S3_ENDPOINT_URL=s3.url,
+        AWS_ACCESS_KEY_ID="benchmark",
+        AWS_SECRET_ACCESS_KEY="benchmark",
+        SSH_PORT=str(ssh.port),
+        KEY_CACHE_DIR=os.path.join(workdir, "keys"),
+        JOB_DIR=os.path.join(workdir, "jobs"),
+        POOL_SIZE="0",
+        PERSISTENCE="s3",
+    )
+    for name, value in [
+        ("AWS_DEFAULT_REGION", "us-east-1"),
+        ("AWS_REGION_ID", "us-east-1"),
+        ("AWS_OUTPUT_FORMAT", "json"),
+        ("APP_DIR", "/opt/benchmark"),
+        ("DOCKERFILE", "auto-server/benchmark:1"),
+        ("DIGITALOCEAN_REGION_SLUG", "nyc1"),
+    ]:
+        os.environ.setdefault(name, value)
+
+
+def counters(digitalocean, s3, ssh) -> dict:
+    """ Running totals of everything the stand-ins were asked to do """
+    return {
+        "do_calls": sum(digitalocean.calls.values()),
+        "do_endpoints": dict(digitalocean.calls),
+        "s3_requests": sum(s3.calls.values()),
+        "s3_bytes": s3.bytes_in["lambda"] + s3.bytes_out["lambda"],
+        "droplet_s3_bytes": s3.bytes_in["droplet"] + s3.bytes_out["droplet"],
+        "ssh_commands": len(ssh.commands),
+        "ssh_connections": ssh.connections,
+        "ssh_bytes": ssh.bytes_sent,
+    }
+
+
+def difference(before: dict, after: dict) -> dict:
+    changed = {
+        name: after[name] - before[name]
+        for name in after
+        if not isinstance(after[name], dict)
+    }
+    changed["do_endpoints"] = {
+        endpoint: count - before["do_endpoints"].get(endpoint, 0)
+        for endpoint, count in after["do_endpoints"].items()
+        if count != before["do_endpoints"].get(endpoint, 0)
+    }
+    return changed
+
+
+def run_round(lambda_function, stand_ins, verbose: bool = False, cold=False):
+    """
+    Each of ``ACTIONS`` once, measured, in order. With ``cold``, whatever the
+    process remembers is forgotten before each
+    """
+    phases = []
+    for action in ACTIONS:
+        if cold:
+            lambda_function.AppState.clear_process_cache()
+            lambda_function.ResourceIndex.clear_process_cache()
+        before = counters(*stand_ins)
+        output = io.StringIO()
+        start = time.monotonic()
+        with contextlib.redirect_stdout(sys.stdout if verbose else output):
+            response = lambda_function.lambda_handler(
+                {"action": action, "app_name": APP_NAME, "wait": True}, object()
+            )
+        seconds = time.monotonic() - start
+
+        job = None
+        if action in lambda_function.settings.JOB_ACTIONS:
+            job = jobs.latest(lambda_function.Controller(APP_NAME).job_store, APP_NAME)
+        if job is not None and job.state != jobs.SUCCEEDED:
+            raise ActionFailed(
+                f'"{action}" {job.state}: {job.error}\n{output.getvalue()[-2000:]}'
+            )
+        phase = difference(before, counters(*stand_ins))
+        phase["action"] = f"{action} (cold)" if cold else action
+        phase.update(seconds=seconds, response=response["message"])
+        phases.append(phase)
+    return phases
+
+
+def median_phases(rounds) -> list:
+    """ Every metric of every phase, as its median over the rounds """
+    phases = []
+    for samples in zip(*rounds):
+        phase = {"action": samples[0]["action"]}
+        for metric in METRICS:
+            phase[metric] = statistics.median(sample[metric] for sample in samples)
+        phase["do_endpoints"] = samples[-1]["do_endpoints"]
+        phases.append(phase)
+    return phases
+
+
+def run(rounds: int = 1, time_scale: float = 0.02, archive_bytes=8 << 20, **options):
+    """
+    Runs the lifecycle ``rounds`` times in this process, returning the median
+    of each phase. The first round finds no key or droplet, like a new app;
+    later ones reuse what the process and S3 remember, like a warm lambda. A
+    last, cold round follows, its phases after the others
+    """
+    digitalocean, s3, ssh = start_fakes(time_scale, archive_bytes)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            configure_environment(digitalocean, s3, ssh, workdir)
+            import lambda_function
+
+            stand_ins = (digitalocean, s3, ssh)
+            results = [
+                run_round(lambda_function, stand_ins, **options) for _ in range(rounds)
+            ]
+            cold = run_round(lambda_function, stand_ins, cold=True, **options)
+            lambda_function.AppState.clear_process_cache()
+    finally:
+        for fake in (ssh, s3, digitalocean):
+            fake.stop()
+    return {
+        "rounds": rounds,
+        "time_scale": time_scale,
+        "archive_bytes": archive_bytes,
+        "phases": median_phases(results) + median_phases([cold]),
+    }
+
+
+def change(now, then) -> str:
+    if then == now:
+        return ""
+    if not then:
+        return " (new)"
+    return f" ({(now - then) / then:+.0%})"
+
+
+def describe(result: dict, baseline: dict = None) -> str:
+    """ A line per phase, with changes from ``baseline`` if given """
+    previous = {
+        phase["action"]: phase for phase in (baseline or {}).get("phases", [])
+    }
+    lines = []
+    for phase in result["phases"]:
+        then = previous.get(phase["action"], {})
+        figures = []
+        for metric, label in METRICS.items():
+            value = phase[metric]
+            shown = f"{value:.2f}" if metric == "seconds" else f"{value:.0f}"
+            if metric in then:
+                shown += change(value, then[metric])
+            figures.append(f"{shown} {label}")
+        lines.append(f'{phase["action"]:<16} ' + ", ".join(figures))
+    return "\n".join(lines)
+
+
+def regressions(result: dict, baseline: dict, tolerance: float) -> list:
+    """ Metrics more than ``tolerance`` (e.g. 0.1 for 10%) worse than before """
+    previous = {phase["action"]: phase for phase in baseline["phases"]}
+    worse = []
+    for phase in result["phases"]:
+        then = previous.get(phase["action"])
+        if then is None:
+            continue
+        for metric, label in METRICS.items():
+            # baselines saved before a metric was added don't count it
+            if metric in then and phase[metric] > then[metric] * (1 + tolerance):
+                worse.append(
+                    f'{phase["action"]} {label}: {then[metric]:g} -> {phase[metric]:g}'
+                )
+    return worse
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=1, help="Times to run it all")
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=0.02,
+        help="Fraction of real droplet timings the stand-ins take",
+    )
+    parser.add_argument(
+        "--archive-mb", type=float, default=8, help="Size of the app's backup"
+    )
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with results saved earlier")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        help="Fail if any metric is this many percent worse than the baseline",
+    )
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show what the actions print"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    result = run(
+        rounds=args.rounds,
+        time_scale=args.time_scale,
+        archive_bytes=int(args.archive_mb * (1 << 20)),
+        verbose=args.verbose,
+    )
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+    else:
+        print(describe(result, baseline))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+    if baseline and args.max_regression is not None:
+        worse = regressions(result, baseline, args.max_regression / 100)
+        if worse:
+            sys.exit("Worse than the baseline:\n" + "\n".join(worse))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+A warm pool of configured, idle droplets that ``create`` can claim instead of
+waiting for a new droplet to boot.
+
+Each app has its own pool for its image, as standby droplets are created with
+the app's SSH key and configured with its private key. Standby droplets carry
+the pool tag from the moment they are created, and the ready tag once they are
+configured. Only ready droplets are ever claimed.
+
+Claiming and counting the pool to refill it both happen under a lease on the
+pool (see ``leases``), named after its tag, so two creates can't claim the same
+droplet and two refills can't both top it up.
+"""
+
+import uuid
+
+import digitalocean
+
+import images
+import waiting
+
+STANDBY_PREFIX = "auto-server-standby"
+# how long a claim or refill may hold the pool's lease
+LEASE_SECONDS = 120
+
+
+class PoolException(Exception):
+    """ Base Exception class for file """
+
+
+def pool_tag(app_name: str, dockerfile: str) -> str:
+    """ Tags every standby droplet of ``app_name``'s pool, ready or not """
+    # slugs never hold an underscore, so no two apps' tags can be the same
+    app_slug, image_slug = images.image_slug(app_name), images.image_slug(dockerfile)
+    return f"{STANDBY_PREFIX}-{app_slug}_{image_slug}"
+
+
+def lease_name(app_name: str, dockerfile: str) -> str:
+    """ The lease claims and refills of ``app_name``'s pool take """
+    return pool_tag(app_name, dockerfile)
+
+
+def ready_tag(app_name: str, dockerfile: str) -> str:
+    """ Tags standby droplets that are configured and can be claimed """
+    return f"{pool_tag(app_name, dockerfile)}-ready"
+
+
+def standby_names(app_name: str, dockerfile: str, count: int):
+    """ Unique droplet names for ``count`` new standby droplets """
+    slug = f"{images.image_slug(app_name)}-{images.image_slug(dockerfile)}"
+    return [f"{STANDBY_PREFIX}-{slug}-{uuid.uuid4().hex[:8]}" for _ in range(count)]
+
+
+def droplets_to_add(
+    current: int, size: int, price_monthly: float, max_monthly_cost: float
+) -> int:
+    """
+    How many standby droplets to create to reach ``size``, without the whole
+    pool costing more than ``max_monthly_cost``
+    """
+    wanted = max(0, size - current)
+    if price_monthly and max_monthly_cost:
+        affordable = int(max_monthly_cost // price_monthly) - current
+        wanted = min(wanted, max(0, affordable))
+    return wanted
+
+
+def claim(manager, token: str, app_name: str, dockerfile: str):
+    """
+    Takes a ready standby droplet out of ``app_name``'s pool and renames it
+    after the app, returning it, or None when the pool is empty. Call it
+    holding the pool's lease.
+    """
+    ready_name = ready_tag(app_name, dockerfile)
+    ready = [
+        droplet
+        for droplet in manager.get_all_droplets(tag_name=ready_name)
+        if droplet.status == "active"
+    ]
+    for droplet in ready:
+        # listing by tag can lag behind a claim that just untagged one, so the
+        # droplet itself is checked
+        droplet.load()
+        if ready_name not in droplet.tags:
+            continue
+        # untag first, so a refill doesn't count it as standing by
+        for tag in (ready_name, pool_tag(app_name, dockerfile)):
+            digitalocean.Tag(token=token, name=tag).remove_droplets([droplet.id])
+        waiting.wait_for_action(droplet.rename(app_name, return_dict=False), timeout=60)
+        droplet.name = app_name
+        return droplet
+    return None
+
+
+def mark_ready(token: str, app_name: str, dockerfile: str, droplets):
+    """ Makes configured standby droplets claimable """
+    tag = digitalocean.Tag(token=token, name=ready_tag(app_name, dockerfile))
+    tag.create()
+    tag.add_droplets([droplet.id for droplet in droplets])
@@ -0,0 +1,205 @@
+"""
+Runs droplet provisioning as a dependency graph of shell steps
+"""
+
+import hashlib
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import tracing
+
+
+class ProvisioningException(Exception):
+    """ Base Exception class for file """
+
+
+class InvalidPlan(ProvisioningException):
+    """ The plan references an unknown step or contains a cycle """
+
+
+class StepFailed(ProvisioningException):
+    """ A provisioning step exited with a non-zero status """
+
+    def __init__(self, step, status, report):
+        super().__init__(f'Step "{step.name}" exited with status {status}')
+        self.step = step
+        self.status = status
+        self.report = report
+
+
+class Step(object):
+    """
+    A single command in a provisioning plan. Steps that are ``cacheable`` are
+    idempotent configuration, and can be skipped when the droplet has already
+    applied the same command.
+    """
+
+    def __init__(self, name: str, command: str, requires=(), cacheable=False):
+        self.name = name
+        self.command = command
+        self.requires = tuple(requires)
+        self.cacheable = cacheable
+
+    def __repr__(self):
+        return f"<Step {self.name}>"
+
+
+class Report(object):
+    """ Timings for the steps of a plan, as offsets from the plan start """
+
+    def __init__(self, steps):
+        self.steps = {step.name: step for step in steps}
+        self.started = {}
+        self.finished = {}
+        self.statuses = {}
+        self.skipped = set()
+
+    @property
+    def durations(self):
+        return {
+            name: self.finished[name] - self.started[name] for name in self.finished
+        }
+
+    @property
+    def total(self):
+        return max(self.finished.values(), default=0.0)
+
+    @property
+    def critical_path(self):
+        """
+        The chain of steps that determined the plan's wall time: starting from
+        the last step to finish, repeatedly follow the requirement that finished
+        last.
+        """
+        if not self.finished:
+            return []
+        name = max(self.finished, key=self.finished.get)
+        path = [name]
+        while True:
+            requires = [r for r in self.steps[name].requires if r in self.finished]
+            if not requires:
+                break
+            name = max(requires, key=self.finished.get)
+            path.append(name)
+        return list(reversed(path))
+
+    @property
+    def succeeded(self):
+        """ Names of steps that ran (or were skipped) without error """
+        return {name for name, status in self.statuses.items() if not status}
+
+    def summary(self):
+        lines = [
+            f"  {name}: " + ("skipped" if name in self.skipped else f"{duration:.2f}s")
+            for name, duration in sorted(
+                self.durations.items(), key=lambda item: self.started[item[0]]
+            )
+        ]
+        lines.append(
+            f"  critical path ({self.total:.2f}s): " + " -> ".join(self.critical_path)
+        )
+        return "\n".join(lines)
+
+
+def fingerprints(steps):
+    """
+    Hashes each step's command together with the fingerprints of the steps it
+    requires, so changing a step also invalidates everything downstream of it.
+    """
+    by_name = {step.name: step for step in steps}
+    result = {}
+
+    def fingerprint(name):
+        if name not in result:
+            step = by_name[name]
+            digest = hashlib.sha256(step.command.encode())
+            for required in sorted(step.requires):
+                digest.update(fingerprint(required).encode())
+            result[name] = digest.hexdigest()
+        return result[name]
+
+    for step in steps:
+        fingerprint(step.name)
+    return result
+
+
+def validate(steps):
+    """ Raises ``InvalidPlan`` for duplicate names, unknown requirements or cycles """
+    names = [step.name for step in steps]
+    if len(set(names)) != len(names):
+        raise InvalidPlan("Duplicate step names")
+    by_name = dict(zip(names, steps))
+    for step in steps:
+        for required in step.requires:
+            if required not in by_name:
+                raise InvalidPlan(f'"{step.name}" requires unknown step "{required}"')
+
+    visiting, done = set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise InvalidPlan(f'Cycle through step "{name}"')
+        visiting.add(name)
+        for required in by_name[name].requires:
+            visit(required)
+        visiting.discard(name)
+        done.add(name)
+
+    for name in names:
+        visit(name)
+
+
+def run_plan(steps, run_step, max_workers: int = 8, skip=()) -> Report:
+    """
+    Runs ``steps`` as soon as their requirements have finished, at most
+    ``max_workers`` at a time. ``run_step(step)`` must block until the step is
+    done and return its exit status. The first non-zero status stops new steps
+    from starting and raises ``StepFailed`` once running steps have finished.
+    Steps named in ``skip`` count as already done.
+    """
+    validate(steps)
+    report = Report(steps)
+    for name in skip:
+        report.started[name] = report.finished[name] = 0.0
+        report.statuses[name] = 0
+        report.skipped.add(name)
+    steps = [step for step in steps if step.name not in report.skipped]
+    pending = list(steps)
+    running = {}
+    failure = None
+    start = time.monotonic()
+
+    def timed(step):
+        report.started[step.name] = time.monotonic() - start
+        try:
+            return run_step(step)
+        finally:
+            report.finished[step.name] = time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if failure is None:
+                ready = [
+                    step
+                    for step in pending
+                    if all(report.statuses.get(r) == 0 for r in step.requires)
+                ]
+                for step in ready:
+                    pending.remove(step)
+                    future = executor.submit(tracing.in_context(timed), step)
+                    running[future] = step.name
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = report.steps[running.pop(future)]
+                status = report.statuses[step.name] = future.result()
+                if status and failure is None:
+                    failure = (step, status)
+
+    if failure is not None:
+        raise StepFailed(*failure, report)
+    return report
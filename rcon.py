@@ -0,0 +1,159 @@
+"""
+Minimal Source RCON client. It runs on the droplet, next to the game server, to
+ask it to save (or stop saving) before a live backup. Factorio and Minecraft
+both speak this protocol:
+
+    python3 rcon.py --port 27015 --password-file <app_dir>/config/rconpw /server-save
+    python3 rcon.py --properties <app_dir>/server.properties save-off "save-all flush"
+
+Commands wait up to --timeout seconds for a reply, as a flush of a big world
+takes a while.
+
+Like the other droplet-side scripts it only uses the standard library.
+"""
+
+import argparse
+import socket
+import struct
+import sys
+
+AUTH = 3
+AUTH_RESPONSE = 2
+EXEC_COMMAND = 2
+RESPONSE_VALUE = 0
+
+
+class RconException(Exception):
+    """ Base Exception class for file """
+
+
+class AuthenticationFailed(RconException):
+    """ The server rejected the RCON password """
+
+
+class Rcon(object):
+    """ A connection to a game server's RCON port """
+
+    def __init__(self, host, port, password, timeout=120):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self._socket = None
+        self._next_id = 0
+
+    def __enter__(self):
+        return self.connect()
+
+    def connect(self):
+        """ Connects and logs in, returning the connection """
+        self._socket = socket.create_connection((self.host, self.port), self.timeout)
+        try:
+            self._authenticate()
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def _authenticate(self):
+        request_id = self._send(AUTH, self.password)
+        while True:
+            response_id, kind, _ = self._read()
+            if kind == AUTH_RESPONSE:
+                break
+        if response_id == -1 or response_id != request_id:
+            raise AuthenticationFailed("RCON password was rejected")
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._socket.close()
+        self._socket = None
+
+    def _send(self, kind, body):
+        self._next_id += 1
+        payload = struct.pack("<ii", self._next_id, kind) + body.encode() + b"\0\0"
+        self._socket.sendall(struct.pack("<i", len(payload)) + payload)
+        return self._next_id
+
+    def _recv_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise RconException("Connection closed by the server")
+            data += chunk
+        return data
+
+    def _read(self):
+        (size,) = struct.unpack("<i", self._recv_exactly(4))
+        packet = self._recv_exactly(size)
+        response_id, kind = struct.unpack("<ii", packet[:8])
+        return response_id, kind, packet[8:-2].decode(errors="replace")
+
+    def command(self, text):
+        """ Runs a console command, returning the server's reply """
+        request_id = self._send(EXEC_COMMAND, text)
+        while True:
+            response_id, kind, body = self._read()
+            if kind == RESPONSE_VALUE and response_id == request_id:
+                return body
+
+
+def read_properties(path):
+    """ Parses a Minecraft ``server.properties`` file """
+    properties = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#") and "=" in line:
+                key, value = line.split("=", 1)
+                properties[key.strip()] = value.strip()
+    return properties
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("commands", nargs="+")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--password-file")
+    parser.add_argument("--properties")
+    parser.add_argument(
+        "--timeout", type=float, default=120, help="Seconds to wait for a reply"
+    )
+    parser.add_argument(
+        "--ignore-unreachable",
+        action="store_true",
+        help="Succeed when nothing is listening, e.g. the server is stopped",
+    )
+    args = parser.parse_args(argv)
+
+    # only failing to reach the server is ignored: a command that fails once
+    # connected, e.g. a save that times out, still fails
+    try:
+        port, password = args.port, ""
+        if args.properties:
+            properties = read_properties(args.properties)
+            port = port or int(properties.get("rcon.port", 25575))
+            password = properties.get("rcon.password", "")
+        if args.password_file:
+            with open(args.password_file) as f:
+                password = f.read().strip()
+        rcon = Rcon(args.host, port, password, timeout=args.timeout).connect()
+    except OSError as error:  # refused, timed out, unreachable, no config file
+        if not args.ignore_unreachable:
+            raise
+        print("RCON unavailable, skipping: {}".format(error), file=sys.stderr)
+        return
+
+    try:
+        for command in args.commands:
+            print(rcon.command(command))
+    finally:
+        rcon.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Knowing when a new server actually accepts players, and where the time to get
+there went.
+
+A published port accepts TCP connections as soon as docker's proxy is up, long
+before the game listens behind it, so each probe waits for a reply in the
+game's own protocol:
+
+* ``server_list_ping``: the Minecraft status request on the game port
+* ``rcon``: a Source RCON login on Factorio's RCON port. Any answer, even a
+  rejected password, means the server is up
+"""
+
+import json
+import socket
+import struct
+import time
+from contextlib import contextmanager
+
+import rcon
+import waiting
+
+# the protocol version sent in a status request; any value gets a reply
+MINECRAFT_PROTOCOL = 47
+
+
+class ReadinessException(Exception):
+    """ Base Exception class for file """
+
+
+class UnknownProbe(ReadinessException):
+    """ No probe with this name """
+
+
+def _varint(value: int) -> bytes:
+    value &= 0xFFFFFFFF
+    out = b""
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        out += bytes([byte | (0x80 if value else 0)])
+        if not value:
+            return out
+
+
+def _recv_exactly(sock, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by the server")
+        data += chunk
+    return data
+
+
+def _read_varint(sock) -> int:
+    result = 0
+    for shift in range(0, 35, 7):
+        byte = _recv_exactly(sock, 1)[0]
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result
+    raise ValueError("VarInt is too long")
+
+
+def _packet(packet_id: int, payload: bytes = b"") -> bytes:
+    data = _varint(packet_id) + payload
+    return _varint(len(data)) + data
+
+
+def server_list_ping(host: str, port: int = 25565, timeout: float = 3.0) -> dict:
+    """ A Minecraft server's status: version, players and description """
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        address = host.encode()
+        handshake = (
+            _varint(MINECRAFT_PROTOCOL)
+            + _varint(len(address))
+            + address
+            + struct.pack(">H", port)
+            + _varint(1)  # next state: status
+        )
+        sock.sendall(_packet(0, handshake) + _packet(0))
+        _read_varint(sock)  # packet length
+        if _read_varint(sock) != 0:
+            raise ValueError("Expected a status response")
+        return json.loads(_recv_exactly(sock, _read_varint(sock)).decode())
+
+
+def rcon_answers(host: str, port: int = 27015, timeout: float = 3.0) -> bool:
+    """ Whether an RCON server answers a login, whatever it thinks of it """
+    try:
+        with rcon.Rcon(host, port, "", timeout=timeout):
+            return True
+    except rcon.AuthenticationFailed:
+        return True
+
+
+PROBES = {"rcon": rcon_answers, "server_list_ping": server_list_ping}
+
+
+def probe(game, host: str) -> bool:
+    """ Whether ``game``'s server on ``host`` is answering players """
+    if game.ready_probe not in PROBES:
+        raise UnknownProbe(f'Unknown probe "{game.ready_probe}"')
+    try:
+        PROBES[game.ready_probe](host, game.ready_port)
+    except (OSError, ValueError, rcon.RconException):
+        return False
+    return True
+
+
+def wait_until_ready(game, host: str, timeout: float = 600, **options):
+    """ Probes until ``game`` answers on ``host``, returning a ``Waited`` """
+    options.setdefault("first", 1.0)
+    options.setdefault("longest", 5.0)
+    return waiting.wait_for(
+        lambda: probe(game, host) or None,
+        timeout=timeout,
+        description=f"{game.name} on {host}",
+        **options,
+    )
+
+
+class Phases(object):
+    """ Named durations that add up to a server's time to playable """
+
+    def __init__(self, clock=time.monotonic):
+        self.durations = {}
+        self._clock = clock
+        self._start = clock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.add(name, self._clock() - start)
+
+    def add(self, name: str, seconds: float):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    @property
+    def total(self) -> float:
+        return self._clock() - self._start
+
+    def summary(self) -> str:
+        lines = [f"Time to playable: {self.total:.1f}s"]
+        lines.extend(
+            f"  {name}: {seconds:.1f}s" for name, seconds in self.durations.items()
+        )
+        return "\n".join(lines)
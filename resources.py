@@ -0,0 +1,107 @@
+"""
+A small index of an app's DigitalOcean resource IDs, so they can be fetched
+directly instead of found by listing everything in the account
+"""
+
+import json
+
+from botocore.exceptions import ClientError
+
+import leases
+
+# how many times a change is retried against a newer index before giving up
+WRITE_ATTEMPTS = 5
+
+
+class ResourcesException(Exception):
+    """ Base Exception class for file """
+
+
+class IndexConflict(ResourcesException):
+    """ The index kept changing under a write, so it couldn't be saved """
+
+
+class ResourceIndex(object):
+    """
+    Maps names like ``droplet_id`` or ``ssh_key_id`` to values, stored as JSON
+    at ``key`` in an S3 bucket. Loaded entries are kept for the life of the
+    process, so a warm lambda doesn't fetch them again.
+
+    Entries are only hints: resources can be deleted behind our back, so
+    callers check what they look up and ``forget`` whatever turns out stale.
+
+    Writes are conditional on the index not having changed since it was read,
+    so concurrent invocations don't undo each other's entries: one that loses
+    reads the index again and makes its change to that.
+    """
+
+    # shared by every index in the process, by S3 key: (entries, ETag)
+    _loaded = {}
+
+    def __init__(self, bucket, key: str):
+        self.bucket = bucket
+        self.key = key
+        leases.allow_conditions(bucket.meta.client)
+
+    @property
+    def entries(self) -> dict:
+        if self.key not in self._loaded:
+            self._loaded[self.key] = self._fetch()
+        return self._loaded[self.key][0]
+
+    def _fetch(self):
+        """ The stored entries and their ETag, which is None if there are none """
+        try:
+            response = self.bucket.Object(self.key).get()
+        except ClientError as error:
+            # anything else, e.g. AccessDenied, would look like an empty index
+            # that the next write then saved over the real one
+            if error.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return {}, None
+            raise
+        try:
+            return json.loads(response["Body"].read().decode()), response["ETag"]
+        except ValueError:
+            return {}, response["ETag"]
+
+    def _change(self, change):
+        """ Stores ``change(entries)``, if it differs, on top of the newest index """
+        entries, version = self.entries, self._loaded[self.key][1]
+        for _ in range(WRITE_ATTEMPTS):
+            changed = change(entries)
+            if changed == entries:
+                self._loaded[self.key] = (entries, version)
+                return
+            condition = {"IfMatch": version} if version else {"IfNoneMatch": "*"}
+            try:
+                response = self.bucket.Object(self.key).put(
+                    Body=json.dumps(changed).encode(),
+                    ContentType="application/json",
+                    **condition,
+                )
+            except ClientError as error:
+                if error.response["Error"]["Code"] not in leases.CONFLICTS:
+                    raise
+                # written by someone else since it was read
+                entries, version = self._fetch()
+                continue
+            self._loaded[self.key] = (changed, response.get("ETag"))
+            return
+        raise IndexConflict(f"{self.key} kept changing, gave up writing it")
+
+    def get(self, name: str):
+        return self.entries.get(name)
+
+    def update(self, **entries):
+        """ Records ``entries``, writing to S3 only if something changed """
+        self._change(lambda current: dict(current, **entries))
+
+    def forget(self, *names):
+        """ Drops stale entries """
+        self._change(
+            lambda current: {k: v for k, v in current.items() if k not in names}
+        )
+
+    @classmethod
+    def clear_process_cache(cls):
+        cls._loaded.clear()
@@ -1,8 +1,12 @@
 import os
+import tempfile
+from types import SimpleNamespace
 
-from dotenv import load_dotenv
+if not os.getenv("AWS_LAMBDA_FUNCTION_NAME"):
+    # a lambda is configured through its environment, there's no .env to read
+    from dotenv import load_dotenv
 
-load_dotenv()
+    load_dotenv()
 
 APP_NAME = os.getenv("APP_NAME")
 APP_DIR = os.getenv("APP_DIR")
@@ -15,31 +19,248 @@ AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_REGION_ID = os.getenv("AWS_REGION_ID")
 AWS_OUTPUT_FORMAT = os.getenv("AWS_OUTPUT_FORMAT")
+# where the controller itself talks to S3, unset for AWS. Only ever pointed
+# elsewhere at a stand-in, e.g. by lifecycle_benchmark.py
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
 
 
 S3_FOLDER = APP_NAME
 
 SSH_KEY_NAME = f"{APP_NAME}-key"
-SSH_KEY_FILE_NAME = f"id_rsa"
+# the type of newly generated keys, "ed25519" or "rsa". Keys already in S3 are
+# used whatever their type, until the "rotate_key" action replaces them
+SSH_KEY_TYPE = os.getenv("SSH_KEY_TYPE", "ed25519")
+# a copy of the key from S3, downloaded again only when it changes
+KEY_CACHE_DIR = os.getenv(
+    "KEY_CACHE_DIR", os.path.join(tempfile.gettempdir(), "auto_server_keys")
+)
 S3_SSH_KEY_FILE_PATH = f"{S3_FOLDER}/{SSH_KEY_NAME}"
+# the app's droplet and SSH key IDs, so they're fetched without listing
+S3_RESOURCE_INDEX_PATH = f"{S3_FOLDER}/resources.json"
 
 ARCHIVE_FILE_NAME = f"{APP_NAME}.tar.gz"
 S3_ARCHIVE_FILE_PATH = f"{S3_FOLDER}/{ARCHIVE_FILE_NAME}"
+# written next to streamed archives, with the checksum of their contents
+S3_ARCHIVE_METADATA_PATH = f"{S3_ARCHIVE_FILE_PATH}.json"
+
+# "archive" tars APP_DIR into a single object, "stream" does the same without
+# an intermediate file, "chunked" keeps deduplicated chunks plus a manifest
+# per backup
+BACKUP_MODE = os.getenv("BACKUP_MODE", "archive")
+BACKUP_RETENTION = int(os.getenv("BACKUP_RETENTION", "10"))
+S3_CHUNK_STORE_PATH = f"{S3_FOLDER}/store"
+# archive compression as codec[:level], e.g. "zstd:3", "pigz" or "lz4:1"
+BACKUP_CODEC = os.getenv("BACKUP_CODEC", "gzip")
+BENCHMARK_SAMPLE_MB = int(os.getenv("BENCHMARK_SAMPLE_MB", "256"))
+
+# live backups save the game through RCON and archive a snapshot of APP_DIR at
+# idle priority, reading at most BACKUP_RATE_LIMIT bytes per second. RCON
+# commands (a flush of a big world, say) get RCON_TIMEOUT seconds to answer
+BACKUP_LIVE = os.getenv("BACKUP_LIVE", "").lower() in ("1", "true", "yes")
+RCON_TIMEOUT = int(os.getenv("RCON_TIMEOUT", "120"))
+BACKUP_RATE_LIMIT = int(os.getenv("BACKUP_RATE_LIMIT", str(20 * 1024 * 1024)))
+SNAPSHOT_DIR = f"{APP_DIR}.snapshot"
+
+# multipart settings for the droplet's aws cli
+S3_MAX_CONCURRENT_REQUESTS = int(os.getenv("S3_MAX_CONCURRENT_REQUESTS", "8"))
+S3_MULTIPART_CHUNKSIZE = os.getenv("S3_MULTIPART_CHUNKSIZE", "16MB")
+
+# parallel ranged GETs for streamed restores
+RESTORE_PART_SIZE = int(os.getenv("RESTORE_PART_SIZE", str(8 * 1024 * 1024)))
+RESTORE_WORKERS = int(os.getenv("RESTORE_WORKERS", "8"))
+
+# "s3" keeps APP_DIR on the droplet and round-trips it through S3 on
+# destroy/create, "volume" keeps it on a block storage volume that is moved to
+# each new droplet, leaving S3 backups for off-site copies only
+PERSISTENCE = os.getenv("PERSISTENCE", "s3")
+VOLUME_NAME = f"{APP_NAME}-data".lower()
+VOLUME_SIZE_GB = int(os.getenv("VOLUME_SIZE_GB", "10"))
+
+# droplets boot from the newest snapshot baked for DOCKERFILE (see the "bake"
+# action), or from BASE_IMAGE when there isn't one
+BASE_IMAGE = os.getenv("BASE_IMAGE", "docker-18-04")
+DROPLET_SIZE = os.getenv("DROPLET_SIZE", "4gb")
+SNAPSHOT_RETENTION = int(os.getenv("SNAPSHOT_RETENTION", "2"))
+
+# configured, idle droplets that "create" claims instead of booting a new one.
+# The pool never holds more than POOL_SIZE droplets, nor more than
+# POOL_MAX_MONTHLY_COST dollars' worth of them. A POOL_SIZE of 0 turns it off
+POOL_SIZE = int(os.getenv("POOL_SIZE", "0"))
+POOL_MAX_MONTHLY_COST = float(os.getenv("POOL_MAX_MONTHLY_COST", "100"))
+
+# DigitalOcean API calls are spread out to stay under its rate limit (250 a
+# minute), and retried with backoff when throttled
+DO_API_BURST = int(os.getenv("DO_API_BURST", "10"))
+DO_API_RATE_PER_MINUTE = int(os.getenv("DO_API_RATE_PER_MINUTE", "250"))
+DO_API_MAX_RETRIES = int(os.getenv("DO_API_MAX_RETRIES", "5"))
+
+# how long to follow DigitalOcean actions (creating or destroying a droplet,
+# attaching a volume) and snapshots before giving up, in seconds
+ACTION_TIMEOUT = int(os.getenv("ACTION_TIMEOUT", "300"))
+SNAPSHOT_TIMEOUT = int(os.getenv("SNAPSHOT_TIMEOUT", "1800"))
+
+# how long a new droplet has to start accepting SSH connections, in seconds
+SSH_TIMEOUT = int(os.getenv("SSH_TIMEOUT", "300"))
+# droplets' sshd listens here, only ever changed to point at a stand-in
+SSH_PORT = int(os.getenv("SSH_PORT", "22"))
+# connections stay open between requests in a warm process, sending a keepalive
+# after this many idle seconds
+SSH_KEEPALIVE = int(os.getenv("SSH_KEEPALIVE", "30"))
+
+# commands keep only the last EXEC_TAIL_LINES lines of their output, however
+# much they print. The "exec" action gives up after EXEC_TIMEOUT seconds, 0
+# waits for as long as the command runs
+EXEC_TAIL_LINES = int(os.getenv("EXEC_TAIL_LINES", "200"))
+EXEC_TIMEOUT = int(os.getenv("EXEC_TIMEOUT", "0"))
+
+# how long "create" waits for the game to accept players, in seconds
+GAME_READY_TIMEOUT = int(os.getenv("GAME_READY_TIMEOUT", "600"))
+
+# actions that run as jobs: "lambda_handler" returns a job ID straight away
+# and a worker runs the action in stages, saving progress after each one. A
+# worker stops starting stages JOB_STAGE_MARGIN seconds before it would time
+# out, and one that hasn't saved progress in JOB_LEASE_SECONDS is presumed dead
+JOB_ACTIONS = os.getenv(
+    "JOB_ACTIONS",
+    "create,destroy,hard_destroy,backup,restore,bake,rotate_key,resize",
+).split(",")
+# "s3" keeps jobs under S3_JOBS_PATH, "directory" keeps them in JOB_DIR
+JOB_STORE = os.getenv("JOB_STORE", "s3")
+JOB_DIR = os.getenv("JOB_DIR", ".jobs")
+S3_JOBS_PATH = f"{S3_FOLDER}/jobs"
+JOB_STAGE_MARGIN = int(os.getenv("JOB_STAGE_MARGIN", "300"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "960"))
+# jobs for an app run one at a time, each holding the app's lease. Leases live
+# next to the jobs: in JOB_DIR, or under S3_LEASES_PATH. A submission waits up
+# to LEASE_WAIT seconds for another one for the same app to finish
+S3_LEASES_PATH = f"{S3_FOLDER}/leases"
+LEASE_WAIT = int(os.getenv("LEASE_WAIT", "30"))
+
+# actions for the whole fleet (every app droplet, or those with a tag) run on
+# at most FLEET_PARALLELISM apps at a time
+FLEET_PARALLELISM = int(os.getenv("FLEET_PARALLELISM", "4"))
+
+# "telemetry" samples the app container's CPU, memory, disk and network use
+# every TELEMETRY_INTERVAL seconds for TELEMETRY_SECONDS, keeping the newest
+# TELEMETRY_RETENTION series in S3. "rightsize" suggests the cheapest droplet
+# size with SIZING_HEADROOM to spare over what they show, plus
+# SIZING_MEMORY_RESERVE_MB for the system, once there are SIZING_MIN_SAMPLES
+# samples; "resize" applies it
+S3_TELEMETRY_PATH = f"{S3_FOLDER}/telemetry"
+TELEMETRY_SECONDS = int(os.getenv("TELEMETRY_SECONDS", "300"))
+TELEMETRY_INTERVAL = int(os.getenv("TELEMETRY_INTERVAL", "10"))
+TELEMETRY_RETENTION = int(os.getenv("TELEMETRY_RETENTION", "48"))
+SIZING_HEADROOM = float(os.getenv("SIZING_HEADROOM", "0.25"))
+SIZING_MEMORY_RESERVE_MB = int(os.getenv("SIZING_MEMORY_RESERVE_MB", "512"))
+SIZING_MIN_SAMPLES = int(os.getenv("SIZING_MIN_SAMPLES", "30"))
+
+# every request is traced, its time split into spans (DigitalOcean calls, SSH
+# commands, S3 requests, waits) that are totalled in the response. A fraction
+# TRACE_SAMPLE_RATE of requests also log each span lasting at least
+# TRACE_MIN_MS milliseconds, and the totals, as lines of JSON
+TRACING = os.getenv("TRACING", "true").lower() in ("1", "true", "yes")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_MIN_MS = float(os.getenv("TRACE_MIN_MS", "0"))
+
+# fingerprints of the configuration already applied to a droplet
+REMOTE_STATE_DIR = "/root/.auto_server"
+REMOTE_STATE_FILE = f"{REMOTE_STATE_DIR}/state.json"
 
 all_settings = [
+    ACTION_TIMEOUT,
     APP_NAME,
     APP_DIR,
     ARCHIVE_FILE_NAME,
     AWS_ACCESS_KEY_ID,
     AWS_SECRET_ACCESS_KEY,
+    BACKUP_CODEC,
+    BACKUP_LIVE,
+    BACKUP_MODE,
+    BACKUP_RATE_LIMIT,
+    BACKUP_RETENTION,
+    BASE_IMAGE,
+    BENCHMARK_SAMPLE_MB,
     DOCKERFILE,
+    DROPLET_SIZE,
+    EXEC_TAIL_LINES,
+    EXEC_TIMEOUT,
+    FLEET_PARALLELISM,
+    GAME_READY_TIMEOUT,
+    JOB_ACTIONS,
+    JOB_DIR,
+    JOB_LEASE_SECONDS,
+    JOB_STAGE_MARGIN,
+    JOB_STORE,
+    KEY_CACHE_DIR,
+    LEASE_WAIT,
+    PERSISTENCE,
+    POOL_MAX_MONTHLY_COST,
+    POOL_SIZE,
     DIGITALOCEAN_API_TOKEN,
     DIGITALOCEAN_REGION_SLUG,
+    DO_API_BURST,
+    DO_API_MAX_RETRIES,
+    DO_API_RATE_PER_MINUTE,
     PRIVATE_KEY_PASSPHRASE,
+    RCON_TIMEOUT,
+    REMOTE_STATE_DIR,
+    RESTORE_PART_SIZE,
+    RESTORE_WORKERS,
+    REMOTE_STATE_FILE,
     S3_ARCHIVE_FILE_PATH,
+    S3_ARCHIVE_METADATA_PATH,
     S3_BUCKET_NAME,
+    S3_CHUNK_STORE_PATH,
+    S3_ENDPOINT_URL,
+    S3_RESOURCE_INDEX_PATH,
     S3_FOLDER,
+    S3_JOBS_PATH,
+    S3_LEASES_PATH,
+    S3_MAX_CONCURRENT_REQUESTS,
+    S3_MULTIPART_CHUNKSIZE,
     S3_SSH_KEY_FILE_PATH,
+    S3_TELEMETRY_PATH,
+    SNAPSHOT_DIR,
+    SNAPSHOT_RETENTION,
+    SNAPSHOT_TIMEOUT,
+    SIZING_HEADROOM,
+    SIZING_MEMORY_RESERVE_MB,
+    SIZING_MIN_SAMPLES,
     SSH_KEY_NAME,
-    SSH_KEY_FILE_NAME,
+    SSH_KEEPALIVE,
+    TELEMETRY_INTERVAL,
+    TELEMETRY_RETENTION,
+    TELEMETRY_SECONDS,
+    TRACE_MIN_MS,
+    TRACE_SAMPLE_RATE,
+    TRACING,
+    SSH_PORT,
+    SSH_TIMEOUT,
+    SSH_KEY_TYPE,
+    VOLUME_NAME,
+    VOLUME_SIZE_GB,
 ]
+
+
+def for_app(app_name: str):
+    """
+    The settings that name one app's resources: its droplet, SSH key, volume
+    and S3 objects. The constants above are those of APP_NAME, but requests
+    can be for any app
+    """
+    archive_file_name = f"{app_name}.tar.gz"
+    s3_archive_file_path = f"{app_name}/{archive_file_name}"
+    return SimpleNamespace(
+        APP_NAME=app_name,
+        S3_FOLDER=app_name,
+        SSH_KEY_NAME=f"{app_name}-key",
+        S3_SSH_KEY_FILE_PATH=f"{app_name}/{app_name}-key",
+        S3_RESOURCE_INDEX_PATH=f"{app_name}/resources.json",
+        S3_APP_OPTIONS_PATH=f"{app_name}/options.json",
+        ARCHIVE_FILE_NAME=archive_file_name,
+        S3_ARCHIVE_FILE_PATH=s3_archive_file_path,
+        S3_ARCHIVE_METADATA_PATH=f"{s3_archive_file_path}.json",
+        S3_CHUNK_STORE_PATH=f"{app_name}/store",
+        S3_TELEMETRY_PATH=f"{app_name}/telemetry",
+        VOLUME_NAME=f"{app_name}-data".lower(),
+    )
@@ -0,0 +1,189 @@
+"""
+Droplet sizes chosen from what an app's container actually uses. The
+"telemetry" action samples it on the droplet (see ``telemetry``) and keeps
+the series here, in S3; ``recommend`` then finds the cheapest size with room
+for what they show.
+"""
+
+import json
+import math
+import time
+
+# bytes per KB, and the seconds in a month of transfer allowance
+KB = 1024
+MONTH_SECONDS = 30 * 24 * 3600
+
+
+class SizingException(Exception):
+    """ Base Exception class for file """
+
+
+class NotEnoughTelemetry(SizingException):
+    """ Too few samples to size the droplet from """
+
+
+class NoSuitableSize(SizingException):
+    """ No size in the region has room for what the app uses """
+
+
+class TelemetryStore(object):
+    """
+    Telemetry series as JSON objects under ``prefix`` in an S3 bucket, named
+    after when they started so they list in order. Only the newest
+    ``retention`` are kept.
+    """
+
+    def __init__(self, bucket, prefix: str, retention: int = 48):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.retention = retention
+
+    def keys(self) -> list:
+        return sorted(
+            summary.key
+            for summary in self.bucket.objects.filter(Prefix=f"{self.prefix}/")
+            if summary.key.endswith(".json")
+        )
+
+    def save(self, series: dict) -> str:
+        started = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(series["start"]))
+        key = f"{self.prefix}/{started}.json"
+        self.bucket.Object(key).put(
+            Body=json.dumps(series, separators=(",", ":")).encode(),
+            ContentType="application/json",
+        )
+        for expired in self.keys()[: -self.retention]:
+            self.bucket.Object(expired).delete()
+        return key
+
+    def recent(self, count: int = None) -> list:
+        """ The newest ``count`` series (all of them by default), oldest first """
+        keys = self.keys()
+        return [
+            json.loads(self.bucket.Object(key).get()["Body"].read().decode())
+            for key in keys[-count if count else 0 :]
+        ]
+
+
+def percentile(values, fraction: float):
+    """ The nearest-rank percentile, e.g. ``fraction=0.95`` for the 95th """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def usage(windows) -> dict:
+    """ What the series show the container using, over all their samples """
+    cpu = [value for series in windows for value in series["cpu"]]
+    if not cpu:
+        raise NotEnoughTelemetry("No telemetry yet, run the telemetry action")
+    memory = [value for series in windows for value in series["memory"]]
+    disk = [
+        read + write
+        for series in windows
+        for read, write in zip(series["disk_read"], series["disk_write"])
+    ]
+    net_tx = [value for series in windows for value in series["net_tx"]]
+    return {
+        "samples": len(cpu),
+        "cpu_p95": percentile(cpu, 0.95),
+        "cpu_peak": max(cpu),
+        "memory_p95_mb": percentile(memory, 0.95),
+        "memory_peak_mb": max(memory),
+        "disk_kb_s_p95": percentile(disk, 0.95),
+        "net_tx_kb_s_mean": round(sum(net_tx) / len(net_tx)),
+    }
+
+
+def needs(used: dict, headroom: float = 0.25, memory_reserve_mb: int = 512) -> dict:
+    """
+    What a droplet needs for ``used``. CPU is sized for the 95th percentile, as
+    a short spike (a world save, say) only delays a few ticks, but memory for
+    the peak, as running out gets the server killed. Transfer is the month's
+    outbound traffic at the average rate.
+    """
+    return {
+        "vcpus": max(1, math.ceil(used["cpu_p95"] * (1 + headroom))),
+        "memory_mb": math.ceil(used["memory_peak_mb"] * (1 + headroom))
+        + memory_reserve_mb,
+        "transfer_tb": used["net_tx_kb_s_mean"] * KB * MONTH_SECONDS / 1e12,
+    }
+
+
+class Recommendation(object):
+    """ The size suggested for an app, and the usage it was chosen from """
+
+    def __init__(self, size, current, used: dict, needed: dict):
+        self.size = size
+        self.current = current
+        self.used = used
+        self.needed = needed
+
+    @property
+    def changed(self) -> bool:
+        return self.current is None or self.size.slug != self.current.slug
+
+    def describe(self) -> str:
+        used, needed = self.used, self.needed
+        lines = [
+            f'Over {used["samples"]} samples the app used {used["cpu_p95"]} cores'
+            f' (95th percentile, {used["cpu_peak"]} at most) and'
+            f' {used["memory_peak_mb"]} MB of memory at most, with disk I/O of'
+            f' {used["disk_kb_s_p95"]} KB/s and {used["net_tx_kb_s_mean"]} KB/s'
+            " sent on average",
+            f'With headroom it needs {needed["vcpus"]} vCPU(s) and'
+            f' {needed["memory_mb"]} MB',
+        ]
+        if not self.changed:
+            lines.append(f'"{self.size.slug}" already fits it best')
+        else:
+            was = (
+                f'"{self.current.slug}" (${self.current.price_monthly}/month)'
+                if self.current is not None
+                else "the current size"
+            )
+            lines.append(
+                f'Suggest "{self.size.slug}" (${self.size.price_monthly}/month)'
+                f" instead of {was}"
+            )
+        return "\n".join(lines)
+
+
+def recommend(
+    windows,
+    sizes,
+    current_slug: str,
+    region: str,
+    headroom: float = 0.25,
+    memory_reserve_mb: int = 512,
+    min_samples: int = 30,
+) -> Recommendation:
+    """
+    The cheapest of ``sizes`` in ``region`` with room for what the telemetry
+    ``windows`` show
+    """
+    used = usage(windows)
+    if used["samples"] < min_samples:
+        raise NotEnoughTelemetry(
+            f'Only {used["samples"]} samples, at least {min_samples} are needed'
+        )
+    needed = needs(used, headroom, memory_reserve_mb)
+    current = next((size for size in sizes if size.slug == current_slug), None)
+    fitting = [
+        size
+        for size in sizes
+        if getattr(size, "available", True)
+        and (not size.regions or region in size.regions)
+        and size.vcpus >= needed["vcpus"]
+        and size.memory >= needed["memory_mb"]
+        and (size.transfer or 0) >= needed["transfer_tb"]
+    ]
+    if not fitting:
+        raise NoSuitableSize(
+            f'No size in {region} has {needed["vcpus"]} vCPU(s) and'
+            f' {needed["memory_mb"]} MB'
+        )
+    best = min(fitting, key=lambda size: (size.price_monthly, size.memory))
+    # ties go to the current size, so a resize is never for nothing
+    if current in fitting and current.price_monthly <= best.price_monthly:
+        best = current
+    return Recommendation(best, current, used, needed)
@@ -0,0 +1,264 @@
+"""
+Connecting to a freshly booted droplet as soon as sshd is up.
+
+Port 22 is probed with plain TCP connects first, which fail fast while the
+droplet boots, and paramiko is only started once something is listening.
+The droplet's host key is trusted on first use and pinned after that.
+
+Connections are meant to be kept open and reused: they send keepalives while
+idle, and ``alive`` checks one still works before it's trusted again.
+
+Command output is read from stdout and stderr as it arrives and handed over a
+line at a time, keeping only a bounded tail, so a verbose command neither
+fills memory nor stalls on a full window of the stream nobody reads.
+"""
+
+import select
+import socket
+import time
+from collections import deque
+
+import paramiko
+
+import waiting
+
+
+class SSHException(Exception):
+    """ Base Exception class for file """
+
+
+class SSHUnavailable(SSHException):
+    """ The droplet didn't accept SSH connections in time """
+
+
+class CommandTimedOut(SSHException):
+    """ A command ran for longer than its timeout """
+
+    def __init__(self, message: str, result):
+        super().__init__(message)
+        self.result = result
+
+
+# how much is read from a stream at once, and the longest line kept whole
+CHUNK_SIZE = 32768
+MAX_LINE = 65536
+
+
+class TrustOnFirstUse(paramiko.MissingHostKeyPolicy):
+    """ Accepts the first host key the server offers, keeping it in ``key`` """
+
+    def __init__(self):
+        self.key = None
+
+    def missing_host_key(self, client, hostname, key):
+        self.key = key
+        client.get_host_keys().add(hostname, key.get_name(), key)
+
+
+def host_key_line(key) -> str:
+    """ ``ssh-ed25519 AAAA...``, as stored in known_hosts """
+    return f"{key.get_name()} {key.get_base64()}"
+
+
+def parse_host_key(line: str):
+    """ The key in a line written by ``host_key_line`` """
+    entry = paramiko.hostkeys.HostKeyEntry.from_line(f"pinned {line}")
+    if entry is None:
+        raise SSHException(f"Can't parse host key {line!r}")
+    return entry.key
+
+
+def port_open(host: str, port: int = 22, timeout: float = 1.0) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def wait_for_port(host: str, port: int = 22, timeout: float = 300, **options):
+    """ Probes ``port`` on a tight, growing interval until it accepts """
+    options.setdefault("first", 0.25)
+    options.setdefault("longest", 2.0)
+    try:
+        return waiting.wait_for(
+            lambda: port_open(host, port) or None,
+            timeout=timeout,
+            description=f"{host}:{port}",
+            **options,
+        )
+    except waiting.WaitTimedOut as error:
+        raise SSHUnavailable(str(error))
+
+
+def connect(
+    host: str,
+    pkey,
+    host_key: str = None,
+    username: str = "root",
+    timeout: float = 120,
+    keepalive: int = 0,
+    client_class=paramiko.SSHClient,
+    port: int = 22,
+    **options,
+):
+    """
+    Connects once sshd accepts, retrying handshakes that fail while the droplet
+    finishes booting (e.g. before its authorized_keys are written). With a
+    ``host_key`` line, any other key is rejected; without one, the key offered
+    is trusted. With ``keepalive``, the connection sends a keepalive after that
+    many idle seconds. Returns the client, the host key line and the time taken.
+    """
+    waited = wait_for_port(host, port, timeout, **options)
+    client = client_class()
+    policy = TrustOnFirstUse()
+    if host_key:
+        key = parse_host_key(host_key)
+        # paramiko looks keys for other ports up as "[host]:port"
+        name = host if port == 22 else f"[{host}]:{port}"
+        client.get_host_keys().add(name, key.get_name(), key)
+        client.set_missing_host_key_policy(paramiko.RejectPolicy())
+    else:
+        client.set_missing_host_key_policy(policy)
+
+    def handshake():
+        try:
+            client.connect(
+                host,
+                port=port,
+                username=username,
+                pkey=pkey,
+                timeout=10,
+                banner_timeout=10,
+                auth_timeout=10,
+                look_for_keys=False,
+                allow_agent=False,
+            )
+        except paramiko.BadHostKeyException:
+            raise
+        except (paramiko.SSHException, OSError):
+            client.close()
+            return None
+        return client
+
+    try:
+        connected = waiting.wait_for(
+            handshake,
+            timeout=max(timeout - waited.seconds, 10),
+            description=f"SSH on {host}",
+            first=0.5,
+            longest=5.0,
+        )
+    except waiting.WaitTimedOut as error:
+        raise SSHUnavailable(str(error))
+    if keepalive:
+        client.get_transport().set_keepalive(keepalive)
+    pinned = host_key or host_key_line(policy.key)
+    return client, pinned, waited.seconds + connected.seconds
+
+
+def alive(client, timeout: float = 5.0) -> bool:
+    """
+    Whether ``client``'s connection still works. Opening a channel takes a
+    round trip to the server, so it catches droplets that went away without
+    closing the connection, at a fraction of the cost of a new one
+    """
+    transport = client.get_transport()
+    if transport is None or not transport.is_active():
+        return False
+    try:
+        transport.open_session(timeout=timeout).close()
+    except (paramiko.SSHException, OSError, EOFError):
+        return False
+    return True
+
+
+class CommandResult(object):
+    """ How a command ended, with the last ``tail`` lines it printed """
+
+    def __init__(self, exit_code, tail, lines: int):
+        self.exit_code = exit_code
+        self.tail = list(tail)
+        self.lines = lines
+
+    @property
+    def output(self) -> str:
+        """ The tail, noting how many earlier lines were dropped """
+        dropped = self.lines - len(self.tail)
+        text = "\n".join(self.tail)
+        if dropped:
+            text = f"[{dropped} earlier lines not kept]\n{text}"
+        return text
+
+
+def _wait_for_data(channel, seconds: float):
+    # the channel's pipe is readable once either stream has data, or it closes
+    select.select([channel], [], [], seconds)
+
+
+def output_lines(
+    channel, timeout: float = None, wait=_wait_for_data, clock=time.monotonic
+):
+    """
+    Yields ``("stdout" or "stderr", line)`` from a command's channel as the
+    output arrives, reading both streams so neither can stall the command.
+    Raises ``CommandTimedOut`` (with an empty result) after ``timeout``
+    seconds, having closed the channel.
+    """
+    deadline = None if timeout is None else clock() + timeout
+    streams = (
+        ("stdout", channel.recv_ready, channel.recv),
+        ("stderr", channel.recv_stderr_ready, channel.recv_stderr),
+    )
+    partial = {"stdout": b"", "stderr": b""}
+
+    def split(name: str, data: bytes):
+        *lines, partial[name] = (partial[name] + data).split(b"\n")
+        if len(partial[name]) > MAX_LINE:
+            lines.append(partial[name])
+            partial[name] = b""
+        for line in lines:
+            yield name, line.decode(errors="replace").rstrip("\r")
+
+    while True:
+        received = False
+        for name, ready, recv in streams:
+            while ready():
+                received = True
+                yield from split(name, recv(CHUNK_SIZE))
+        # the exit status comes after all of the output
+        if channel.exit_status_ready() and not (
+            channel.recv_ready() or channel.recv_stderr_ready()
+        ):
+            break
+        if deadline is not None and clock() >= deadline:
+            channel.close()
+            raise CommandTimedOut(
+                f"Command still running after {timeout}s",
+                CommandResult(None, [], 0),
+            )
+        if not received:
+            wait(channel, 0.1)
+    for name in ("stdout", "stderr"):
+        if partial[name]:
+            yield from split(name, b"\n")
+
+
+def collect(channel, on_line=None, timeout: float = None, tail: int = 200, **options):
+    """
+    Runs a command's channel to completion, passing each line to
+    ``on_line(stream, line)`` and keeping the last ``tail`` lines of both
+    streams. Returns a ``CommandResult`` with the exit code.
+    """
+    kept = deque(maxlen=tail)
+    count = 0
+    try:
+        for stream, line in output_lines(channel, timeout, **options):
+            count += 1
+            kept.append(line)
+            if on_line is not None:
+                on_line(stream, line)
+    except CommandTimedOut as error:
+        error.result = CommandResult(None, kept, count)
+        raise
+    return CommandResult(channel.recv_exit_status(), kept, count)
@@ -0,0 +1,134 @@
+"""
+Measures what a cold start costs: how long importing the lambda takes, how
+long the first call of each action then takes, and which heavy libraries each
+one had to import. Every sample is a fresh interpreter, as a cold lambda is.
+
+The defaults need no credentials or network, keeping jobs in a local
+directory. Actions that call DigitalOcean or AWS can be measured too, given
+the same environment the lambda has:
+
+    python startup_benchmark.py --action status --action backup --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# the imports worth deferring, each a sizeable part of a second on a lambda
+HEAVY_MODULES = ("boto3", "botocore.session", "digitalocean", "paramiko", "requests")
+
+SAMPLE = """
+import json, sys, time
+start = time.perf_counter()
+import lambda_function
+imported = time.perf_counter()
+lambda_function.lambda_handler(json.loads(sys.argv[1]), object())
+called = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "first_call": called - imported,
+    "loaded": [name for name in json.loads(sys.argv[2]) if name in sys.modules],
+}))
+"""
+
+
+class StartupBenchmarkException(Exception):
+    """ Base Exception class for file """
+
+
+def offline_environment(job_dir: str) -> dict:
+    """ Enough configuration for actions that don't leave the machine """
+    environment = dict(os.environ)
+    environment.setdefault("APP_NAME", "benchmark")
+    environment.setdefault("S3_BUCKET_NAME", "benchmark")
+    environment.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    environment.setdefault("JOB_STORE", "directory")
+    environment.setdefault("JOB_DIR", job_dir)
+    return environment
+
+
+def sample(event: dict, environment: dict) -> dict:
+    """ Import time, first call time and heavy modules loaded, for one event """
+    result = subprocess.run(
+        [sys.executable, "-c", SAMPLE, json.dumps(event), json.dumps(HEAVY_MODULES)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=environment,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if result.returncode:
+        raise StartupBenchmarkException(
+            f'"{event["action"]}" failed:\n{result.stderr.strip()}'
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(event: dict, environment: dict, runs: int) -> dict:
+    """ The median of ``runs`` cold starts """
+    samples = [sample(event, environment) for _ in range(runs)]
+    return {
+        "action": event["action"],
+        "import": statistics.median(s["import"] for s in samples),
+        "first_call": statistics.median(s["first_call"] for s in samples),
+        "loaded": samples[-1]["loaded"],
+    }
+
+
+def describe(result: dict) -> str:
+    loaded = ", ".join(result["loaded"]) or "none"
+    return (
+        f'{result["action"]:<14} import {result["import"] * 1000:7.1f}ms   '
+        f'first call {result["first_call"] * 1000:7.1f}ms   heavy imports: {loaded}'
+    )
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--action",
+        action="append",
+        dest="actions",
+        help="Action to measure, may be repeated (default: status)",
+    )
+    parser.add_argument("--app-name", default="benchmark", help="App to act upon")
+    parser.add_argument("--body", default="", help="Message body for each action")
+    parser.add_argument("--runs", type=int, default=3, help="Cold starts per action")
+    parser.add_argument(
+        "--max-import",
+        type=float,
+        help="Fail if importing the lambda takes longer than this, in seconds",
+    )
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    with tempfile.TemporaryDirectory() as job_dir:
+        environment = offline_environment(job_dir)
+        results = [
+            measure(
+                {"action": action, "app_name": args.app_name, "body": args.body},
+                environment,
+                args.runs,
+            )
+            for action in args.actions or ["status"]
+        ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("\n".join(describe(result) for result in results))
+
+    slowest = max(result["import"] for result in results)
+    if args.max_import is not None and slowest > args.max_import:
+        sys.exit(f"Import took {slowest:.3f}s, over the {args.max_import:.3f}s limit")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Droplet-side sampling of an app container's resource use, through the Docker
+Engine's stats API on its unix socket. Like ``transfer``, this runs on the
+droplet's system python3, so it only uses the standard library:
+
+    python3 telemetry.py sample <container> [--seconds N] [--interval N]
+
+``sample`` reads the container's counters every ``--interval`` seconds for
+``--seconds`` and prints one line of JSON: a compact time series with a value
+per interval for CPU (in cores), memory (in MB), disk reads and writes and
+network traffic in and out (in KB/s).
+"""
+
+import argparse
+import http.client
+import json
+import socket
+import sys
+import time
+import urllib.parse
+
+DOCKER_SOCKET = "/var/run/docker.sock"
+MB = 1024 * 1024
+KB = 1024
+# counters that the series holds the rate of, in KB/s
+RATES = ["disk_read", "disk_write", "net_rx", "net_tx"]
+
+
+class TelemetryException(Exception):
+    """ Base Exception class for file """
+
+
+class DockerError(TelemetryException):
+    """ The Docker Engine refused a request, e.g. for a container that's gone """
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """ HTTP to a server listening on a unix socket, as dockerd does """
+
+    def __init__(self, path, timeout=30):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def container_stats(container, socket_path=DOCKER_SOCKET):
+    """
+    One reading of ``container``'s stats. ``one-shot`` skips the second of
+    CPU sampling Docker would otherwise do, as ``counters`` keeps its own
+    previous reading; engines too old for it ignore it and take a second.
+    """
+    connection = UnixHTTPConnection(socket_path)
+    try:
+        connection.request(
+            "GET",
+            "/containers/%s/stats?stream=false&one-shot=true"
+            % urllib.parse.quote(container),
+        )
+        response = connection.getresponse()
+        body = response.read()
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise DockerError(
+            "Stats for %s: HTTP %d %s"
+            % (container, response.status, body.decode(errors="replace").strip())
+        )
+    return json.loads(body.decode())
+
+
+def counters(stats):
+    """ The running totals and gauges in a stats reading, by name """
+    cpu = stats.get("cpu_stats") or {}
+    memory = stats.get("memory_stats") or {}
+    memory_detail = memory.get("stats") or {}
+    # page cache the kernel can drop isn't counted, as "docker stats" doesn't
+    inactive = memory_detail.get(
+        "total_inactive_file", memory_detail.get("inactive_file", 0)
+    )
+    disk = {"read": 0, "write": 0}
+    blkio = (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive")
+    for entry in blkio or []:
+        op = entry.get("op", "").lower()
+        if op in disk:
+            disk[op] += entry.get("value", 0)
+    networks = (stats.get("networks") or {}).values()
+    return {
+        "cpu": (cpu.get("cpu_usage") or {}).get("total_usage", 0),
+        "system_cpu": cpu.get("system_cpu_usage", 0),
+        "cpus": cpu.get("online_cpus")
+        or len((cpu.get("cpu_usage") or {}).get("percpu_usage") or []),
+        "memory": max(0, memory.get("usage", 0) - inactive),
+        "memory_limit": memory.get("limit", 0),
+        "disk_read": disk["read"],
+        "disk_write": disk["write"],
+        "net_rx": sum(network.get("rx_bytes", 0) for network in networks),
+        "net_tx": sum(network.get("tx_bytes", 0) for network in networks),
+    }
+
+
+def new_series(container, interval, first):
+    series = {
+        "container": container,
+        "start": int(time.time()),
+        "interval": interval,
+        "cpus": first["cpus"],
+        "memory_limit_mb": round(first["memory_limit"] / MB),
+        "cpu": [],
+        "memory": [],
+    }
+    series.update((name, []) for name in RATES)
+    return series
+
+
+def add_interval(series, previous, current, seconds):
+    """
+    Appends what happened between two readings. A counter that went backwards
+    means the container restarted, so that interval counts from zero.
+    """
+
+    def delta(name):
+        change = current[name] - previous[name]
+        return change if change >= 0 else current[name]
+
+    system = delta("system_cpu")
+    cores = delta("cpu") / system * current["cpus"] if system else 0.0
+    series["cpu"].append(round(cores, 2))
+    series["memory"].append(round(current["memory"] / MB))
+    for name in RATES:
+        series[name].append(round(delta(name) / KB / max(seconds, 1e-6)))
+
+
+def sample(
+    container,
+    seconds=300,
+    interval=10,
+    stats=container_stats,
+    clock=time.monotonic,
+    sleep=time.sleep,
+):
+    """ ``container``'s resource use over ``seconds``, as a series """
+    previous, then = counters(stats(container)), clock()
+    series = new_series(container, interval, previous)
+    started = then
+    for tick in range(1, max(1, int(seconds // interval)) + 1):
+        # on a fixed schedule, however long the readings take
+        sleep(max(0, started + tick * interval - clock()))
+        current, now = counters(stats(container)), clock()
+        add_interval(series, previous, current, now - then)
+        previous, then = current, now
+    return series
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command")
+    sample_parser = commands.add_parser("sample")
+    sample_parser.add_argument("container")
+    sample_parser.add_argument("--seconds", type=float, default=300)
+    sample_parser.add_argument("--interval", type=float, default=10)
+    sample_parser.add_argument("--socket", default=DOCKER_SOCKET)
+    args = parser.parse_args(argv)
+
+    if args.command == "sample":
+        series = sample(
+            args.container,
+            args.seconds,
+            args.interval,
+            stats=lambda container: container_stats(container, args.socket),
+        )
+        print(json.dumps(series, separators=(",", ":")))
+    else:
+        parser.error("a command is required")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Unit tests for the archive pipelines, run locally against a stand-in aws cli
+"""
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+
+from archive import (
+    UnknownCodec,
+    archive_backup_commands,
+    archive_extract_command,
+    benchmark,
+    format_benchmark,
+    parse_codec,
+    pipeline,
+    stream_backup_command,
+    stream_restore_command,
+)
+
+TRANSFER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transfer.py")
+
+
+def run(command):
+    return subprocess.run(
+        command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+
+
+def make_app(tmp_path):
+    app_dir = tmp_path / "app"
+    (app_dir / "saves").mkdir(parents=True)
+    (app_dir / "saves" / "world.zip").write_bytes(os.urandom(50000))
+    return app_dir
+
+
+def backup(tmp_path, app_dir):
+    return run(
+        stream_backup_command(
+            str(app_dir),
+            "s3://bucket/app/app.tar.gz",
+            TRANSFER,
+            str(tmp_path / "app.tar.gz.json"),
+            codec="gzip:1",
+            progress_every=10240,
+        )
+    )
+
+
+def test_pipeline_fails_when_any_stage_fails():
+    assert run(pipeline("false", "cat")).returncode != 0
+    assert run(pipeline("true", "cat")).returncode == 0
+
+
+def test_stream_backup_uploads_a_tarball(tmp_path, fake_aws):
+    app_dir = make_app(tmp_path)
+
+    result = backup(tmp_path, app_dir)
+
+    assert result.returncode == 0, result.stderr
+    assert b"Total bytes written" in result.stderr
+    assert b"bytes" in result.stderr.splitlines()[-1]
+    with tarfile.open(str(fake_aws / "app.tar.gz")) as archive:
+        assert "./saves/world.zip" in archive.getnames()
+    metadata = json.loads((fake_aws / "app.tar.gz.json").read_text())
+    assert metadata["codec"] == "gzip:1"
+    assert "sha256" in metadata
+    assert os.listdir(str(app_dir)) == ["saves"]
+
+
+def test_stream_restore_verifies_checksum(tmp_path, fake_aws, range_server):
+    app_dir = make_app(tmp_path)
+    assert backup(tmp_path, app_dir).returncode == 0
+    served, url = range_server
+    shutil.copy(str(fake_aws / "app.tar.gz"), str(served / "app.tar.gz"))
+    sha256 = json.loads((fake_aws / "app.tar.gz.json").read_text())["sha256"]
+    target = tmp_path / "restored"
+    target.mkdir()
+
+    result = run(
+        stream_restore_command(
+            f"{url}/app.tar.gz?X-Amz-Signature=x&X-Amz-Expires=3600",
+            str(target),
+            TRANSFER,
+            sha256=sha256,
+            part_size=4096,
+            workers=4,
+        )
+    )
+
+    assert result.returncode == 0, result.stderr
+    original = (app_dir / "saves" / "world.zip").read_bytes()
+    assert (target / "saves" / "world.zip").read_bytes() == original
+
+    mismatch = run(
+        stream_restore_command(
+            f"{url}/app.tar.gz", str(target), TRANSFER, sha256="0" * 64
+        )
+    )
+    assert mismatch.returncode != 0
+    assert b"DigestMismatch" in mismatch.stderr
+
+
+@pytest.mark.parametrize("spec", ["gzip:1", "pigz", "zstd:3", "lz4"])
+def test_codecs_round_trip(tmp_path, spec):
+    codec, level = parse_codec(spec)
+    if not shutil.which(codec.package):
+        pytest.skip(f"{codec.package} isn't installed")
+    app_dir = make_app(tmp_path)
+    archive_file = str(tmp_path / "app.tar")
+    target = tmp_path / "restored"
+    target.mkdir()
+
+    create = archive_backup_commands(str(app_dir), archive_file, "s3://b/k", spec)[0]
+    assert run(create).returncode == 0
+    assert run(archive_extract_command(archive_file, str(target), spec)).returncode == 0
+
+    original = (app_dir / "saves" / "world.zip").read_bytes()
+    assert (target / "saves" / "world.zip").read_bytes() == original
+
+
+def test_unknown_codec():
+    with pytest.raises(UnknownCodec):
+        parse_codec("bzip9")
+
+
+def test_benchmark_reports_each_codec(tmp_path):
+    app_dir = make_app(tmp_path)
+    (app_dir / "config.ini").write_text("setting=value\n" * 1000)
+
+    results = benchmark(str(app_dir), ["gzip:1", "gzip:9"], workdir=str(tmp_path))
+
+    assert [r["codec"] for r in results] == ["gzip:1", "gzip:9"]
+    assert all(r["ratio"] > 1 and r["compress_mb_s"] > 0 for r in results)
+    assert "decompress MB/s" in format_benchmark(results)
+    assert os.listdir(str(tmp_path)) == ["app"]
@@ -0,0 +1,169 @@
+"""
+Unit tests for chunked, deduplicated backups
+"""
+import io
+import os
+import random
+import subprocess
+import sys
+import time
+
+import pytest
+
+import chunkstore
+from chunkstore import (
+    CHUNKS,
+    Chunker,
+    DirectoryStore,
+    ManifestNotFound,
+    backup,
+    prune,
+    restore,
+)
+from startup_benchmark import offline_environment
+
+SMALL = dict(min_size=1024, avg_size=4096, max_size=16384)
+
+
+def noise(size, seed):
+    return random.Random(seed).getrandbits(8 * size).to_bytes(size, "big")
+
+
+def make_tree(root, files):
+    for path, data in files.items():
+        full = os.path.join(root, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, "wb") as f:
+            f.write(data)
+
+
+def test_chunks_reassemble_within_bounds():
+    data = noise(200000, 1)
+    chunks = list(Chunker(**SMALL).chunks(io.BytesIO(data), read_size=5000))
+    assert b"".join(chunks) == data
+    assert all(len(c) <= SMALL["max_size"] for c in chunks)
+    assert all(len(c) >= SMALL["min_size"] for c in chunks[:-1])
+
+
+def test_boundaries_survive_an_insertion():
+    data = noise(200000, 2)
+    chunker = Chunker(**SMALL)
+    before = set(chunker.chunks(io.BytesIO(data)))
+    after = set(chunker.chunks(io.BytesIO(b"inserted" + data)))
+    assert len(before & after) >= len(before) - 2
+
+
+def test_vectorised_boundaries_match_the_byte_at_a_time_hash(monkeypatch):
+    pytest.importorskip("numpy")
+    data = noise(300000, 4)
+    for sizes in (SMALL, dict(min_size=16, avg_size=64, max_size=200)):
+        vectorised = list(Chunker(**sizes).chunks(io.BytesIO(data)))
+        with monkeypatch.context() as patched:
+            patched.setattr(chunkstore, "numpy", None)
+            assert list(Chunker(**sizes).chunks(io.BytesIO(data))) == vectorised
+
+
+def test_restore_removes_unlisted_files_and_replaces_symlinks(tmp_path):
+    source, target = tmp_path / "source", tmp_path / "target"
+    make_tree(str(source), {"world/r.0.0.mca": b"kept", "server.properties": b"a"})
+    store = DirectoryStore(str(tmp_path / "store"))
+    backup(str(source), store, Chunker(**SMALL))
+
+    outside = tmp_path / "outside"
+    outside.write_bytes(b"untouched")
+    make_tree(str(target), {"world/r.9.9.mca": b"stale", "logs/latest.log": b"x"})
+    os.symlink(str(outside), str(target / "server.properties"))
+    stats = restore(str(target), store)
+
+    assert stats["removed"] == 3
+    assert sorted(os.listdir(str(target))) == ["server.properties", "world"]
+    assert os.listdir(str(target / "world")) == ["r.0.0.mca"]
+    assert not os.path.islink(str(target / "server.properties"))
+    assert (target / "server.properties").read_bytes() == b"a"
+    assert outside.read_bytes() == b"untouched"
+
+
+def test_backup_and_restore_round_trip(tmp_path):
+    source, target = tmp_path / "source", tmp_path / "target"
+    files = {"world/r.0.0.mca": noise(50000, 3), "server.properties": b"motd=hi\n"}
+    make_tree(str(source), files)
+    store = DirectoryStore(str(tmp_path / "store"))
+
+    backup(str(source), store, Chunker(**SMALL))
+    restore(str(target), store)
+
+    for path, data in files.items():
+        assert (target / path).read_bytes() == data
+
+
+def test_second_backup_only_uploads_changes(tmp_path):
+    source = tmp_path / "source"
+    world = noise(100000, 4)
+    make_tree(str(source), {"world/r.0.0.mca": world, "other.dat": noise(30000, 5)})
+    store = DirectoryStore(str(tmp_path / "store"))
+    first = backup(str(source), store, Chunker(**SMALL))
+
+    changed = world[:50000] + b"x" + world[50001:]
+    make_tree(str(source), {"world/r.0.0.mca": changed})
+    os.utime(str(source / "world/r.0.0.mca"), (1, 1))
+    second = backup(str(source), store, Chunker(**SMALL))
+
+    assert 0 < second["chunks"] < first["chunks"]
+    assert second["read"] == len(changed)
+
+
+def test_prune_keeps_chunks_of_remaining_manifests(tmp_path):
+    source = tmp_path / "source"
+    make_tree(str(source), {"a": noise(20000, 6)})
+    store = DirectoryStore(str(tmp_path / "store"))
+    backup(str(source), store, Chunker(**SMALL))
+    make_tree(str(source), {"a": noise(20000, 7)})
+    backup(str(source), store, Chunker(**SMALL))
+
+    result = prune(store, 1)
+    assert result["manifests"] == 1
+    assert result["chunks"] > 0
+    restore(str(tmp_path / "target"), store)
+    assert (tmp_path / "target" / "a").read_bytes() == noise(20000, 7)
+    assert store.list(CHUNKS)
+
+
+def test_restore_without_backups(tmp_path):
+    with pytest.raises(ManifestNotFound):
+        restore(str(tmp_path / "target"), DirectoryStore(str(tmp_path / "store")))
+
+
+def test_rate_limited_backup(tmp_path):
+    source = tmp_path / "source"
+    make_tree(str(source), {"a": noise(40000, 8)})
+    store = DirectoryStore(str(tmp_path / "store"))
+
+    start = time.monotonic()
+    backup(str(source), store, Chunker(**SMALL), rate_limit=100000)
+
+    assert time.monotonic() - start >= 0.35
+
+
+FAILED_RESTORE = """
+import lambda_function, ssh
+lambda_function.Controller._stream = lambda self, command: ssh.CommandResult(
+    1, ["ManifestNotFound: no backups in store"], 1
+)
+try:
+    lambda_function.Controller("benchmark").restore()
+except lambda_function.RestoreFailed as error:
+    print(error)
+"""
+
+
+def test_a_failed_chunked_restore_is_reported(tmp_path):
+    environment = dict(offline_environment(str(tmp_path)), BACKUP_MODE="chunked")
+    # settings are read on import, so the controller gets a process of its own
+    output = subprocess.check_output(
+        [sys.executable, "-c", FAILED_RESTORE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=environment,
+        universal_newlines=True,
+    )
+    assert "Restore exited with status 1" in output
+    assert "no backups in store" in output
@@ -0,0 +1,119 @@
+"""
+Unit tests for the DigitalOcean client layer, with fake responses and clocks
+"""
+import threading
+import time
+
+import pytest
+import requests
+
+import doclient
+
+
+class FakeResponse(object):
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_token_bucket_bursts_then_paces():
+    now = [0.0]
+    bucket = doclient.TokenBucket(capacity=2, rate=1.0, clock=lambda: now[0])
+    assert [bucket.wait_time() for _ in range(3)] == [0.0, 0.0, 1.0]
+    now[0] = 10.0
+    assert bucket.wait_time() == 0.0
+
+
+def test_token_bucket_slows_down_when_allowance_runs_low():
+    bucket = doclient.TokenBucket(capacity=10, rate=5.0)
+    bucket.update(remaining=30, reset_at=1060.0, now=1000.0)
+    assert bucket.rate == pytest.approx(0.5)
+    assert bucket.tokens <= 10
+    bucket.update(remaining=0, reset_at=1060.0, now=1000.0)
+    assert bucket.rate == pytest.approx(1 / 60.0)
+
+
+def test_backoff_delays_grow_with_jitter():
+    class Ceiling(object):
+        def uniform(self, low, high):
+            return high
+
+    delays = doclient.backoff_delays(6, base=1, cap=10, rng=Ceiling())
+    assert delays == [1, 2, 4, 8, 10, 10]
+
+
+def test_endpoints_group_ids():
+    endpoint = doclient.Metrics.endpoint
+    assert (
+        endpoint("GET", "https://api.digitalocean.com/v2/droplets/1234/actions/9")
+        == "GET droplets/:id/actions/:id"
+    )
+    assert endpoint("GET", "https://api.digitalocean.com/v2/account/keys") == (
+        "GET account/keys"
+    )
+
+
+def test_429s_are_retried_and_counted():
+    sleeps = []
+    client = doclient.Client(burst=100, max_retries=3, sleep=sleeps.append)
+    url = "https://api.digitalocean.com/v2/droplets"
+    for method in ("GET", "POST"):
+        responses = [FakeResponse(429, {"Retry-After": "2"}), FakeResponse(200)]
+        response = client.request(lambda *args: responses.pop(0), method, url, {})
+        assert response.status_code == 200
+    # the first backoff is under a second, so Retry-After wins
+    assert sleeps == [2.0, 2.0]
+    stats = client.metrics.snapshot()["GET droplets"]
+    assert (stats["calls"], stats["errors"], stats["retries"]) == (2, 1, 1)
+
+
+def test_server_errors_are_only_retried_for_reads():
+    client = doclient.Client(burst=100, max_retries=2, sleep=lambda _: None)
+    url = "https://api.digitalocean.com/v2/droplets"
+    assert client.request(lambda *a: FakeResponse(503), "POST", url, {}).status_code
+    assert client.metrics.snapshot()["POST droplets"]["calls"] == 1
+    client.request(lambda *a: FakeResponse(503), "GET", url, {})
+    assert client.metrics.snapshot()["GET droplets"]["calls"] == 3
+
+
+def test_connection_errors_fail_writes_immediately():
+    def fail(*args):
+        raise requests.ConnectionError
+
+    client = doclient.Client(burst=100, max_retries=2, sleep=lambda _: None)
+    with pytest.raises(requests.ConnectionError):
+        client.request(fail, "DELETE", "https://api/v2/droplets/1", {})
+    assert client.metrics.snapshot()["DELETE droplets/:id"]["calls"] == 1
+
+
+def test_identical_gets_in_flight_are_coalesced():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def send(url, method, params):
+        calls.append(url)
+        started.set()
+        release.wait(5)
+        return FakeResponse(200)
+
+    client = doclient.Client(burst=100)
+    url = "https://api.digitalocean.com/v2/droplets/1"
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(client.request(send, "GET", url, {}))
+        )
+        for _ in range(4)
+    ]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 4 and len({id(r) for r in results}) == 1
+    assert client.metrics.snapshot()["GET droplets/:id"]["coalesced"] == 3
@@ -0,0 +1,73 @@
+"""
+Unit tests for fleet operations, with stand-in actions
+"""
+import threading
+import time
+
+import fleet
+
+
+def test_failures_dont_stop_the_rest():
+    def act(app_name):
+        if app_name == "factorio":
+            raise RuntimeError("no droplet")
+        return f"Backed up {app_name}"
+
+    results = fleet.run(["minecraft", "factorio", "valheim"], act)
+    assert [result.app_name for result in results] == [
+        "minecraft",
+        "factorio",
+        "valheim",
+    ]
+    assert [result.ok for result in results] == [True, False, True]
+    assert results[1].error == "RuntimeError: no droplet"
+
+    summary = fleet.summary("backup", results, 12.5)
+    assert summary.splitlines()[0] == 'Ran "backup" on 3 app(s), 1 failed in 12.5s'
+    assert "factorio (0.0s): Failed: RuntimeError: no droplet" in summary
+
+
+def test_parallelism_is_bounded():
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def act(app_name):
+        with lock:
+            running.append(app_name)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(app_name)
+
+    start = time.monotonic()
+    results = fleet.run([f"app{i}" for i in range(6)], act, parallelism=3)
+    assert all(result.ok for result in results)
+    assert max(peak) == 3
+    # two rounds of three, rather than six in a row
+    assert time.monotonic() - start < 0.25
+
+
+def test_no_apps():
+    assert fleet.run([], lambda app_name: None) == []
+
+
+class FakeDroplet(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeManager(object):
+    def __init__(self, droplets):
+        self.droplets = droplets
+        self.tags = []
+
+    def get_all_droplets(self, tag_name=None):
+        self.tags.append(tag_name)
+        return self.droplets
+
+
+def test_app_names_from_tagged_droplets():
+    manager = FakeManager([FakeDroplet("valheim"), FakeDroplet("minecraft")])
+    assert fleet.app_names(manager) == ["minecraft", "valheim"]
+    assert manager.tags == [fleet.APP_TAG]
@@ -0,0 +1,41 @@
+"""
+Unit tests for naming and picking baked snapshots
+"""
+import images
+
+
+class FakeImage(object):
+    """ Stands in for ``digitalocean.Image`` """
+
+    def __init__(self, name, regions=("nyc1",)):
+        self.name = name
+        self.regions = list(regions)
+
+
+def test_snapshot_name_round_trips():
+    name = images.snapshot_name("factoriotools/factorio:1.0", "0123456789ab", 0)
+    assert name == "auto-server-factoriotools-factorio-1-0-0123456789ab-19700101000000"
+    assert images.snapshot_version(FakeImage(name)) == "0123456789ab"
+    assert images.snapshot_version(FakeImage("ubuntu-18-04")) is None
+
+
+def test_bake_version_changes_with_inputs():
+    assert images.bake_version("a", "b") == images.bake_version("a", "b")
+    assert images.bake_version("a", "b") != images.bake_version("ab")
+    assert len(images.bake_version("a")) == 12
+
+
+def test_newest_snapshot_and_expiry():
+    dockerfile = "factoriotools/factorio:1.0"
+    old = FakeImage(images.snapshot_name(dockerfile, "a" * 12, 100))
+    new = FakeImage(images.snapshot_name(dockerfile, "b" * 12, 200), ["sfo2"])
+    newest = FakeImage(images.snapshot_name(dockerfile, "c" * 12, 300))
+    other = FakeImage(images.snapshot_name("itzg/minecraft-server", "d" * 12, 400))
+    unrelated = FakeImage("my manual snapshot")
+    all_images = [old, other, newest, unrelated, new]
+
+    assert images.newest_snapshot(all_images, dockerfile) is newest
+    assert images.newest_snapshot([old, new], dockerfile, "nyc1") is old
+    assert images.newest_snapshot([other, unrelated], dockerfile) is None
+    assert images.expired_snapshots(all_images, dockerfile, 1) == [new, old]
+    assert images.expired_snapshots(all_images, dockerfile, 5) == []
@@ -0,0 +1,133 @@
+"""
+Unit tests for the job model, against a store in a temporary directory and
+one in a fake S3 bucket
+"""
+import pytest
+
+import jobs
+
+
+@pytest.fixture(params=["directory", "s3"])
+def store(request, tmp_path, s3_bucket):
+    if request.param == "directory":
+        return jobs.DirectoryJobStore(str(tmp_path / "jobs"))
+    return jobs.S3JobStore(s3_bucket, "jobs/")
+
+
+def test_store_round_trip(store):
+    assert store.jobs("minecraft") == []
+    job = jobs.Job("create", "minecraft", "1.16")
+    store.save(job)
+
+    loaded = store.load("minecraft", job.id)
+    assert loaded.to_dict() == job.to_dict()
+    assert [j.id for j in store.jobs("minecraft")] == [job.id]
+    assert store.jobs("factorio") == []
+    with pytest.raises(jobs.JobNotFound):
+        store.load("minecraft", "missing")
+
+
+def test_run_saves_each_stage(store):
+    job, _ = jobs.submit(store, "create", "minecraft")
+    job = jobs.run(store, job, [("one", lambda: "first"), ("two", lambda: None)])
+
+    assert job.state == jobs.SUCCEEDED
+    assert store.load("minecraft", job.id).completed == ["one", "two"]
+    assert job.messages == {"one": "first", "two": ""}
+
+
+def test_failed_job_resumes_from_failed_stage(store):
+    calls = []
+
+    def flaky():
+        calls.append("flaky")
+        if calls.count("flaky") == 1:
+            raise RuntimeError("droplet not ready")
+        return "ok"
+
+    stages = [("one", lambda: calls.append("one")), ("flaky", flaky)]
+    job, _ = jobs.submit(store, "create", "minecraft")
+    job = jobs.run(store, job, stages)
+    assert job.state == jobs.FAILED
+    assert job.error == "flaky: RuntimeError: droplet not ready"
+
+    again, new = jobs.submit(store, "create", "minecraft")
+    assert new and again.id == job.id
+    assert again.state == jobs.QUEUED and again.error is None
+    job = jobs.run(store, again, stages)
+    assert job.state == jobs.SUCCEEDED
+    assert calls == ["one", "flaky", "flaky"]
+    assert job.attempts == 2
+
+
+def test_duplicate_submissions_share_a_job(store):
+    job, new = jobs.submit(store, "destroy", "minecraft")
+    assert new
+    duplicate, new = jobs.submit(store, "destroy", "minecraft")
+    assert duplicate.id == job.id and not new
+
+    job.state = jobs.RUNNING
+    store.save(job)
+    duplicate, new = jobs.submit(store, "destroy", "minecraft")
+    assert duplicate.state == jobs.RUNNING and not new
+    assert not job.stalled(900)
+    assert job.stalled(900, now=job.updated_at + 901)
+
+    # a different request for the app is a different job
+    other, new = jobs.submit(store, "destroy", "minecraft", "now")
+    assert other.id != job.id and new
+
+
+def test_submit_after_success_starts_new_job(store):
+    job, _ = jobs.submit(store, "backup", "minecraft")
+    job = jobs.run(store, job, [])
+    assert job.state == jobs.SUCCEEDED
+    assert jobs.submit(store, "backup", "minecraft")[0].id != job.id
+
+
+def test_run_requeues_when_out_of_time(store):
+    left = [1000]
+
+    def slow():
+        left[0] = 10
+        return "done"
+
+    stages = [("slow", slow), ("next", lambda: "next")]
+    job, _ = jobs.submit(store, "create", "minecraft")
+    job = jobs.run(store, job, stages, time_left=lambda: left[0], margin=60)
+    assert job.state == jobs.QUEUED
+    assert job.completed == ["slow"]
+
+    # a fresh worker always gets through at least one stage
+    job = jobs.run(store, job, stages, time_left=lambda: 10, margin=60)
+    assert job.state == jobs.SUCCEEDED
+    assert job.completed == ["slow", "next"]
+
+
+def test_latest_is_found_per_app_and_action(store):
+    backup, _ = jobs.submit(store, "backup", "minecraft")
+    jobs.run(store, backup, [])
+    create, _ = jobs.submit(store, "create", "minecraft")
+    other, _ = jobs.submit(store, "backup", "factorio")
+
+    assert jobs.latest(store, "minecraft").id == create.id
+    assert jobs.latest(store, "minecraft", "backup").id == backup.id
+    assert jobs.latest(store, "factorio").id == other.id
+    assert jobs.latest(store, "terraria") is None
+    # retrying a failed job doesn't make it any less the latest
+    create.state = jobs.FAILED
+    store.save(create)
+    assert jobs.submit(store, "create", "minecraft")[0].id == create.id
+    assert jobs.latest(store, "minecraft").id == create.id
+
+
+def test_stage_data_is_saved_for_the_next_worker(store):
+    job, _ = jobs.submit(store, "bake", "minecraft")
+
+    def droplet():
+        job.data["droplet_id"] = 42
+
+    stages = [("droplet", droplet), ("snapshot", lambda: "")]
+    job = jobs.run(store, job, stages, time_left=lambda: 0, margin=60)
+    assert job.state == jobs.QUEUED
+    assert store.load("minecraft", job.id).data == {"droplet_id": 42}
@@ -0,0 +1,58 @@
+"""
+Unit tests for SSH key generation and the ETag-checked key cache
+"""
+import paramiko
+import pytest
+
+import keys
+
+
+@pytest.mark.parametrize("key_type", keys.KEY_TYPES)
+@pytest.mark.parametrize("passphrase", [None, "hunter2"])
+def test_generated_keys_load(key_type, passphrase):
+    text = keys.generate(key_type, passphrase)
+    key = keys.load(text, passphrase)
+    assert key.get_name() == {"ed25519": "ssh-ed25519", "rsa": "ssh-rsa"}[key_type]
+    assert keys.public_key_line(key).startswith(f"{key.get_name()} AAAA")
+
+
+
+def test_ed25519_keys_sign():
+    # the OpenSSH format is written by hand, so check the key really works
+    key = keys.load(keys.generate("ed25519"))
+    signature = key.sign_ssh_data(b"data")
+    public = paramiko.Ed25519Key(data=key.asbytes())
+    assert public.verify_ssh_sig(b"data", paramiko.Message(signature.asbytes()))
+
+
+def test_encrypted_key_needs_its_passphrase():
+    text = keys.generate("ed25519", "hunter2")
+    with pytest.raises(paramiko.SSHException):
+        keys.load(text, "wrong")
+
+
+def test_unknown_key_type():
+    with pytest.raises(keys.UnknownKeyType):
+        keys.generate("dsa")
+
+
+def test_cache_downloads_only_changed_keys(tmp_path, s3_bucket):
+    bucket = s3_bucket
+    cache = keys.KeyCache(bucket, "app/app-key", str(tmp_path))
+    assert cache.fetch() is None
+
+    cache.store("first")
+    assert cache.fetch() == "first"
+    etag = bucket.stored["app/app-key"][1]
+    assert bucket.requests[-1] == ("get", "app/app-key", {"IfNoneMatch": etag})
+
+    # another process rotated the key
+    other = keys.KeyCache(bucket, "app/app-key", str(tmp_path / "elsewhere"))
+    other.store("second")
+    assert cache.fetch() == "second"
+    assert cache.fetch() == "second"
+
+    # a cold start without the local copy downloads it
+    fresh = keys.KeyCache(bucket, "app/app-key", str(tmp_path / "cold"))
+    assert fresh.fetch() == "second"
+    assert bucket.requests[-1] == ("get", "app/app-key", {})
@@ -0,0 +1,75 @@
+"""
+Unit tests for per-app leases, against a local directory and a stand-in for
+S3's conditional writes
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import leases
+
+@pytest.fixture(params=["directory", "s3"])
+def store(request, tmp_path, s3_bucket):
+    if request.param == "directory":
+        return leases.DirectoryLeaseStore(str(tmp_path / "leases"))
+    return leases.S3LeaseStore(s3_bucket, "app/leases")
+
+
+def test_one_holder_at_a_time(store):
+    lease = leases.acquire(store, "minecraft", "first", ttl=60, now=0)
+    assert lease.owner == "first"
+    assert leases.acquire(store, "minecraft", "second", ttl=60, now=10) is None
+    # other apps aren't affected
+    assert leases.acquire(store, "factorio", "second", ttl=60, now=10)
+
+    leases.release(store, lease)
+    assert leases.acquire(store, "minecraft", "second", ttl=60, now=10)
+
+
+def test_expired_lease_can_be_taken(store):
+    leases.acquire(store, "minecraft", "dead", ttl=60, now=0)
+    lease = leases.acquire(store, "minecraft", "alive", ttl=60, now=61)
+    assert lease.owner == "alive" and lease.expires_at == 121
+
+    # the old holder can neither extend nor release it any more
+    assert leases.acquire(store, "minecraft", "dead", ttl=60, now=62) is None
+    leases.release(store, leases.Lease("minecraft", "dead", 60))
+    assert store.read("minecraft")[0]["owner"] == "alive"
+
+
+def test_holder_extends_its_lease(store):
+    leases.acquire(store, "minecraft", "first", ttl=60, now=0)
+    lease = leases.acquire(store, "minecraft", "first", ttl=60, now=50)
+    assert lease.expires_at == 110
+
+
+def test_conditional_write_loses_to_a_concurrent_one(store):
+    record, version = store.read("minecraft")
+    assert store.write("minecraft", {"owner": "a"}, version)
+    assert not store.write("minecraft", {"owner": "b"}, version)
+
+    record, version = store.read("minecraft")
+    assert store.write("minecraft", {"owner": "b"}, version)
+    assert not store.delete("minecraft", version)
+
+
+def test_concurrent_acquires_have_one_winner(store):
+    with ThreadPoolExecutor(8) as pool:
+        won = list(
+            pool.map(
+                lambda owner: leases.acquire(store, "minecraft", owner, ttl=60),
+                range(8),
+            )
+        )
+    assert len([lease for lease in won if lease]) == 1
+
+
+def test_hold_gives_up_after_waiting(store):
+    leases.acquire(store, "minecraft", "first", ttl=60)
+    with pytest.raises(leases.LeaseHeld):
+        with leases.hold(store, "minecraft", "second", ttl=60, wait=0.05, first=0.01):
+            pass
+
+    with leases.hold(store, "factorio", "second", ttl=60) as lease:
+        assert store.read("factorio")[0]["owner"] == lease.owner
+    assert store.read("factorio") == (None, None)
@@ -0,0 +1,75 @@
+"""
+Unit tests for the offline lifecycle benchmark
+"""
+import json
+import os
+import subprocess
+import sys
+
+import lifecycle_benchmark
+
+
+def test_lifecycle_runs_against_the_stand_ins(tmp_path):
+    saved = tmp_path / "baseline.json"
+    # settings are read on import, so the run gets a process of its own
+    subprocess.check_call(
+        [
+            sys.executable,
+            "lifecycle_benchmark.py",
+            "--time-scale",
+            "0.002",
+            "--archive-mb",
+            "1",
+            "--save",
+            str(saved),
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        timeout=120,
+    )
+    result = json.loads(saved.read_text())
+    phases = {phase["action"]: phase for phase in result["phases"]}
+    actions = lifecycle_benchmark.ACTIONS
+    assert list(phases) == [*actions, *(f"{action} (cold)" for action in actions)]
+
+    assert phases["create"]["do_endpoints"]["POST /droplets"] == 1
+    assert phases["create"]["ssh_commands"] > 0
+    # configuring an existing droplet doesn't need DigitalOcean
+    assert phases["configure"]["do_calls"] == 0
+    # the archive goes up on backup, and comes back down on restore
+    assert phases["backup"]["droplet_s3_bytes"] >= 1 << 20
+    assert phases["restore"]["droplet_s3_bytes"] >= 1 << 20
+    assert phases["destroy"]["do_endpoints"]["DELETE /droplets/:id"] == 1
+
+    # a cold backup connects once and, finding the droplet's configuration
+    # recorded on it, only reads that before backing up
+    cold = phases["backup (cold)"]
+    assert cold["ssh_connections"] == 1
+    assert cold["ssh_commands"] == phases["backup"]["ssh_commands"] + 1
+
+
+def test_regressions_are_measured_against_the_baseline():
+    baseline = {
+        "phases": [
+            {"action": "create", "seconds": 10.0, "do_calls": 8, "s3_bytes": 0},
+            {"action": "backup", "seconds": 4.0, "do_calls": 0, "s3_bytes": 100},
+        ]
+    }
+    result = {
+        "phases": [
+            {"action": "create", "seconds": 10.5, "do_calls": 12, "s3_bytes": 0},
+            {"action": "backup", "seconds": 2.0, "do_calls": 0, "s3_bytes": 100},
+            {"action": "restore", "seconds": 3.0, "do_calls": 0, "s3_bytes": 100},
+        ]
+    }
+    for phase in baseline["phases"] + result["phases"]:
+        for metric in lifecycle_benchmark.METRICS:
+            phase.setdefault(metric, 0)
+
+    assert lifecycle_benchmark.regressions(result, baseline, 0.1) == [
+        "create DO calls: 8 -> 12"
+    ]
+    assert lifecycle_benchmark.regressions(result, baseline, 0.5) == []
+    report = lifecycle_benchmark.describe(result, baseline)
+    assert "12 (+50%) DO calls" in report
+    assert "2.00 (-50%) s" in report
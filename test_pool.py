@@ -0,0 +1,110 @@
+"""
+Unit tests for sizing and naming the warm pool
+"""
+import pytest
+
+import pool
+
+
+def test_droplets_to_add_fills_up_to_size():
+    assert pool.droplets_to_add(0, 3, 0, 0) == 3
+    assert pool.droplets_to_add(2, 3, 20, 0) == 1
+    assert pool.droplets_to_add(5, 3, 20, 100) == 0
+
+
+def test_droplets_to_add_respects_cost_limit():
+    # $100 buys four $24 droplets, one of which is already running
+    assert pool.droplets_to_add(1, 10, 24, 100) == 3
+    assert pool.droplets_to_add(4, 10, 24, 100) == 0
+    assert pool.droplets_to_add(0, 10, 200, 100) == 0
+
+
+def test_standby_names_and_tags():
+    names = pool.standby_names("app", "factoriotools/factorio:1.0", 3)
+    assert len(set(names)) == 3
+    assert all(
+        name.startswith("auto-server-standby-app-factoriotools-factorio-1-0-")
+        for name in names
+    )
+    assert pool.ready_tag("app", "factoriotools/factorio:1.0") == (
+        "auto-server-standby-app_factoriotools-factorio-1-0-ready"
+    )
+
+
+class FakeDroplet(object):
+    def __init__(self, droplet_id, tags):
+        self.id = droplet_id
+        self.status = "active"
+        self.name = f"standby-{droplet_id}"
+        self.tags = list(tags)
+        self.current_tags = self.tags
+
+    def load(self):
+        self.tags = list(self.current_tags)
+
+    def rename(self, name, return_dict):
+        return None
+
+
+class FakeManager(object):
+    def __init__(self, droplets):
+        self.droplets = droplets
+
+    def get_all_droplets(self, tag_name):
+        # a stale listing, as tags can take a moment to show
+        return list(self.droplets)
+
+
+class TaggedManager(FakeManager):
+    def get_all_droplets(self, tag_name):
+        return [droplet for droplet in self.droplets if tag_name in droplet.tags]
+
+
+@pytest.fixture
+def removed(monkeypatch):
+    """ The ``(tag, droplet IDs)`` claims untag droplets from """
+    removed = []
+
+    class FakeTag(object):
+        def __init__(self, token, name):
+            self.name = name
+
+        def remove_droplets(self, ids):
+            removed.append((self.name, ids))
+
+    monkeypatch.setattr(pool.digitalocean, "Tag", FakeTag)
+    monkeypatch.setattr(pool.waiting, "wait_for_action", lambda *args, **kwargs: None)
+    return removed
+
+
+def tags(app_name, dockerfile):
+    return [pool.pool_tag(app_name, dockerfile), pool.ready_tag(app_name, dockerfile)]
+
+
+def test_claim_skips_droplets_claimed_since_they_were_listed(removed):
+    dockerfile = "factoriotools/factorio:1.0"
+    taken = FakeDroplet(1, tags("app", dockerfile))
+    free = FakeDroplet(2, tags("app", dockerfile))
+    taken.current_tags = []
+    claimed = pool.claim(FakeManager([taken, free]), "token", "app", dockerfile)
+    assert claimed is free and claimed.name == "app"
+    assert [ids for _, ids in removed] == [[2], [2]]
+    assert pool.claim(FakeManager([taken]), "token", "app", dockerfile) is None
+
+
+def test_apps_on_the_same_image_have_their_own_pools(removed):
+    # each app's standbys only accept that app's SSH key
+    dockerfile = "itzg/minecraft-server"
+    survival, creative = tags("survival", dockerfile), tags("creative", dockerfile)
+    assert not set(survival) & set(creative)
+    assert pool.lease_name("survival", dockerfile) != pool.lease_name(
+        "creative", dockerfile
+    )
+    # an app whose name runs into the image's can't share another's tags either
+    assert pool.pool_tag("a", "b-c") != pool.pool_tag("a-b", "c")
+
+    manager = TaggedManager([FakeDroplet(1, survival)])
+    assert pool.claim(manager, "token", "creative", dockerfile) is None
+    claimed = pool.claim(manager, "token", "survival", dockerfile)
+    assert claimed.id == 1 and claimed.name == "survival"
+    assert [tag for tag, _ in removed] == survival[::-1]
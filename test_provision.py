@@ -0,0 +1,93 @@
+"""
+Unit tests for the provisioning plan executor
+"""
+import threading
+import time
+
+import pytest
+
+from provision import InvalidPlan, Step, StepFailed, fingerprints, run_plan
+
+
+def sleeper(durations, statuses=None, log=None):
+    """ Builds a ``run_step`` that sleeps for each step's duration """
+    statuses = statuses or {}
+
+    def run_step(step):
+        if log is not None:
+            log.append(step.name)
+        time.sleep(durations[step.name])
+        return statuses.get(step.name, 0)
+
+    return run_step
+
+
+def test_independent_steps_overlap():
+    steps = [Step("a", ""), Step("b", ""), Step("c", "")]
+    report = run_plan(steps, sleeper({"a": 0.2, "b": 0.2, "c": 0.2}))
+    assert report.total < 0.4
+
+
+def test_dependents_wait_for_requirements():
+    steps = [
+        Step("update", ""),
+        Step("install", "", requires=["update"]),
+        Step("pull", ""),
+        Step("run", "", requires=["install", "pull"]),
+    ]
+    report = run_plan(
+        steps, sleeper({"update": 0.1, "install": 0.1, "pull": 0.05, "run": 0.01})
+    )
+    assert report.started["install"] >= report.finished["update"]
+    assert report.started["run"] >= report.finished["install"]
+    assert report.started["run"] >= report.finished["pull"]
+    assert report.critical_path == ["update", "install", "run"]
+    assert "critical path" in report.summary()
+
+
+def test_failure_stops_new_steps():
+    log = []
+    steps = [Step("a", ""), Step("b", "", requires=["a"])]
+    with pytest.raises(StepFailed) as info:
+        run_plan(steps, sleeper({"a": 0, "b": 0}, {"a": 2}, log))
+    assert info.value.step.name == "a"
+    assert info.value.status == 2
+    assert log == ["a"]
+
+
+def test_invalid_plans():
+    with pytest.raises(InvalidPlan):
+        run_plan([Step("a", "", requires=["missing"])], sleeper({}))
+    with pytest.raises(InvalidPlan):
+        run_plan(
+            [Step("a", "", requires=["b"]), Step("b", "", requires=["a"])], sleeper({})
+        )
+
+
+def test_steps_run_on_separate_threads():
+    threads = set()
+
+    def run_step(step):
+        threads.add(threading.get_ident())
+        time.sleep(0.05)
+        return 0
+
+    run_plan([Step("a", ""), Step("b", "")], run_step)
+    assert len(threads) == 2
+
+
+def test_skipped_steps_satisfy_requirements():
+    log = []
+    steps = [Step("update", ""), Step("install", "", requires=["update"])]
+    report = run_plan(steps, sleeper({"install": 0}, log=log), skip=["update"])
+    assert log == ["install"]
+    assert report.skipped == {"update"}
+    assert report.succeeded == {"update", "install"}
+
+
+def test_fingerprints_cascade_to_dependents():
+    before = fingerprints([Step("a", "x"), Step("b", "y", requires=["a"])])
+    after = fingerprints([Step("a", "z"), Step("b", "y", requires=["a"])])
+    assert before["a"] != after["a"]
+    assert before["b"] != after["b"]
+    assert fingerprints([Step("a", "x")])["a"] == before["a"]
@@ -0,0 +1,99 @@
+"""
+Unit tests for the RCON client, against an in-process fake server
+"""
+import socket
+import struct
+import threading
+
+import pytest
+
+from rcon import AUTH, AUTH_RESPONSE, AuthenticationFailed, Rcon, main
+
+
+def fake_server(password, replies):
+    """ Accepts one RCON connection, answering commands from ``replies`` """
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    received = []
+
+    def send(conn, request_id, kind, body):
+        payload = struct.pack("<ii", request_id, kind) + body.encode() + b"\0\0"
+        conn.sendall(struct.pack("<i", len(payload)) + payload)
+
+    def serve():
+        conn, _ = listener.accept()
+        with conn:
+            while True:
+                header = conn.recv(4)
+                if not header:
+                    return
+                (size,) = struct.unpack("<i", header)
+                packet = b""
+                while len(packet) < size:
+                    packet += conn.recv(size - len(packet))
+                request_id, kind = struct.unpack("<ii", packet[:8])
+                body = packet[8:-2].decode()
+                if kind == AUTH:
+                    # real servers send an empty response value first
+                    send(conn, request_id, 0, "")
+                    accepted = request_id if body == password else -1
+                    send(conn, accepted, AUTH_RESPONSE, "")
+                else:
+                    received.append(body)
+                    send(conn, request_id, 0, replies.get(body, ""))
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1], received
+
+
+def test_commands_round_trip():
+    port, received = fake_server("secret", {"/server-save": "Saving map..."})
+    with Rcon("127.0.0.1", port, "secret") as rcon:
+        assert rcon.command("/server-save") == "Saving map..."
+    assert received == ["/server-save"]
+
+
+def test_wrong_password():
+    port, _ = fake_server("secret", {})
+    with pytest.raises(AuthenticationFailed):
+        with Rcon("127.0.0.1", port, "guess"):
+            pass
+
+
+def test_password_from_server_properties(tmp_path, capsys):
+    port, received = fake_server("hunter2", {"save-off": "Saving disabled"})
+    properties = tmp_path / "server.properties"
+    properties.write_text(
+        f"enable-rcon=true\nrcon.port={port}\nrcon.password=hunter2\n"
+    )
+
+    main(["--properties", str(properties), "save-off", "save-all flush"])
+
+    assert received == ["save-off", "save-all flush"]
+    assert "Saving disabled" in capsys.readouterr().out
+
+
+def test_ignore_unreachable():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    with pytest.raises(ConnectionRefusedError):
+        main(["--port", str(port), "save-on"])
+    main(["--port", str(port), "--ignore-unreachable", "save-on"])
+
+
+def test_ignore_unreachable_covers_servers_that_never_answer():
+    # accepts connections but never replies, like a server still starting
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    port = listener.getsockname()[1]
+    try:
+        with pytest.raises(socket.timeout):
+            main(["--port", str(port), "--timeout", "0.2", "save-on"])
+        main(["--port", str(port), "--timeout", "0.2", "--ignore-unreachable", "x"])
+    finally:
+        listener.close()
+
@@ -0,0 +1,92 @@
+"""
+Unit tests for game readiness probes, against tiny local servers
+"""
+import json
+import socket
+import struct
+import threading
+
+import pytest
+
+import readiness
+from games import Game
+
+
+def serve_once(handler):
+    """ Accepts one connection on a free port and hands it to ``handler`` """
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def run():
+        connection, _ = server.accept()
+        with connection:
+            handler(connection)
+        server.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def minecraft_status(connection):
+    # the handshake and status request, then the status response
+    for _ in range(2):
+        length = readiness._read_varint(connection)
+        readiness._recv_exactly(connection, length)
+    status = json.dumps({"players": {"online": 0, "max": 20}}).encode()
+    payload = readiness._varint(len(status)) + status
+    connection.sendall(readiness._packet(0, payload))
+
+
+def rcon_rejection(connection):
+    (size,) = struct.unpack("<i", readiness._recv_exactly(connection, 4))
+    readiness._recv_exactly(connection, size)
+    reply = struct.pack("<ii", -1, 2) + b"\0\0"
+    connection.sendall(struct.pack("<i", len(reply)) + reply)
+
+
+def test_varints_round_trip():
+    assert readiness._varint(300) == b"\xac\x02"
+    assert readiness._varint(-1) == b"\xff\xff\xff\xff\x0f"
+
+
+def test_server_list_ping():
+    port = serve_once(minecraft_status)
+    assert readiness.server_list_ping("127.0.0.1", port)["players"]["max"] == 20
+
+
+def test_rcon_rejection_still_means_ready():
+    port = serve_once(rcon_rejection)
+    assert readiness.rcon_answers("127.0.0.1", port)
+
+
+def test_accepting_without_answering_is_not_ready():
+    # what docker's proxy does before the game listens
+    port = serve_once(lambda connection: None)
+    game = Game("factorio", 0, [], [], ready_probe="rcon", ready_port=port)
+    assert not readiness.probe(game, "127.0.0.1")
+
+
+def test_wait_until_ready_times_out():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    port = server.getsockname()[1]
+    server.close()
+    game = Game("minecraft", 0, [], [], ready_probe="server_list_ping", ready_port=port)
+    with pytest.raises(readiness.waiting.WaitTimedOut):
+        readiness.wait_until_ready(game, "127.0.0.1", timeout=0.2, first=0.05)
+
+
+def test_phases_add_up():
+    now = [0.0]
+    phases = readiness.Phases(clock=lambda: now[0])
+    with phases.phase("ssh"):
+        now[0] += 2
+    phases.add("configure", 3)
+    phases.add("configure", 1)
+    assert phases.durations == {"ssh": 2, "configure": 4}
+    assert phases.summary().splitlines() == [
+        "Time to playable: 2.0s",
+        "  ssh: 2.0s",
+        "  configure: 4.0s",
+    ]
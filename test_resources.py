@@ -0,0 +1,113 @@
+"""
+Unit tests for the resource index, against a fake S3 bucket
+"""
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from resources import IndexConflict, ResourceIndex
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    ResourceIndex.clear_process_cache()
+    yield
+    ResourceIndex.clear_process_cache()
+
+
+def test_missing_index_is_empty(s3_bucket):
+    assert ResourceIndex(s3_bucket, "app/resources.json").get("droplet_id") is None
+
+
+def test_an_unreadable_index_is_not_taken_for_an_empty_one(s3_bucket):
+    s3_bucket.Object("app/resources.json").put(Body=b'{"droplet_id": 42}')
+    s3_bucket.errors["app/resources.json"] = "AccessDenied"
+    index = ResourceIndex(s3_bucket, "app/resources.json")
+    with pytest.raises(ClientError):
+        index.update(ssh_key_id=7)
+    assert s3_bucket.count("put", "app/resources.json") == 1
+
+
+def test_entries_persist_and_are_loaded_once(s3_bucket):
+    bucket = s3_bucket
+    index = ResourceIndex(bucket, "app/resources.json")
+    index.update(droplet_id=42, ip_address="10.0.0.1")
+    assert json.loads(bucket.body("app/resources.json")) == {
+        "droplet_id": 42,
+        "ip_address": "10.0.0.1",
+    }
+
+    # a warm lambda's next controller reuses the process copy
+    again = ResourceIndex(bucket, "app/resources.json")
+    assert again.get("droplet_id") == 42
+    assert bucket.count("get", "app/resources.json") == 1
+
+    # a cold one reads it back from S3
+    ResourceIndex.clear_process_cache()
+    assert ResourceIndex(bucket, "app/resources.json").get("ip_address") == "10.0.0.1"
+
+
+def test_unchanged_updates_are_not_written(s3_bucket):
+    bucket = s3_bucket
+    index = ResourceIndex(bucket, "app/resources.json")
+    index.update(droplet_id=42)
+    index.update(droplet_id=42)
+    index.forget("ssh_key_id")
+    assert bucket.count("put", "app/resources.json") == 1
+
+    index.forget("droplet_id")
+    assert index.get("droplet_id") is None
+    assert json.loads(bucket.body("app/resources.json")) == {}
+
+
+def test_writes_from_other_processes_are_not_lost(s3_bucket):
+    bucket = s3_bucket
+    ResourceIndex(bucket, "app/resources.json").update(droplet_id=42)
+
+    # another invocation, with its own process cache, saves the SSH key
+    cached = dict(ResourceIndex._loaded)
+    ResourceIndex.clear_process_cache()
+    ResourceIndex(bucket, "app/resources.json").update(ssh_key_id=7)
+    ResourceIndex._loaded.update(cached)
+
+    # this one's copy is out of date, so its write is made again on top
+    index = ResourceIndex(bucket, "app/resources.json")
+    index.update(ip_address="10.0.0.1")
+    assert json.loads(bucket.body("app/resources.json")) == {
+        "droplet_id": 42,
+        "ssh_key_id": 7,
+        "ip_address": "10.0.0.1",
+    }
+    assert index.get("ssh_key_id") == 7
+
+    index.forget("droplet_id")
+    ResourceIndex.clear_process_cache()
+    assert ResourceIndex(bucket, "app/resources.json").entries == {
+        "ssh_key_id": 7,
+        "ip_address": "10.0.0.1",
+    }
+
+
+def test_a_write_that_keeps_losing_gives_up(s3_bucket):
+    index = ResourceIndex(s3_bucket, "app/resources.json")
+    index.update(droplet_id=42)
+    Object = s3_bucket.Object
+
+    def racing(key):
+        # someone else writes the index whenever it's read
+        stored = Object(key)
+        get = stored.get
+
+        def get_then_change(**conditions):
+            response = get(**conditions)
+            Object(key).put(Body=b"{}")
+            return response
+
+        stored.get = get_then_change
+        return stored
+
+    Object(index.key).put(Body=b"{}")
+    s3_bucket.Object = racing
+    with pytest.raises(IndexConflict):
+        index.update(droplet_id=43)
@@ -0,0 +1,110 @@
+"""
+Unit tests for droplet right-sizing, against fake sizes and a fake S3 bucket
+"""
+import json
+
+import pytest
+
+import sizing
+
+
+class Size(object):
+    def __init__(self, slug, vcpus, memory, disk, price_monthly, regions=("nyc1",)):
+        self.slug = slug
+        self.vcpus = vcpus
+        self.memory = memory
+        self.disk = disk
+        self.transfer = 4.0
+        self.price_monthly = price_monthly
+        self.regions = list(regions)
+
+
+SIZES = [
+    Size("s-1vcpu-2gb", 1, 2048, 50, 12.0),
+    Size("s-2vcpu-2gb", 2, 2048, 60, 18.0),
+    Size("s-2vcpu-4gb", 2, 4096, 80, 24.0),
+    Size("s-4vcpu-8gb", 4, 8192, 160, 48.0),
+    Size("c-2", 2, 4096, 25, 42.0),
+    Size("s-8vcpu-16gb", 8, 16384, 320, 96.0, regions=("sfo3",)),
+]
+
+
+def series(cpu, memory, start=0, net_tx=0):
+    return {
+        "start": start,
+        "cpu": list(cpu),
+        "memory": list(memory),
+        "disk_read": [0] * len(cpu),
+        "disk_write": [0] * len(cpu),
+        "net_rx": [0] * len(cpu),
+        "net_tx": [net_tx] * len(cpu),
+    }
+
+
+def recommend(windows, current="s-2vcpu-4gb", **options):
+    options.setdefault("min_samples", 1)
+    return sizing.recommend(windows, SIZES, current, "nyc1", **options)
+
+
+def test_a_quiet_server_is_sized_down():
+    # a light vanilla server: under a core, a gigabyte of memory
+    quiet = series([0.3] * 19 + [1.5], [900] * 20)
+    recommendation = recommend([quiet], current="s-4vcpu-8gb")
+    # the one-off spike is above the 95th percentile, so one vCPU will do
+    assert recommendation.needed["vcpus"] == 1
+    assert recommendation.needed["memory_mb"] == 900 * 1.25 + 512
+    assert recommendation.size.slug == "s-1vcpu-2gb"
+    assert recommendation.changed
+    assert (
+        'Suggest "s-1vcpu-2gb" ($12.0/month) instead of "s-4vcpu-8gb" ($48.0/month)'
+        in recommendation.describe()
+    )
+
+
+def test_a_busy_modpack_is_sized_up_for_its_peak_memory():
+    busy = series([1.8] * 20, [3000] * 19 + [5000])
+    recommendation = recommend([busy])
+    assert recommendation.size.slug == "s-4vcpu-8gb"
+
+
+def test_the_current_size_is_kept_when_it_fits_best():
+    recommendation = recommend([series([1.2] * 20, [2500] * 20)])
+    assert recommendation.size.slug == "s-2vcpu-4gb"
+    assert not recommendation.changed
+    assert "already fits" in recommendation.describe()
+
+
+def test_sizes_in_other_regions_are_ruled_out():
+    heavy = series([5.0] * 20, [1000] * 20)
+    with pytest.raises(sizing.NoSuitableSize, match="7 vCPU"):
+        recommend([heavy])
+
+
+def test_transfer_is_sized_for_the_month():
+    # 2 MB/s out is over 5 TB a month
+    chatty = series([0.5] * 20, [500] * 20, net_tx=2048)
+    with pytest.raises(sizing.NoSuitableSize):
+        recommend([chatty])
+
+
+def test_too_few_samples_are_not_enough():
+    with pytest.raises(sizing.NotEnoughTelemetry):
+        recommend([])
+    with pytest.raises(sizing.NotEnoughTelemetry, match="Only 3 samples"):
+        recommend([series([1.0] * 3, [100] * 3)], min_samples=30)
+
+
+def test_the_store_keeps_the_newest_series(s3_bucket):
+    s3_bucket.Object("app/telemetry-other.json").put(Body=b"{}")
+    store = sizing.TelemetryStore(s3_bucket, "app/telemetry/", retention=2)
+    # an hour apart, saved out of order
+    for start in (7200, 0, 3600, 10800):
+        store.save(series([start / 3600], [1], start=start))
+
+    assert store.keys() == [
+        "app/telemetry/19700101T020000Z.json",
+        "app/telemetry/19700101T030000Z.json",
+    ]
+    assert [window["cpu"] for window in store.recent()] == [[2.0], [3.0]]
+    assert [window["cpu"] for window in store.recent(1)] == [[3.0]]
+    assert json.loads(s3_bucket.body("app/telemetry-other.json")) == {}
@@ -0,0 +1,232 @@
+"""
+Unit tests for SSH readiness and host key pinning, against a local listener
+and a fake paramiko client
+"""
+import socket
+
+import paramiko
+import pytest
+
+import ssh
+
+
+@pytest.fixture
+def listener():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+    yield server
+    server.close()
+
+
+class FakeClient(object):
+    """ Stands in for ``paramiko.SSHClient``, failing the first handshakes """
+
+    failures = []
+
+    def __init__(self):
+        self.host_keys = paramiko.HostKeys()
+        self.policy = None
+        self.attempts = 0
+        self.server_key = paramiko.RSAKey.generate(1024)
+
+    def get_host_keys(self):
+        return self.host_keys
+
+    def set_missing_host_key_policy(self, policy):
+        self.policy = policy
+
+    def connect(self, host, **kwargs):
+        self.attempts += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        if self.host_keys.lookup(host) is None:
+            self.policy.missing_host_key(self, host, self.server_key)
+
+    def close(self):
+        pass
+
+
+def test_port_open(listener):
+    port = listener.getsockname()[1]
+    assert ssh.port_open("127.0.0.1", port)
+    listener.close()
+    assert not ssh.port_open("127.0.0.1", port)
+
+
+def test_wait_for_port_gives_up(listener):
+    port = listener.getsockname()[1]
+    listener.close()
+    with pytest.raises(ssh.SSHUnavailable):
+        ssh.wait_for_port("127.0.0.1", port, timeout=0.3)
+
+
+def test_host_key_lines_round_trip():
+    key = paramiko.RSAKey.generate(1024)
+    line = ssh.host_key_line(key)
+    assert line.startswith("ssh-rsa ")
+    assert ssh.parse_host_key(line) == key
+
+
+def test_connect_retries_handshakes_and_pins_key(monkeypatch):
+    monkeypatch.setattr(ssh, "port_open", lambda host, port: True)
+    FakeClient.failures = [
+        paramiko.AuthenticationException(),
+        paramiko.SSHException("Error reading SSH banner"),
+    ]
+
+    client, host_key, seconds = ssh.connect(
+        "10.0.0.1", pkey=None, client_class=FakeClient
+    )
+    assert client.attempts == 3
+    assert host_key == ssh.host_key_line(client.server_key)
+    assert seconds >= 0
+
+
+def test_connect_with_pinned_key_rejects_others(monkeypatch):
+    monkeypatch.setattr(ssh, "port_open", lambda host, port: True)
+    pinned = ssh.host_key_line(paramiko.RSAKey.generate(1024))
+    other = paramiko.RSAKey.generate(1024)
+    FakeClient.failures = [paramiko.BadHostKeyException("10.0.0.1", other, other)]
+
+    with pytest.raises(paramiko.BadHostKeyException):
+        ssh.connect("10.0.0.1", pkey=None, host_key=pinned, client_class=FakeClient)
+
+
+class FakeTransport(object):
+    def __init__(self, active=True, answers=True):
+        self.active = active
+        self.answers = answers
+        self.keepalive = None
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self, interval):
+        self.keepalive = interval
+
+    def open_session(self, timeout=None):
+        if not self.answers:
+            raise paramiko.SSHException("Timeout opening channel.")
+        return socket.socket()
+
+
+class ConnectedClient(FakeClient):
+    transport = None
+
+    def get_transport(self):
+        return self.transport
+
+
+def test_alive_checks_with_a_round_trip():
+    client = ConnectedClient()
+    assert not ssh.alive(client)
+    client.transport = FakeTransport(active=False)
+    assert not ssh.alive(client)
+    # a droplet that vanished leaves the transport looking active
+    client.transport = FakeTransport(answers=False)
+    assert not ssh.alive(client)
+    client.transport = FakeTransport()
+    assert ssh.alive(client)
+
+
+def test_connect_turns_on_keepalives(monkeypatch):
+    monkeypatch.setattr(ssh, "port_open", lambda host, port: True)
+    ConnectedClient.failures = []
+    ConnectedClient.transport = FakeTransport()
+    client, _, _ = ssh.connect(
+        "10.0.0.1", pkey=None, keepalive=30, client_class=ConnectedClient
+    )
+    assert client.transport.keepalive == 30
+
+
+class FakeChannel(object):
+    """ Replays output that arrives in chunks, as a paramiko channel would """
+
+    def __init__(self, chunks, exit_code=0, finishes=True):
+        # (stream, bytes) pairs, delivered one per wait
+        self.chunks = list(chunks)
+        self.exit_code = exit_code
+        self.finishes = finishes
+        self.buffers = {"stdout": b"", "stderr": b""}
+        self.closed = False
+        self.waits = 0
+
+    def arrive(self, channel=None, seconds=None):
+        self.waits += 1
+        if self.chunks:
+            stream, data = self.chunks.pop(0)
+            self.buffers[stream] += data
+
+    def _recv(self, stream, size):
+        data, self.buffers[stream] = (
+            self.buffers[stream][:size],
+            self.buffers[stream][size:],
+        )
+        return data
+
+    def recv_ready(self):
+        return bool(self.buffers["stdout"])
+
+    def recv_stderr_ready(self):
+        return bool(self.buffers["stderr"])
+
+    def recv(self, size):
+        return self._recv("stdout", size)
+
+    def recv_stderr(self, size):
+        return self._recv("stderr", size)
+
+    def exit_status_ready(self):
+        return self.finishes and not self.chunks
+
+    def recv_exit_status(self):
+        return self.exit_code
+
+    def close(self):
+        self.closed = True
+
+
+def test_collect_interleaves_streams_and_keeps_a_tail():
+    channel = FakeChannel(
+        [
+            ("stdout", b"one\ntw"),
+            ("stderr", b"warning\n"),
+            ("stdout", b"o\nthree\n"),
+            ("stderr", b"no newline"),
+        ],
+        exit_code=3,
+    )
+    seen = []
+    result = ssh.collect(
+        channel,
+        on_line=lambda stream, line: seen.append((stream, line)),
+        tail=2,
+        wait=channel.arrive,
+    )
+    assert seen == [
+        ("stdout", "one"),
+        ("stderr", "warning"),
+        ("stdout", "two"),
+        ("stdout", "three"),
+        ("stderr", "no newline"),
+    ]
+    assert result.exit_code == 3
+    assert result.tail == ["three", "no newline"]
+    assert result.output == "[3 earlier lines not kept]\nthree\nno newline"
+
+
+def test_collect_times_out_with_the_tail_so_far():
+    channel = FakeChannel([("stdout", b"started\n")], finishes=False)
+    clock = iter(range(100)).__next__
+    with pytest.raises(ssh.CommandTimedOut) as raised:
+        ssh.collect(channel, timeout=5, wait=channel.arrive, clock=clock)
+    assert channel.closed
+    assert raised.value.result.exit_code is None
+    assert raised.value.result.tail == ["started"]
+
+
+def test_overlong_lines_are_not_held_back():
+    channel = FakeChannel([("stdout", b"x" * (ssh.MAX_LINE + 10))])
+    result = ssh.collect(channel, wait=channel.arrive)
+    assert [len(line) for line in result.tail] == [ssh.MAX_LINE + 10]
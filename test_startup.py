@@ -0,0 +1,48 @@
+"""
+Unit tests for keeping cold starts cheap
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import lazy
+from startup_benchmark import HEAVY_MODULES, offline_environment, sample
+
+
+def test_importing_the_lambda_defers_heavy_modules(tmp_path):
+    script = (
+        "import json, sys, lambda_function\n"
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    output = subprocess.check_output(
+        [sys.executable, "-c", script],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=offline_environment(str(tmp_path)),
+    )
+    assert json.loads(output) == []
+
+
+def test_status_needs_no_heavy_modules(tmp_path):
+    event = {"action": "status", "app_name": "benchmark", "body": ""}
+    result = sample(event, offline_environment(str(tmp_path)))
+    assert result["loaded"] == []
+    assert result["import"] > 0
+
+
+def test_lazy_module_imports_once_on_first_use():
+    loads = []
+    proxy = lazy.module("json", on_load=loads.append)
+    assert "not loaded" in repr(proxy)
+    assert not loads
+
+    threads = [threading.Thread(target=lambda: proxy.dumps([1])) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loads == [json]
+    assert proxy.loads("[2]") == [2]
+    assert "loaded" in repr(proxy) and "not" not in repr(proxy)
@@ -0,0 +1,137 @@
+"""
+Unit tests for the droplet-side telemetry sampler, against canned Docker stats
+and a stand-in Docker Engine on a unix socket
+"""
+import json
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import telemetry
+
+MB = 1024 * 1024
+
+
+def stats(cpu, system, memory, read=0, write=0, rx=0, tx=0, cgroup_v2=False):
+    """ A Docker stats reading, trimmed to the fields the sampler uses """
+    cache = "inactive_file" if cgroup_v2 else "total_inactive_file"
+    op = str.lower if cgroup_v2 else str
+    return {
+        "cpu_stats": {
+            "cpu_usage": {"total_usage": cpu},
+            "system_cpu_usage": system,
+            "online_cpus": 4,
+        },
+        "memory_stats": {
+            "usage": memory + 10 * MB,
+            "limit": 8192 * MB,
+            "stats": {cache: 10 * MB},
+        },
+        "blkio_stats": {
+            "io_service_bytes_recursive": [
+                {"op": op("Read"), "value": read},
+                {"op": op("Write"), "value": write},
+                {"op": op("Total"), "value": read + write},
+            ]
+        },
+        "networks": {
+            "eth0": {"rx_bytes": rx, "tx_bytes": tx},
+            "eth1": {"rx_bytes": rx, "tx_bytes": 0},
+        },
+    }
+
+
+@pytest.mark.parametrize("cgroup_v2", [False, True])
+def test_counters_leave_out_reclaimable_cache(cgroup_v2):
+    counters = telemetry.counters(stats(5, 10, 512 * MB, 100, 200, 30, 40, cgroup_v2))
+    assert counters == {
+        "cpu": 5,
+        "system_cpu": 10,
+        "cpus": 4,
+        "memory": 512 * MB,
+        "memory_limit": 8192 * MB,
+        "disk_read": 100,
+        "disk_write": 200,
+        "net_rx": 60,
+        "net_tx": 40,
+    }
+
+
+def test_sample_measures_rates_on_a_fixed_schedule():
+    # half of one of 4 cores, then two full cores, then the container restarts
+    readings = [
+        stats(0, 0, 100 * MB),
+        stats(5 * 10 ** 9, 40 * 10 ** 9, 200 * MB, read=10240, tx=20480),
+        stats(25 * 10 ** 9, 80 * 10 ** 9, 300 * MB, read=20480, tx=40960),
+        stats(10 ** 9, 120 * 10 ** 9, 50 * MB, read=10240, tx=10240),
+    ]
+    now = [0.0]
+    sleeps = []
+
+    def reading(container):
+        assert container == "app"
+        now[0] += 0.5
+        return readings.pop(0)
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    series = telemetry.sample(
+        "app", 30, 10, stats=reading, clock=lambda: now[0], sleep=sleep
+    )
+    assert sleeps == [10.0, 9.5, 9.5]
+    assert series["cpu"] == [0.5, 2.0, 0.1]
+    assert series["memory"] == [200, 300, 50]
+    assert series["disk_read"] == [1, 1, 1]
+    assert series["net_tx"] == [2, 2, 1]
+    assert (series["cpus"], series["memory_limit_mb"]) == (4, 8192)
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if self.path.startswith("/containers/app/stats"):
+            status, body = 200, json.dumps(stats(1, 2, 64 * MB))
+        else:
+            status, body = 404, '{"message": "No such container"}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def address_string(self):
+        return "docker.sock"
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def docker_socket(tmp_path):
+    path = str(tmp_path / "docker.sock")
+    server = socketserver.UnixStreamServer(path, FakeDockerHandler)
+    server.paths = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path, server
+    server.shutdown()
+    server.server_close()
+
+
+def test_stats_are_read_from_the_engine_socket(docker_socket, capsys):
+    path, server = docker_socket
+    assert telemetry.container_stats("app", path)["cpu_stats"]["online_cpus"] == 4
+    assert server.paths == ["/containers/app/stats?stream=false&one-shot=true"]
+    with pytest.raises(telemetry.DockerError, match="No such container"):
+        telemetry.container_stats("gone", path)
+
+    telemetry.main(
+        ["sample", "app", "--seconds", "0.1", "--interval", "0.1", "--socket", path]
+    )
+    series = json.loads(capsys.readouterr().out)
+    assert series["container"] == "app"
+    assert series["memory"] == [64]
@@ -0,0 +1,177 @@
+"""
+Unit tests for tracing, with a fake clock and collected output
+"""
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pytest
+from botocore.config import Config
+
+import doclient
+import fakes
+import tracing
+
+
+class FakeResponse(object):
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_spans_are_nested_and_totalled_by_name():
+    lines = []
+    with tracing.trace("backup", emit=lines.append, app_name="app") as trace:
+        trace.clock = clock = Clock()
+        with tracing.span("ssh.exec", command="tar -cf -") as outer:
+            clock.now += 2.0
+            with tracing.span("s3", bytes=100):
+                clock.now += 1.0
+            outer.set(exit_status=0)
+        with tracing.span("s3", bytes=50, attempt=2):
+            clock.now += 0.5
+        with pytest.raises(RuntimeError):
+            with tracing.span("ssh.exec", command="false"):
+                raise RuntimeError("lost")
+
+    spans = [json.loads(line) for line in lines[:-1]]
+    inner, outer = spans[0], spans[1]
+    assert inner["parent_id"] == outer["span_id"]
+    assert outer["parent_id"] is None
+    assert (outer["seconds"], outer["exit_status"]) == (3.0, 0)
+    assert spans[-1]["error"] == "RuntimeError: lost"
+
+    summary = trace.summary()
+    assert list(summary["spans"]) == ["ssh.exec", "s3"]
+    assert summary["spans"]["ssh.exec"] == {
+        "count": 2,
+        "seconds": 3.0,
+        "longest": 3.0,
+        "errors": 1,
+    }
+    assert summary["spans"]["s3"]["bytes"] == 150
+    assert summary["spans"]["s3"]["retries"] == 1
+    assert json.loads(lines[-1]) == {"trace": summary, "app_name": "app"}
+
+
+def test_unsampled_and_quick_spans_are_only_totalled():
+    lines = []
+    with tracing.trace("status", sample_rate=0.0, emit=lines.append) as trace:
+        with tracing.span("digitalocean"):
+            pass
+    assert lines == []
+    assert trace.summary()["spans"]["digitalocean"]["count"] == 1
+
+    with tracing.trace("status", min_ms=100, emit=lines.append) as trace:
+        trace.clock = clock = Clock()
+        with tracing.span("quick"):
+            pass
+        with tracing.span("slow"):
+            clock.now += 0.2
+    assert [json.loads(line).get("name") for line in lines] == ["slow", None]
+    assert set(trace.summary()["spans"]) == {"quick", "slow"}
+
+
+def test_spans_outside_a_trace_record_nothing():
+    with tracing.trace("status", enabled=False) as trace:
+        assert trace is None
+        with tracing.span("ssh.exec") as span:
+            span.set(exit_status=0)
+            tracing.annotate(reconnected=True)
+    assert span is tracing.NO_SPAN
+    assert tracing.start_span("s3") is tracing.NO_SPAN
+
+
+def test_spans_on_worker_threads_join_the_trace():
+    lines = []
+    with tracing.trace("destroy", emit=lines.append) as trace:
+        with tracing.span("fleet") as parent:
+
+            def work(number):
+                with tracing.span("app", number=number):
+                    return number
+
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                assert list(executor.map(tracing.in_context(work), range(8))) == list(
+                    range(8)
+                )
+    assert trace.summary()["spans"]["app"]["count"] == 8
+    apps = [json.loads(line) for line in lines if '"name": "app"' in line]
+    assert {span["parent_id"] for span in apps} == {parent.id}
+
+
+def test_long_attributes_are_cut_short():
+    with tracing.trace("exec", emit=lambda line: None) as trace:
+        span = tracing.start_span("ssh.exec", command="x" * 1000)
+    assert len(span.attributes["command"]) == tracing.MAX_ATTRIBUTE_LENGTH + 3
+    assert "ssh.exec" not in trace.summary()["spans"]
+
+
+def test_digitalocean_attempts_are_spans():
+    client = doclient.Client(burst=100, max_retries=3, sleep=lambda seconds: None)
+    url = "https://api.digitalocean.com/v2/droplets"
+    responses = [FakeResponse(503), FakeResponse(200)]
+    lines = []
+    with tracing.trace("create", emit=lines.append) as trace:
+        client.request(lambda *args: responses.pop(0), "GET", url, {})
+
+    attempts = [json.loads(line) for line in lines[:-1]]
+    assert [(span["attempt"], span["status"]) for span in attempts] == [
+        (1, 503),
+        (2, 200),
+    ]
+    assert attempts[0]["error"] == "HTTP 503"
+    assert attempts[0]["endpoint"] == "GET droplets"
+    stats = trace.summary()["spans"]["digitalocean"]
+    assert (stats["count"], stats["errors"], stats["retries"]) == (2, 1, 1)
+
+
+def test_commands_are_only_recorded_as_digests():
+    command = "aws configure set aws_secret_access_key hunter2"
+    assert tracing.digest(command) == tracing.digest(command)
+    assert tracing.digest(command) != tracing.digest(command + " ")
+    assert "hunter2" not in tracing.digest(command)
+    assert len(tracing.digest("x" * 1000)) == 12
+
+
+
+def test_s3_calls_record_their_key_and_bytes():
+    s3 = fakes.FakeS3().start()
+    try:
+        client = boto3.client(
+            "s3",
+            endpoint_url=s3.url,
+            region_name="us-east-1",
+            aws_access_key_id="key",
+            aws_secret_access_key="secret",
+            config=Config(s3={"addressing_style": "path"}),
+        )
+        tracing.instrument_boto3(client)
+        lines = []
+        with tracing.trace("backup", emit=lines.append):
+            client.put_object(Bucket="bucket", Key="app/state.json", Body=b"hello!")
+            client.put_object(
+                Bucket="bucket", Key="app/world.tar", Body=io.BytesIO(b"world")
+            )
+            client.get_object(Bucket="bucket", Key="app/world.tar")["Body"].read()
+            client.head_object(Bucket="bucket", Key="app/world.tar")
+    finally:
+        s3.stop()
+
+    spans = [json.loads(line) for line in lines[:-1]]
+    assert [(span["operation"], span["key"], span["bytes"]) for span in spans] == [
+        ("PutObject", "app/state.json", 6),
+        ("PutObject", "app/world.tar", 5),
+        ("GetObject", "app/world.tar", 5),
+        # nothing comes back from a HEAD, whatever the object's size
+        ("HeadObject", "app/world.tar", None),
+    ]
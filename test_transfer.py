@@ -0,0 +1,49 @@
+"""
+Unit tests for the droplet-side transfer helpers
+"""
+import io
+import os
+import tarfile
+
+from transfer import archive_digest, ranged_get
+
+
+def make_tar(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_ranged_get_reassembles_in_order(range_server):
+    served, url = range_server
+    data = os.urandom(100001)
+    (served / "object").write_bytes(data)
+    out = io.BytesIO()
+
+    size = ranged_get(f"{url}/object", out, part_size=1000, workers=4)
+
+    assert size == len(data)
+    assert out.getvalue() == data
+
+
+def test_ranged_get_of_empty_object(range_server):
+    served, url = range_server
+    (served / "empty").write_bytes(b"")
+    out = io.BytesIO()
+    assert ranged_get(f"{url}/empty", out) == 0
+    assert out.getvalue() == b""
+
+
+def test_archive_digest_passes_stream_through():
+    archive = make_tar({"a": b"one", "b/c": b"two"})
+    out = io.BytesIO()
+
+    digest = archive_digest(io.BytesIO(archive), out)
+
+    assert out.getvalue() == archive
+    assert digest == archive_digest(io.BytesIO(make_tar({"a": b"one", "b/c": b"two"})))
+    assert digest != archive_digest(io.BytesIO(make_tar({"a": b"one", "b/c": b"2"})))
@@ -0,0 +1,101 @@
+"""
+Unit tests for volume persistence, against a fake volumes API
+"""
+import subprocess
+
+import pytest
+
+import volumes
+
+
+class FakeVolume(object):
+    """ Stands in for ``digitalocean.Volume``, tracking calls on ``api`` """
+
+    def __init__(self, api=None, **kwargs):
+        self.api = api
+        self.id = None
+        self.droplet_ids = []
+        self.__dict__.update(kwargs)
+
+    def create(self):
+        self.id = f"vol-{len(self.api.volumes) + 1}"
+        self.api.volumes.append(self)
+
+    def attach(self, droplet_id, region):
+        self.api.calls.append(("attach", self.id, droplet_id, region))
+        self.api.pending[self.id] = droplet_id
+
+    def load(self):
+        if self.id in self.api.pending:
+            self.droplet_ids = [self.api.pending.pop(self.id)]
+
+
+class FakeApi(object):
+    """ Stands in for ``digitalocean.Manager`` """
+
+    def __init__(self):
+        self.volumes = []
+        self.calls = []
+        self.pending = {}
+
+    def get_all_volumes(self, region=None):
+        return [v for v in self.volumes if region in (None, v.region)]
+
+    def volume_class(self, **kwargs):
+        return FakeVolume(api=self, **kwargs)
+
+
+def test_ensure_volume_creates_once():
+    api = FakeApi()
+    first = volumes.ensure_volume(api, "t", "f-data", "nyc1", 10, api.volume_class)
+    again = volumes.ensure_volume(api, "t", "f-data", "nyc1", 10, api.volume_class)
+
+    assert first is again
+    assert len(api.volumes) == 1
+    assert first.filesystem_type == "ext4"
+    assert first.size_gigabytes == 10
+
+
+def test_volumes_are_per_region():
+    api = FakeApi()
+    volumes.ensure_volume(api, "t", "factorio-data", "nyc1", 10, api.volume_class)
+    volumes.ensure_volume(api, "t", "factorio-data", "ams3", 10, api.volume_class)
+    assert len(api.volumes) == 2
+
+
+def test_duplicate_volumes():
+    api = FakeApi()
+    api.volumes = [FakeVolume(name="x", region="nyc1") for _ in range(2)]
+    with pytest.raises(volumes.MultipleVolumesFound):
+        volumes.find_volume(api, "x", "nyc1")
+
+
+def test_attach_waits_and_skips_when_attached():
+    api = FakeApi()
+    volume = volumes.ensure_volume(api, "t", "f-data", "nyc1", 10, api.volume_class)
+
+    volumes.attach(volume, 42, "nyc1")
+    volumes.attach(volume, 42, "nyc1")
+
+    assert volume.droplet_ids == [42]
+    assert api.calls == [("attach", volume.id, 42, "nyc1")]
+
+
+def test_if_empty_command(tmp_path):
+    marker = tmp_path / "ran"
+    command = volumes.if_empty_command(str(tmp_path), f"touch {marker}")
+    (tmp_path / "lost+found").mkdir()
+
+    subprocess.run(command, shell=True, check=True)
+    assert marker.exists()
+
+    marker.unlink()
+    (tmp_path / "saves").mkdir()
+    subprocess.run(command, shell=True, check=True)
+    assert not marker.exists()
+
+
+def test_mount_command_uses_stable_device_path():
+    command = volumes.mount_command("factorio-data", "/opt/factorio")
+    assert "/dev/disk/by-id/scsi-0DO_Volume_factorio-data" in command
+    assert "/etc/fstab" in command
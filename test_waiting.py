@@ -0,0 +1,83 @@
+"""
+Unit tests for adaptive waiting, with a fake clock
+"""
+import digitalocean
+import pytest
+
+import waiting
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeAction(object):
+    def __init__(self, statuses):
+        self.id = 7
+        self.type = "create"
+        self.statuses = list(statuses)
+        self.status = None
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        self.status = self.statuses.pop(0)
+
+
+def test_poll_intervals_back_off_to_a_cap():
+    intervals = waiting.poll_intervals(first=1, factor=2, longest=5)
+    assert [next(intervals) for _ in range(5)] == [1, 2, 4, 5, 5]
+
+
+def test_wait_for_returns_value_and_timing():
+    clock = FakeClock()
+    values = iter([None, None, "10.0.0.1"])
+    waited = waiting.wait_for(
+        lambda: next(values), first=1, factor=2, sleep=clock.sleep, clock=clock
+    )
+    assert waited.value == "10.0.0.1"
+    assert (waited.seconds, waited.polls) == (3, 3)
+    assert clock.sleeps == [1, 2]
+
+
+def test_wait_for_gives_up_at_the_deadline():
+    clock = FakeClock()
+    with pytest.raises(waiting.WaitTimedOut):
+        waiting.wait_for(
+            lambda: None, timeout=10, first=4, sleep=clock.sleep, clock=clock
+        )
+    assert clock.now == 10
+
+
+def test_wait_for_action_follows_status():
+    clock = FakeClock()
+    action = FakeAction(["in-progress", "in-progress", "completed"])
+    waited = waiting.wait_for_action(action, sleep=clock.sleep, clock=clock)
+    assert waited.value is action and action.loads == 3
+
+    with pytest.raises(waiting.ActionFailed):
+        waiting.wait_for_action(
+            FakeAction(["in-progress", "errored"]), sleep=clock.sleep, clock=clock
+        )
+
+
+def test_wait_until_gone():
+    clock = FakeClock()
+    remaining = [True, True]
+
+    def load():
+        if not remaining:
+            raise digitalocean.NotFoundError()
+        remaining.pop()
+
+    waited = waiting.wait_until_gone(load, sleep=clock.sleep, clock=clock)
+    assert waited.polls == 3
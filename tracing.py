@@ -0,0 +1,334 @@
+"""
+Timed spans for where an action's time goes: DigitalOcean calls, SSH commands,
+S3 requests, waits and retries, each with attributes such as the bytes moved,
+the attempt number or the exit status. Commands are only recorded as a
+``digest``, as they can carry credentials and presigned URLs.
+
+A request starts a trace, and spans started while it's current (on the same
+thread, or on one given a copy of its context) belong to it. Spans are
+aggregated by name for a summary, and in sampled traces each one is also
+written out as a line of JSON as it ends. Outside a trace, spans cost a
+context variable lookup and record nothing, which is what ``enabled=False``
+leaves everywhere.
+"""
+
+import contextvars
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# longer attribute values, e.g. commands carrying a whole script, are cut short
+MAX_ATTRIBUTE_LENGTH = 200
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+class TracingException(Exception):
+    """ Base Exception class for file """
+
+
+def digest(text: str) -> str:
+    """ Tells apart what spans must not record, e.g. commands, without saying it """
+    return hashlib.sha256(text.encode()).hexdigest()[:12]
+
+
+def _shorten(value):
+    if isinstance(value, str) and len(value) > MAX_ATTRIBUTE_LENGTH:
+        return value[:MAX_ATTRIBUTE_LENGTH] + "..."
+    return value
+
+
+class Span(object):
+    """ One timed operation, ended by ``end`` or by leaving ``span`` """
+
+    def __init__(self, trace, name: str, parent_id=None, **attributes):
+        self.trace = trace
+        self.name = name
+        self.id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = {}
+        self.error = None
+        self.seconds = None
+        self.start = trace.clock()
+        self.set(**attributes)
+
+    def set(self, **attributes):
+        self.attributes.update(
+            (name, _shorten(value)) for name, value in attributes.items()
+        )
+
+    def end(self, error=None, **attributes):
+        """ Records the span, failed if there's an ``error`` (or its message) """
+        if self.seconds is not None:
+            return
+        self.set(**attributes)
+        if isinstance(error, BaseException):
+            self.error = f"{type(error).__name__}: {error}"
+        elif error is not None:
+            self.error = str(error)
+        self.seconds = self.trace.clock() - self.start
+        self.trace.record(self)
+
+
+class _NoSpan(object):
+    """ What spans are outside a trace: nothing """
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, error=None, **attributes):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+class SpanStats(object):
+    """ Totals for the spans of one name """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.longest = 0.0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+
+    def add(self, span: Span):
+        self.count += 1
+        self.seconds += span.seconds
+        self.longest = max(self.longest, span.seconds)
+        self.errors += span.error is not None
+        self.retries += span.attributes.get("attempt", 1) > 1
+        self.bytes += span.attributes.get("bytes") or 0
+
+    def as_dict(self) -> dict:
+        stats = {
+            "count": self.count,
+            "seconds": round(self.seconds, 3),
+            "longest": round(self.longest, 3),
+        }
+        stats.update(
+            (name, getattr(self, name))
+            for name in ("errors", "retries", "bytes")
+            if getattr(self, name)
+        )
+        return stats
+
+
+class Trace(object):
+    """
+    The spans of one request. All of them are totted up by name; in a sampled
+    trace, those lasting at least ``min_seconds`` are each passed to ``emit``
+    as a line of JSON
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sampled: bool = True,
+        min_seconds: float = 0.0,
+        emit=print,
+        clock=time.monotonic,
+        **attributes,
+    ):
+        self.name = name
+        self.id = uuid.uuid4().hex
+        self.sampled = sampled
+        self.min_seconds = min_seconds
+        self.emit = emit
+        self.clock = clock
+        self.attributes = attributes
+        self.start = clock()
+        self.seconds = None
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, span: Span):
+        with self._lock:
+            self.stats.setdefault(span.name, SpanStats()).add(span)
+        if self.sampled and span.seconds >= self.min_seconds:
+            line = {
+                "trace_id": self.id,
+                "span_id": span.id,
+                "parent_id": span.parent_id,
+                "name": span.name,
+                "offset": round(span.start - self.start, 3),
+                "seconds": round(span.seconds, 3),
+            }
+            if span.error is not None:
+                line["error"] = span.error
+            line.update(span.attributes)
+            self.emit(json.dumps(line, default=str))
+
+    def summary(self) -> dict:
+        """ Spans totalled by name, slowest first """
+        with self._lock:
+            spans = sorted(
+                self.stats.items(), key=lambda item: item[1].seconds, reverse=True
+            )
+            return {
+                "trace_id": self.id,
+                "name": self.name,
+                "seconds": round(self.seconds or self.clock() - self.start, 3),
+                "spans": {name: stats.as_dict() for name, stats in spans},
+            }
+
+
+@contextmanager
+def trace(
+    name: str,
+    enabled: bool = True,
+    sample_rate: float = 1.0,
+    min_ms: float = 0,
+    emit=print,
+    **attributes,
+):
+    """
+    Makes a new trace current for the block, yielding it, or None when not
+    ``enabled``. A ``sample_rate`` of a trace's spans are written out, and
+    its summary at the end
+    """
+    if not enabled:
+        yield None
+        return
+    current = Trace(
+        name,
+        sampled=random.random() < sample_rate,
+        min_seconds=min_ms / 1000,
+        emit=emit,
+        **attributes,
+    )
+    trace_token, span_token = _trace.set(current), _span.set(None)
+    try:
+        yield current
+    finally:
+        _span.reset(span_token)
+        _trace.reset(trace_token)
+        current.seconds = current.clock() - current.start
+        if current.sampled:
+            emit(json.dumps({"trace": current.summary(), **current.attributes}))
+
+
+def start_span(name: str, **attributes):
+    """
+    A span under the current one, to be ended by the caller, e.g. from a
+    callback. Spans started here don't become current
+    """
+    current = _trace.get()
+    if current is None:
+        return NO_SPAN
+    parent = _span.get()
+    return Span(current, name, parent.id if parent else None, **attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """ Times the block as a span, current for spans started inside it """
+    started = start_span(name, **attributes)
+    if started is NO_SPAN:
+        yield started
+        return
+    token = _span.set(started)
+    try:
+        yield started
+    except BaseException as error:
+        started.end(error=error)
+        raise
+    finally:
+        _span.reset(token)
+        started.end()
+
+
+def annotate(**attributes):
+    """ Adds attributes to the current span, if there is one """
+    current = _span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def in_context(function):
+    """
+    ``function``, run in a copy of the current context, so spans it starts on
+    another thread belong to the current trace and span
+    """
+    context = contextvars.copy_context()
+
+    def bound(*args, **kwargs):
+        # a copy per call, as one context can't be entered by two threads
+        return context.copy().run(function, *args, **kwargs)
+
+    return bound
+
+
+def _size(body):
+    """ How many bytes a request body sends, or None if it can't be told """
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode())
+    try:
+        position = body.tell()
+        body.seek(0, 2)
+        end = body.tell()
+        body.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return end - position
+
+
+def instrument_boto3(client):
+    """ Times each of a boto3 client's API calls as an "s3"-style span """
+    service = client.meta.service_model.service_name
+    events = client.meta.events
+
+    def before_parameter_build(params, context, **_):
+        # the call's own parameters, which are serialized by "before-call"
+        context["tracing_attributes"] = {
+            "key": params.get("Key"),
+            "bytes": _size(params.get("Body")),
+        }
+
+    def before_call(model, context, **_):
+        context["tracing_span"] = start_span(
+            service,
+            operation=model.name,
+            **context.pop("tracing_attributes", {}),
+        )
+
+    def after_call(http_response, parsed, context, **_):
+        started = context.pop("tracing_span", NO_SPAN)
+        status = http_response.status_code
+        # what came back, for calls that return a body like GetObject's
+        if status < 300 and "Body" in parsed and parsed.get("ContentLength"):
+            started.set(bytes=parsed["ContentLength"])
+        started.end(status=status)
+
+    def after_call_error(exception, context, **_):
+        context.pop("tracing_span", NO_SPAN).end(error=exception)
+
+    events.register(f"before-parameter-build.{service}", before_parameter_build)
+    events.register(f"before-call.{service}", before_call)
+    events.register(f"after-call.{service}", after_call)
+    events.register(f"after-call-error.{service}", after_call_error)
+    return client
+
+
+def describe(summary: dict) -> str:
+    """ A trace summary as a few lines of text, for people """
+    lines = [f'Trace {summary["trace_id"]}: {summary["name"]} in {summary["seconds"]}s']
+    for name, stats in summary["spans"].items():
+        line = (
+            f'  {name}: {stats["count"]} in {stats["seconds"]}s'
+            f' (longest {stats["longest"]}s)'
+        )
+        for key in ("errors", "retries", "bytes"):
+            if key in stats:
+                line += f", {stats[key]} {key}"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,162 @@
+"""
+Droplet-side helpers for streaming app archives. Like ``chunkstore``, this runs
+on the droplet's system python3, so it only uses the standard library:
+
+    python3 transfer.py get <url> [--part-size N] [--workers N]
+    python3 transfer.py digest [--out FILE] [--field KEY=VALUE ...] [--expect SHA256]
+
+``get`` downloads an object (normally a presigned S3 URL) as parallel byte
+ranges and writes them to stdout in order, so the next stage of a pipeline can
+start on the first part while later ones are still in flight. ``digest`` passes
+a tar stream from stdin to stdout untouched while hashing each member's name,
+type and content, so an archive can be checksummed on its way into S3 and
+verified on its way back out without reading the tree a second time.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import tarfile
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+PART_SIZE = 8 * 1024 * 1024
+WORKERS = 8
+
+
+class TransferException(Exception):
+    """ Base Exception class for file """
+
+
+class DigestMismatch(TransferException):
+    """ The archive doesn't match the checksum recorded when it was made """
+
+
+class ShortRead(TransferException):
+    """ A ranged GET returned fewer bytes than requested """
+
+
+def fetch_range(url, start, end, retries=4):
+    """
+    GETs bytes ``start`` to ``end`` (inclusive) of ``url``, retrying with
+    backoff. Returns the bytes and the object's total size.
+    """
+    headers = {"Range": "bytes=%d-%d" % (start, end)}
+    request = urllib.request.Request(url, headers=headers)
+    for attempt in range(retries):
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                data = response.read()
+                content_range = response.headers.get("Content-Range", "")
+            size = int(content_range.rsplit("/", 1)[1]) if content_range else len(data)
+            if len(data) != min(end, size - 1) - start + 1:
+                raise ShortRead("Bytes %d-%d came back as %d" % (start, end, len(data)))
+            return data, size
+        except urllib.error.HTTPError as error:
+            # an empty object can't satisfy any range
+            if error.code == 416 and start == 0:
+                return b"", 0
+            if error.code < 500 or attempt == retries - 1:
+                raise
+        except (OSError, ShortRead):
+            if attempt == retries - 1:
+                raise
+        time.sleep(0.5 * 2 ** attempt)
+
+
+def ranged_get(url, out, part_size=PART_SIZE, workers=WORKERS):
+    """
+    Writes ``url`` to ``out`` in order while up to ``workers`` ranges download
+    at once. The first part also tells us the object's size, so no separate
+    HEAD is needed. At most ``2 * workers`` parts are held in memory.
+    """
+    data, size = fetch_range(url, 0, part_size - 1)
+    out.write(data)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        window = deque()
+        for start in range(part_size, size, part_size):
+            end = min(start + part_size, size) - 1
+            window.append(executor.submit(fetch_range, url, start, end))
+            if len(window) >= workers * 2:
+                out.write(window.popleft().result()[0])
+        while window:
+            out.write(window.popleft().result()[0])
+    out.flush()
+    return size
+
+
+class _Tee(object):
+    """ A readable file that copies everything read from it into ``sink`` """
+
+    def __init__(self, source, sink=None):
+        self.source = source
+        self.sink = sink
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        if self.sink is not None:
+            self.sink.write(data)
+        return data
+
+
+def archive_digest(source, sink=None):
+    """
+    sha256 over the members of the (uncompressed) tar stream ``source``, in
+    archive order. Everything read is copied to ``sink``, including tar's
+    end-of-archive padding.
+    """
+    tee = _Tee(source, sink)
+    digest = hashlib.sha256()
+    with tarfile.open(fileobj=tee, mode="r|") as archive:
+        for member in archive:
+            digest.update(member.name.encode() + b"\0" + member.type + b"\0")
+            if member.issym() or member.islnk():
+                digest.update(member.linkname.encode() + b"\0")
+            if member.isfile():
+                content = archive.extractfile(member)
+                while True:
+                    data = content.read(1024 * 1024)
+                    if not data:
+                        break
+                    digest.update(data)
+    while tee.read(1024 * 1024):
+        pass
+    if sink is not None:
+        sink.flush()
+    return digest.hexdigest()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command")
+    get_parser = commands.add_parser("get")
+    get_parser.add_argument("url")
+    get_parser.add_argument("--part-size", type=int, default=PART_SIZE)
+    get_parser.add_argument("--workers", type=int, default=WORKERS)
+    digest_parser = commands.add_parser("digest")
+    digest_parser.add_argument("--out")
+    digest_parser.add_argument("--field", action="append", default=[])
+    digest_parser.add_argument("--expect")
+    args = parser.parse_args(argv)
+
+    if args.command == "get":
+        ranged_get(args.url, sys.stdout.buffer, args.part_size, args.workers)
+    elif args.command == "digest":
+        digest = archive_digest(sys.stdin.buffer, sys.stdout.buffer)
+        if args.out:
+            metadata = dict(field.split("=", 1) for field in args.field)
+            metadata["sha256"] = digest
+            with open(args.out, "w") as f:
+                json.dump(metadata, f)
+        if args.expect and args.expect != digest:
+            raise DigestMismatch("Expected %s, got %s" % (args.expect, digest))
+    else:
+        parser.error("a command is required")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,27 @@
 import digitalocean
 import argparse
 
+import doclient
+import fleet
 import settings
 
+doclient.install(
+    burst=settings.DO_API_BURST,
+    rate_per_minute=settings.DO_API_RATE_PER_MINUTE,
+    max_retries=settings.DO_API_MAX_RETRIES,
+)
 manager = digitalocean.Manager(token=settings.DIGITALOCEAN_API_TOKEN)
 
 
 def kill_droplets():
     """ Kill all droplets on this account """
-    droplets = manager.get_all_droplets()
-    for droplet in droplets:
-        droplet.destroy()
+    droplets = {str(droplet.id): droplet for droplet in manager.get_all_droplets()}
+    results = fleet.run(
+        droplets,
+        lambda droplet_id: droplets[droplet_id].destroy() and "Destroyed",
+        settings.FLEET_PARALLELISM,
+    )
+    print(fleet.summary("kill", results))
 
 def kill_keys():
     keys = manager.get_all_sshkeys()
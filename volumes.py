@@ -0,0 +1,123 @@
+"""
+DigitalOcean block storage volumes that keep an app's files across droplets
+"""
+
+import shlex
+
+import digitalocean
+
+import waiting
+
+
+class VolumeException(Exception):
+    """ Base Exception class for file """
+
+
+class MultipleVolumesFound(VolumeException):
+    """ Too many volumes were found for this app """
+
+
+class VolumeNotAttached(VolumeException):
+    """ The volume hasn't shown up on the droplet yet """
+
+
+def device_path(name: str) -> str:
+    """ Where DigitalOcean exposes an attached volume on the droplet """
+    return f"/dev/disk/by-id/scsi-0DO_Volume_{name}"
+
+
+def find_volume(manager, name: str, region: str):
+    """ The volume called ``name`` in ``region``, or None """
+    volumes = [v for v in manager.get_all_volumes(region=region) if v.name == name]
+    if len(volumes) > 1:
+        raise MultipleVolumesFound
+    return volumes[0] if volumes else None
+
+
+def ensure_volume(
+    manager,
+    token: str,
+    name: str,
+    region: str,
+    size_gigabytes: int,
+    volume_class=digitalocean.Volume,
+):
+    """ Finds the app's volume, creating it (formatted as ext4) if needed """
+    volume = find_volume(manager, name, region)
+    if volume is None:
+        volume = volume_class(
+            token=token,
+            name=name,
+            region=region,
+            size_gigabytes=size_gigabytes,
+            filesystem_type="ext4",
+            description="auto_server app data",
+        )
+        volume.create()
+    return volume
+
+
+def wait_until_attached(volume, droplet_id: int, **options):
+    """ Polls the volume until DigitalOcean lists it on ``droplet_id`` """
+
+    def check():
+        volume.load()
+        return volume if droplet_id in (volume.droplet_ids or []) else None
+
+    options.setdefault("timeout", 60)
+    try:
+        return waiting.wait_for(check, **options).value
+    except waiting.WaitTimedOut:
+        raise VolumeNotAttached(f"{volume.name} isn't attached to {droplet_id}")
+
+
+def attach(volume, droplet_id: int, region: str, **options):
+    """
+    Attaches ``volume`` to ``droplet_id`` unless it already is, following the
+    attach action when DigitalOcean returns one
+    """
+    if droplet_id in (volume.droplet_ids or []):
+        return volume
+    response = volume.attach(droplet_id, region)
+    if isinstance(response, dict) and "action" in response:
+        action = waiting.action_for(volume.token, response["action"]["id"])
+        waiting.wait_for_action(action, **options)
+    return wait_until_attached(volume, droplet_id, **options)
+
+
+def detach(volume, droplet_id: int, region: str, **options):
+    """ Detaches ``volume`` from ``droplet_id``, waiting until it's done """
+    response = volume.detach(droplet_id, region)
+    if isinstance(response, dict) and "action" in response:
+        action = waiting.action_for(volume.token, response["action"]["id"])
+        waiting.wait_for_action(action, **options)
+    return volume
+
+
+def mount_command(name: str, mount_point: str) -> str:
+    """ Mounts the volume at ``mount_point``, now and on every boot """
+    device = shlex.quote(device_path(name))
+    mount_point = shlex.quote(mount_point)
+    options = "defaults,nofail,discard,noatime"
+    mount = f"mount -o {options} {device} {mount_point}"
+    return (
+        f"mkdir -p {mount_point}"
+        f" && (mountpoint -q {mount_point} || {mount})"
+        f" && (grep -q {device} /etc/fstab"
+        f" || echo '{device} {mount_point} ext4 {options} 0 2' >> /etc/fstab)"
+    )
+
+
+def unmount_command(mount_point: str) -> str:
+    """ Flushes and unmounts the volume so it can be detached cleanly """
+    mount_point = shlex.quote(mount_point)
+    return f"sync && (! mountpoint -q {mount_point} || umount {mount_point})"
+
+
+def if_empty_command(mount_point: str, command: str) -> str:
+    """ Runs ``command`` only when the volume holds no app files yet """
+    mount_point = shlex.quote(mount_point)
+    return (
+        f'[ -n "$(ls -A {mount_point} | grep -v "^lost+found$")" ]'
+        f" || ( {command} )"
+    )
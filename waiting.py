@@ -0,0 +1,103 @@
+"""
+Waiting on DigitalOcean: following an action to completion, or polling until
+a resource reaches some state. Polls are quick at first, when most waits end,
+and back off towards ``longest`` for slow ones, up to a deadline.
+"""
+
+import time
+
+import lazy
+import tracing
+
+digitalocean = lazy.module("digitalocean")
+
+
+class WaitException(Exception):
+    """ Base Exception class for file """
+
+
+class WaitTimedOut(WaitException):
+    """ The deadline passed before the wait was over """
+
+
+class ActionFailed(WaitException):
+    """ DigitalOcean reported the action as errored """
+
+
+class Waited(object):
+    """ What a wait ended with, how long it took and how many polls it made """
+
+    def __init__(self, value, seconds: float, polls: int):
+        self.value = value
+        self.seconds = seconds
+        self.polls = polls
+
+    def __repr__(self):
+        return f"<Waited {self.seconds:.1f}s, {self.polls} polls: {self.value!r}>"
+
+
+def poll_intervals(first: float = 0.5, factor: float = 1.5, longest: float = 10.0):
+    """ 0.5, 0.75, 1.125, ... seconds, growing to ``longest`` """
+    interval = first
+    while True:
+        yield interval
+        interval = min(longest, interval * factor)
+
+
+def wait_for(
+    check,
+    timeout: float = 300,
+    description: str = "DigitalOcean",
+    first: float = 0.5,
+    factor: float = 1.5,
+    longest: float = 10.0,
+    sleep=time.sleep,
+    clock=time.monotonic,
+) -> Waited:
+    """ Calls ``check`` until it returns something other than None """
+    start = clock()
+    polls = 0
+    with tracing.span("wait", description=description) as span:
+        for interval in poll_intervals(first, factor, longest):
+            polls += 1
+            span.set(polls=polls)
+            value = check()
+            if value is not None:
+                return Waited(value, clock() - start, polls)
+            remaining = start + timeout - clock()
+            if remaining <= 0:
+                raise WaitTimedOut(
+                    f"Gave up waiting for {description} after {timeout}s"
+                )
+            sleep(min(interval, remaining))
+
+
+def action_for(token: str, action_id: int):
+    """ An action to follow, from the ID in a response or ``action_ids`` """
+    return digitalocean.Action(token=token, id=action_id)
+
+
+def wait_for_action(action, **options) -> Waited:
+    """ Polls ``action`` until it completes, raising if it errors """
+
+    def check():
+        action.load()
+        if action.status == "errored":
+            raise ActionFailed(f"{action.type} action {action.id} errored")
+        return action if action.status == "completed" else None
+
+    options.setdefault("description", f"action {action.id}")
+    return wait_for(check, **options)
+
+
+def wait_until_gone(load, **options) -> Waited:
+    """ Calls ``load`` until it raises ``digitalocean.NotFoundError`` """
+
+    def check():
+        try:
+            load()
+        except digitalocean.NotFoundError:
+            return True
+        return None
+
+    return wait_for(check, **options)